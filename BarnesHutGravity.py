@@ -0,0 +1,251 @@
+import time
+
+import numpy
+
+from DirectGravity import DirectGravity
+from WorldObject import G
+
+
+# Bits per axis in the Morton keys, and so the deepest level of the octree
+MAX_DEPTH = 21
+
+
+def _spreadBits(values):
+    # Spread the low 21 bits of each value out so that there are two zero
+    # bits between each of them, ready for interleaving into a Morton key.
+    values = values.astype(numpy.uint64) & numpy.uint64(0x1fffff)
+    values = (values | (values << numpy.uint64(32))) & numpy.uint64(0x1f00000000ffff)
+    values = (values | (values << numpy.uint64(16))) & numpy.uint64(0x1f0000ff0000ff)
+    values = (values | (values << numpy.uint64(8))) & numpy.uint64(0x100f00f00f00f00f)
+    values = (values | (values << numpy.uint64(4))) & numpy.uint64(0x10c30c30c30c30c3)
+    values = (values | (values << numpy.uint64(2))) & numpy.uint64(0x1249249249249249)
+    return values
+
+
+def _expandRanges(starts, counts):
+    # For each i, the integers starts[i] .. starts[i] + counts[i] - 1, all
+    # concatenated, along with the index i that each one came from.
+    owners = numpy.repeat(numpy.arange(len(counts)), counts)
+    offsets = numpy.arange(len(owners)) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    return owners, starts[owners] + offsets
+
+
+class Octree(object):
+
+    def __init__(self, locations, masses, leafSize):
+        corner = locations.min(axis=0)
+        size = (locations.max(axis=0) - corner).max() * (1 + 1e-9)
+        if size == 0:
+            size = 1.0
+
+        cells = numpy.floor((locations - corner) / size * 2 ** MAX_DEPTH)
+        cells = numpy.clip(cells, 0, 2 ** MAX_DEPTH - 1)
+        keys = (
+            _spreadBits(cells[:, 0]) << numpy.uint64(2) |
+            _spreadBits(cells[:, 1]) << numpy.uint64(1) |
+            _spreadBits(cells[:, 2])
+        )
+
+        # Sorting by Morton key puts the bodies in every node of the tree
+        # into one contiguous run, so a node is just a range of bodies.
+        self.order = numpy.argsort(keys, kind="mergesort")
+        keys = keys[self.order]
+        self.locations = locations[self.order]
+        self.masses = masses[self.order]
+        count = len(keys)
+
+        weighted = self.locations * self.masses[:, numpy.newaxis]
+
+        starts = []
+        ends = []
+        sizes = []
+        leaves = []
+        firstChildren = []
+        lastChildren = []
+
+        levelStarts = numpy.array([0])
+        nodeCount = 0
+        for level in range(MAX_DEPTH + 1):
+            if level > 0:
+                prefixes = keys >> numpy.uint64(3 * (MAX_DEPTH - level))
+                levelStarts = numpy.concatenate(([0], numpy.flatnonzero(prefixes[1:] != prefixes[:-1]) + 1))
+                # Hook the previous level's nodes up to their children now we
+                # know where they are.
+                nodeCount += len(starts[-1])
+                firstChildren[-1] += nodeCount + numpy.searchsorted(levelStarts, starts[-1])
+                lastChildren[-1] += nodeCount + numpy.searchsorted(levelStarts, ends[-1])
+
+            levelEnds = numpy.append(levelStarts[1:], count)
+            levelLeaves = (levelEnds - levelStarts <= leafSize) | (level == MAX_DEPTH)
+
+            starts.append(levelStarts)
+            ends.append(levelEnds)
+            sizes.append(numpy.repeat(size / 2 ** level, len(levelStarts)))
+            leaves.append(levelLeaves)
+            firstChildren.append(numpy.zeros(len(levelStarts), dtype=numpy.intp))
+            lastChildren.append(numpy.zeros(len(levelStarts), dtype=numpy.intp))
+
+            if levelLeaves.all():
+                break
+
+        self.starts = numpy.concatenate(starts)
+        self.ends = numpy.concatenate(ends)
+        self.sizes = numpy.concatenate(sizes)
+        self.leaves = numpy.concatenate(leaves)
+        self.firstChildren = numpy.concatenate(firstChildren)
+        self.lastChildren = numpy.concatenate(lastChildren)
+
+        self.nodeMasses = numpy.add.reduceat(self.masses, self.starts)
+        weightedSums = numpy.add.reduceat(weighted, self.starts, axis=0)
+        # Massless nodes don't attract anything, but they still need somewhere
+        # sensible to be for the opening test.
+        geometricCentres = numpy.add.reduceat(self.locations, self.starts, axis=0) / (self.ends - self.starts)[:, numpy.newaxis]
+        massive = self.nodeMasses > 0
+        self.centresOfMass = geometricCentres
+        self.centresOfMass[massive] = weightedSums[massive] / self.nodeMasses[massive][:, numpy.newaxis]
+
+
+class BarnesHutGravity(object):
+
+    # Bodies traversing the tree at once; bounds the size of the
+    # interaction lists we build.
+    blockSize = 4096
+
+    def __init__(self, theta=0.5, leafSize=8):
+        self.theta = theta
+        self.leafSize = leafSize
+
+
+    def _accumulate(self, accelerations, bodies, displacements, masses):
+        # a = GM/r**2 towards the attractor, so GM * d / r**3 where d points
+        # from the body to the attractor.
+        distancesSquared = (displacements ** 2).sum(axis=1)
+        weights = masses / (distancesSquared * numpy.sqrt(distancesSquared))
+        for axis in range(3):
+            accelerations[:, axis] += numpy.bincount(
+                bodies, weights=displacements[:, axis] * weights, minlength=len(accelerations)
+            )
+
+
+    def _traverse(self, tree, locations, selves):
+        # Accelerations of bodies at locations, each of which is body number
+        # selves[i] in the tree's order, or -1 if it's not in the tree.
+        count = len(locations)
+        accelerations = numpy.zeros((count, 3), dtype=numpy.float64)
+        thetaSquared = self.theta ** 2
+
+        # Each (body, node) pair is a node that the body still has to decide
+        # whether to open.  Everything starts at the root.
+        bodies = numpy.arange(count)
+        nodes = numpy.zeros(count, dtype=numpy.intp)
+        while len(bodies):
+            displacements = tree.centresOfMass[nodes] - locations[bodies]
+            distancesSquared = (displacements ** 2).sum(axis=1)
+            containsBody = (tree.starts[nodes] <= selves[bodies]) & (selves[bodies] < tree.ends[nodes])
+            accept = ~containsBody & (tree.sizes[nodes] ** 2 < thetaSquared * distancesSquared)
+
+            self._accumulate(accelerations, bodies[accept], displacements[accept], tree.nodeMasses[nodes[accept]])
+
+            rejected = ~accept
+            atLeaf = rejected & tree.leaves[nodes]
+            toOpen = rejected & ~tree.leaves[nodes]
+
+            # Leaves that are too close get summed body by body
+            leafBodies = bodies[atLeaf]
+            leafNodes = nodes[atLeaf]
+            owners, attractors = _expandRanges(tree.starts[leafNodes], tree.ends[leafNodes] - tree.starts[leafNodes])
+            pairBodies = leafBodies[owners]
+            notSelf = selves[pairBodies] != attractors
+            pairBodies = pairBodies[notSelf]
+            attractors = attractors[notSelf]
+            self._accumulate(
+                accelerations, pairBodies,
+                tree.locations[attractors] - locations[pairBodies], tree.masses[attractors]
+            )
+
+            # ...and everything else gets pushed down to the node's children
+            openBodies = bodies[toOpen]
+            openNodes = nodes[toOpen]
+            owners, nodes = _expandRanges(
+                tree.firstChildren[openNodes], tree.lastChildren[openNodes] - tree.firstChildren[openNodes]
+            )
+            bodies = openBodies[owners]
+
+        return accelerations
+
+
+    def accelerations(self, locations, masses, sources=None):
+        # As for DirectGravity: only sources go into the tree, but every
+        # body is pulled on by it.
+        count = len(masses)
+        if sources is None:
+            sources = numpy.arange(count)
+        if count < 2 or not len(sources):
+            return numpy.zeros((count, 3), dtype=numpy.float64)
+
+        # Meters again, for G
+        locations = locations * 1000
+        tree = Octree(locations[sources], numpy.asarray(masses, dtype=numpy.float64)[sources], self.leafSize)
+        selves = numpy.empty(count, dtype=numpy.intp)
+        selves.fill(-1)
+        selves[sources[tree.order]] = numpy.arange(len(sources))
+
+        accelerations = numpy.empty((count, 3), dtype=numpy.float64)
+        for first in range(0, count, self.blockSize):
+            last = min(first + self.blockSize, count)
+            accelerations[first:last] = self._traverse(tree, locations[first:last], selves[first:last])
+
+        # Back to km
+        return G * accelerations / 1000
+
+
+def errorReport(locations, masses, thetas=(0.2, 0.35, 0.5, 0.7, 1.0)):
+    started = time.time()
+    exact = DirectGravity().accelerations(locations, masses)
+    directTime = time.time() - started
+    exactMagnitudes = numpy.sqrt((exact ** 2).sum(axis=1))
+
+    rows = []
+    for theta in thetas:
+        started = time.time()
+        approximate = BarnesHutGravity(theta).accelerations(locations, masses)
+        elapsed = time.time() - started
+        errors = numpy.sqrt(((approximate - exact) ** 2).sum(axis=1)) / exactMagnitudes
+        rows.append({
+            "theta": theta,
+            "seconds": elapsed,
+            "directSeconds": directTime,
+            "speedup": directTime / elapsed,
+            "medianError": numpy.median(errors),
+            "p99Error": numpy.percentile(errors, 99),
+            "maxError": errors.max(),
+        })
+    return rows
+
+
+def _asteroidBelt(count, seed=0):
+    # A Sun-like mass with a thick belt of small bodies around it, in km
+    random = numpy.random.RandomState(seed)
+    radii = random.uniform(3.3e8, 4.8e8, count)
+    angles = random.uniform(0, 2 * numpy.pi, count)
+    locations = numpy.column_stack((
+        radii * numpy.cos(angles), radii * numpy.sin(angles), random.normal(0, 2e7, count)
+    ))
+    masses = 10 ** random.uniform(12, 20, count)
+    locations[0] = 0
+    masses[0] = 1.9891 * 10**30
+    return locations, masses
+
+
+if __name__ == '__main__':
+    import sys
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    locations, masses = _asteroidBelt(count)
+    print "%d bodies" % count
+    print "%6s %10s %10s %8s %12s %12s %12s" % ("theta", "bh (s)", "direct (s)", "speedup", "median err", "p99 err", "max err")
+    for row in errorReport(locations, masses):
+        print "%6.2f %10.3f %10.3f %8.1f %12.2e %12.2e %12.2e" % (
+            row["theta"], row["seconds"], row["directSeconds"], row["speedup"],
+            row["medianError"], row["p99Error"], row["maxError"]
+        )
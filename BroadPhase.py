@@ -0,0 +1,291 @@
+import numpy
+
+
+class BroadPhase(object):
+
+    # Finds which bodies are touching, or close enough to one another to
+    # care, without checking every pair.  Each body gets an axis-aligned
+    # box around the sphere it sweeps out over a step, and the boxes are
+    # kept sorted by their lower x bound ("sweep and prune"): then only
+    # pairs whose boxes overlap along x, which is a handful, need looking
+    # at any more closely.  Bodies barely move between steps, so the order
+    # from last time is almost right, and re-sorting it is close to a
+    # linear pass.
+    #
+    # Pairs are reported as (i, j), i < j, indexes into the engine's
+    # arrays.  Two bodies are in contact when their spheres overlap, and
+    # near one another when they're within the larger of their two margins
+    # of touching.  The check follows each pair over the whole step, so
+    # something moving fast can't skip through something else in one go;
+    # given velocities it follows the curve through both ends, since at a
+    # high time warp a step can be a good part of an orbit, and the straight
+    # line across would cut through the planet underneath.
+
+    # Points along each pair's path that the check goes through
+    pathSamples = 16
+
+    # Shortest distance between the ends of a step, as a fraction of the
+    # distance travelled, for which we'll believe the path in between;
+    # 0.9 is a quarter of a circular orbit.
+    trustedChord = 0.9
+
+
+    def __init__(self, radii, margins=None):
+        self.radii = numpy.asarray(radii, dtype=numpy.float64)
+        count = len(self.radii)
+        if margins is None:
+            margins = numpy.zeros(count)
+        self.margins = numpy.asarray(margins, dtype=numpy.float64)
+
+        self.order = numpy.arange(count)
+        self.previous = None
+        self.previousVelocities = None
+        self.locations = None
+        self.velocities = None
+        self.interval = 0.0
+        self.jumped = None
+        self.lows = None
+        self.highs = None
+        self.sortedLows = None
+        self.maxWidth = 0.0
+
+        # Pairs as they stood after the last update, as (n, 2) arrays
+        self.contacts = numpy.zeros((0, 2), dtype=numpy.int64)
+        self.nearby = numpy.zeros((0, 2), dtype=numpy.int64)
+
+
+    def update(self, locations, velocities=None, interval=0.0, jumped=None):
+        # Call after every step with where everything is now and, ideally,
+        # how fast it's going and how long the step was.  jumped, if given,
+        # is a boolean mask of the bodies that were put where they are
+        # rather than travelling there, which are only checked where they
+        # ended up.  Returns the events since last time, as a list of
+        # (kind, i, j): "contact" when two bodies touch, "approach" when
+        # they come within range and "depart" when they leave it again.
+        locations = numpy.array(locations, dtype=numpy.float64)
+        if velocities is not None:
+            velocities = numpy.array(velocities, dtype=numpy.float64)
+        previous, previousVelocities = self.locations, self.velocities
+        if previous is None or len(previous) != len(locations):
+            previous, previousVelocities = locations, None
+        if jumped is not None and previous is not locations and jumped.any():
+            jumped = numpy.array(jumped, dtype=bool)
+            previous = previous.copy()
+            previous[jumped] = locations[jumped]
+            if previousVelocities is not None and velocities is not None:
+                previousVelocities = previousVelocities.copy()
+                previousVelocities[jumped] = velocities[jumped]
+        else:
+            jumped = None
+        self.jumped = jumped
+        self.previous, self.previousVelocities = previous, previousVelocities
+        self.locations, self.velocities = locations, velocities
+        self.interval = interval
+
+        # The boxes cover both ends of the step, and however far the path
+        # between them bows out: about the change in velocity times the
+        # step over eight, as it would be under constant acceleration.
+        extents = self.radii + self.margins
+        if self._curved():
+            extents = extents + numpy.sqrt(((velocities - previousVelocities) ** 2).sum(axis=1)) * interval / 8
+        extents = extents[:, numpy.newaxis]
+        self.lows = numpy.minimum(previous, locations) - extents
+        self.highs = numpy.maximum(previous, locations) + extents
+        self.maxWidth = (self.highs[:, 0] - self.lows[:, 0]).max() if len(locations) else 0.0
+        self._sort()
+
+        first, second = self._candidates()
+        contacts, nearby = self._narrowPhase(first, second)
+
+        events = (
+            [("contact", i, j) for i, j in self._added(self.contacts, contacts)] +
+            [("approach", i, j) for i, j in self._added(self.nearby, nearby)] +
+            [("depart", i, j) for i, j in self._added(nearby, self.nearby)]
+        )
+        self.contacts = contacts
+        self.nearby = nearby
+        return events
+
+
+    def _sort(self):
+        keys = self.lows[:, 0]
+        if len(self.order) != len(keys):
+            self.order = numpy.argsort(keys, kind="mergesort")
+        else:
+            sortedKeys = keys[self.order]
+            if (sortedKeys[1:] < sortedKeys[:-1]).any():
+                self.order = self.order[numpy.argsort(sortedKeys, kind="mergesort")]
+        self.sortedLows = keys[self.order]
+        self.ranks = numpy.empty_like(self.order)
+        self.ranks[self.order] = numpy.arange(len(self.order))
+
+
+    def _candidates(self):
+        # Every pair whose boxes overlap.  Along x, body number r in sorted
+        # order overlaps everything after it up to the first one whose box
+        # starts beyond the end of its own.
+        count = len(self.order)
+        sortedHighs = self.highs[self.order, 0]
+        ends = numpy.searchsorted(self.sortedLows, sortedHighs, "right")
+        counts = ends - numpy.arange(count) - 1
+        total = counts.sum()
+        firstRanks = numpy.repeat(numpy.arange(count), counts)
+        offsets = numpy.arange(total) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        first = self.order[firstRanks]
+        second = self.order[firstRanks + 1 + offsets]
+
+        overlapping = (
+            (self.lows[first, 1:] <= self.highs[second, 1:]) &
+            (self.lows[second, 1:] <= self.highs[first, 1:])
+        ).all(axis=1)
+        first, second = first[overlapping], second[overlapping]
+        return numpy.minimum(first, second), numpy.maximum(first, second)
+
+
+    def _curved(self):
+        return self.velocities is not None and self.previousVelocities is not None and self.interval > 0
+
+
+    def _paths(self, first, second):
+        # Where second was relative to first at pathSamples + 1 points over
+        # the step, as (pairs, points, 3), and which of the pairs the path
+        # can be trusted for.  With velocities at both ends, it's the cubic
+        # through both ends with those velocities, which is good until the
+        # step is a large part of an orbit.  Past about a quarter of one,
+        # when the ends are much closer together than the distance
+        # travelled, only the ends are known for sure, as they are for
+        # anything that jumped.
+        fractions = numpy.linspace(0, 1, self.pathSamples + 1)[numpy.newaxis, :, numpy.newaxis]
+        start = (self.previous[second] - self.previous[first])[:, numpy.newaxis, :]
+        end = (self.locations[second] - self.locations[first])[:, numpy.newaxis, :]
+        trusted = numpy.ones(len(first), dtype=bool)
+        if self.jumped is not None:
+            trusted = ~(self.jumped[first] | self.jumped[second])
+        if not self._curved():
+            return start + fractions * (end - start), trusted
+
+        startVelocity = (self.previousVelocities[second] - self.previousVelocities[first]) * self.interval
+        endVelocity = (self.velocities[second] - self.velocities[first]) * self.interval
+        squared, cubed = fractions ** 2, fractions ** 3
+        paths = (
+            (2 * cubed - 3 * squared + 1) * start +
+            (cubed - 2 * squared + fractions) * startVelocity[:, numpy.newaxis, :] +
+            (3 * squared - 2 * cubed) * end +
+            (cubed - squared) * endVelocity[:, numpy.newaxis, :]
+        )
+        chords = numpy.sqrt(((end - start)[:, 0] ** 2).sum(axis=1))
+        travelled = numpy.maximum(
+            numpy.sqrt((startVelocity ** 2).sum(axis=1)), numpy.sqrt((endVelocity ** 2).sum(axis=1))
+        )
+        return paths, trusted & (chords >= self.trustedChord * travelled)
+
+
+    def _closest(self, paths):
+        # The closest approach along each path, and how far along each of
+        # its segments that came
+        segmentStarts = paths[:, :-1]
+        segments = paths[:, 1:] - segmentStarts
+        lengthsSquared = (segments ** 2).sum(axis=2)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            fractions = numpy.clip(-(segmentStarts * segments).sum(axis=2) / lengthsSquared, 0, 1)
+        fractions[lengthsSquared == 0] = 0
+        distances = numpy.sqrt(((segmentStarts + fractions[:, :, numpy.newaxis] * segments) ** 2).sum(axis=2))
+        return distances.min(axis=1) if distances.size else numpy.zeros(len(paths))
+
+
+    def _narrowPhase(self, first, second):
+        # The closest each pair got over the step
+        paths, trusted = self._paths(first, second)
+        closest = self._closest(paths)
+        ends = numpy.sqrt((paths[:, [0, -1]] ** 2).sum(axis=2)).min(axis=1)
+        closest[~trusted] = ends[~trusted]
+
+        touching = self.radii[first] + self.radii[second]
+        inRange = touching + numpy.maximum(self.margins[first], self.margins[second])
+        pairs = numpy.column_stack((first, second))
+        return pairs[closest < touching], pairs[closest < inRange]
+
+
+    def _added(self, before, after):
+        # Pairs in after that weren't in before
+        if not len(after):
+            return []
+        if not len(before):
+            return [tuple(pair) for pair in after.tolist()]
+        count = len(self.radii)
+        new = numpy.in1d(after[:, 0] * count + after[:, 1], before[:, 0] * count + before[:, 1], invert=True)
+        return [tuple(pair) for pair in after[new].tolist()]
+
+
+    def partners(self, index, pairs):
+        # Everything paired with body number index in pairs, which is
+        # contacts or nearby
+        return numpy.concatenate((pairs[pairs[:, 0] == index, 1], pairs[pairs[:, 1] == index, 0]))
+
+
+    def contactNormal(self, index, other):
+        # Which way body number index was from other when they first
+        # touched during the last step, which is the way to push it back
+        # out even if it's gone most of the way through by now.
+        touching = self.radii[index] + self.radii[other]
+        paths, trusted = self._paths(numpy.array([other]), numpy.array([index]))
+        path = paths[0] if trusted[0] else paths[0, [0, -1]]
+        offset = path[-1]
+        for start, end in zip(path[:-1], path[1:]):
+            change = end - start
+            a = numpy.dot(change, change)
+            b = 2 * numpy.dot(start, change)
+            c = numpy.dot(start, start) - touching ** 2
+            if c <= 0:
+                offset = start
+                break
+            if a > 0 and b * b >= 4 * a * c:
+                fraction = (-b - numpy.sqrt(b * b - 4 * a * c)) / (2 * a)
+                if 0 <= fraction <= 1:
+                    offset = start + fraction * change
+                    break
+        length = numpy.linalg.norm(offset)
+        if length == 0:
+            return numpy.array((0., 0., 1.))
+        return offset / length
+
+
+    def nearest(self, index, count=1, candidates=None):
+        # The count bodies whose surfaces are closest to the centre of body
+        # number index, nearest first, as (indexes, surface distances), as
+        # of the last update.  candidates is a boolean mask of which bodies
+        # to consider.  Searches outwards from index in the sorted order,
+        # in windows that double each time, until nothing further along
+        # can possibly be closer than what's been found.
+        if self.locations is None:
+            return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0)
+        total = len(self.order)
+        x = self.locations[index, 0]
+        rank = self.ranks[index]
+        low, high = rank, rank
+        window = 32
+        found = numpy.zeros(0, dtype=numpy.int64)
+        distances = numpy.zeros(0)
+        while True:
+            newLow, newHigh = max(low - window, 0), min(high + window, total)
+            batch = numpy.concatenate((self.order[newLow:low], self.order[high:newHigh]))
+            batch = batch[batch != index]
+            if candidates is not None:
+                batch = batch[candidates[batch]]
+            batchDistances = (
+                numpy.sqrt(((self.locations[batch] - self.locations[index]) ** 2).sum(axis=1)) - self.radii[batch]
+            )
+            found = numpy.concatenate((found, batch))
+            distances = numpy.concatenate((distances, batchDistances))
+            best = numpy.argsort(distances, kind="mergesort")[:count]
+            found, distances = found[best], distances[best]
+            low, high = newLow, newHigh
+            window *= 2
+
+            # Anything not looked at yet has a box that's at least this far
+            # away along x, and a surface no nearer than its box.
+            worst = distances[-1] if len(distances) == count else float("inf")
+            leftDone = low == 0 or x - self.sortedLows[low - 1] - self.maxWidth > worst
+            rightDone = high == total or self.sortedLows[high] - x > worst
+            if leftDone and rightDone:
+                return found, distances
@@ -0,0 +1,63 @@
+import math
+
+import numpy
+
+
+class Camera(object):
+
+    # What the UI is looking through this frame.  Locations handed to it
+    # are relative to the user's spaceship, which is what the camera orbits.
+
+    def __init__(self, fovV, resolution, distance, orientation, near=0.1, far=float("inf")):
+        self.fovV = fovV
+        self.width, self.height = resolution
+        self.distance = distance
+        self.orientation = orientation
+        self.near = near
+        self.far = far
+        # Pixels per unit of size at unit distance
+        self.pixelScale = (self.height / 2.) / math.tan(math.radians(fovV) / 2)
+
+
+    def eyeLocation(self):
+        # The view is translate(0, 0, -distance) * rotation, so the eye sits
+        # at the inverse rotation of (0, 0, distance).
+        return self.orientation.conjugate().rotate((0, 0, self.distance))
+
+
+    def projectedRadius(self, radius, relativeLocation):
+        eyeX, eyeY, eyeZ = self.eyeLocation()
+        x, y, z = relativeLocation
+        distance = math.sqrt((x - eyeX) ** 2 + (y - eyeY) ** 2 + (z - eyeZ) ** 2)
+        if distance <= radius:
+            return float("inf")
+        return radius / distance * self.pixelScale
+
+
+    def cull(self, radii, relativeLocations):
+        # Bounding spheres for a whole population at once.  Returns which of
+        # them touch the view frustum, and how many pixels in radius each
+        # would be.
+        rotation = numpy.array(self.orientation.rotationMatrix())
+        eyeSpace = numpy.dot(relativeLocations, rotation.T)
+        eyeSpace[:, 2] -= self.distance
+        # The camera looks down -z
+        depths = -eyeSpace[:, 2]
+
+        halfV = math.radians(self.fovV) / 2
+        halfH = math.atan(math.tan(halfV) * self.width / float(self.height))
+        x = numpy.abs(eyeSpace[:, 0])
+        y = numpy.abs(eyeSpace[:, 1])
+        # Signed distances outside the side planes; the sphere is in if it's
+        # less than its radius outside every one of them.
+        visible = (
+            (depths + radii > self.near) &
+            (depths - radii < self.far) &
+            (x * math.cos(halfH) - depths * math.sin(halfH) < radii) &
+            (y * math.cos(halfV) - depths * math.sin(halfV) < radii)
+        )
+
+        distances = numpy.sqrt((eyeSpace ** 2).sum(axis=1))
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            pixelRadii = numpy.where(distances > radii, radii / distances * self.pixelScale, numpy.inf)
+        return visible, pixelRadii
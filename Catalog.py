@@ -0,0 +1,120 @@
+import struct
+import sys
+
+import numpy
+
+
+MAGIC = "EXPCAT01"
+HEADER = struct.Struct("<8sQI")
+COLUMN = struct.Struct("<16s4sIQ")
+
+# Each column is contiguous in the file, starting on a boundary like this,
+# so that any one of them can be mapped and used as an array as it stands.
+ALIGNMENT = 64
+
+# name, dtype, values per body
+COLUMNS = (
+    ("masses", "<f8", 1),
+    ("locations", "<f8", 3),
+    ("velocities", "<f8", 3),
+    ("radii", "<f4", 1),
+    ("colors", "<f4", 3),
+)
+
+
+def writeCatalog(path, masses, locations, velocities, radii=None, colors=None):
+    # radii and colors are the render hints: how big each body is, in km,
+    # and what colour its marker should be.
+    count = len(masses)
+    if radii is None:
+        radii = numpy.zeros(count)
+    if colors is None:
+        colors = numpy.ones((count, 3))
+    data = {
+        "masses": masses, "locations": locations, "velocities": velocities,
+        "radii": radii, "colors": colors,
+    }
+
+    offset = HEADER.size + COLUMN.size * len(COLUMNS)
+    layout = []
+    for name, dtype, width in COLUMNS:
+        offset = (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+        values = numpy.ascontiguousarray(data[name], dtype=dtype)
+        if values.shape != ((count,) if width == 1 else (count, width)):
+            raise ValueError("%s should have %d values for each of %d bodies" % (name, width, count))
+        layout.append((name, dtype, width, offset, values))
+        offset += values.nbytes
+
+    with open(path, "wb") as catalog:
+        catalog.write(HEADER.pack(MAGIC, count, len(layout)))
+        for name, dtype, width, offset, _ in layout:
+            catalog.write(COLUMN.pack(name, dtype, width, offset))
+        for _, _, _, offset, values in layout:
+            catalog.write("\0" * (offset - catalog.tell()))
+            catalog.write(values.tostring())
+
+
+class Catalog(object):
+
+    # A big population of bodies that don't need to be objects in their own
+    # right, kept in columns rather than rows so that each column maps
+    # straight onto one of the physics engine's arrays.  Nothing is read
+    # until the engine copies the columns across, in bulk.
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as catalog:
+            magic, count, columnCount = HEADER.unpack(catalog.read(HEADER.size))
+            if magic != MAGIC:
+                raise IOError("%s is not a catalog file" % path)
+            columns = [COLUMN.unpack(catalog.read(COLUMN.size)) for _ in range(columnCount)]
+        self.count = count
+
+        for name, dtype, width, offset in columns:
+            name = name.rstrip("\0")
+            dtype = dtype.rstrip("\0")
+            shape = (count,) if width == 1 else (count, width)
+            if count:
+                values = numpy.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape)
+            else:
+                values = numpy.zeros(shape, dtype=dtype)
+            setattr(self, name, values)
+
+        for name, _, _ in COLUMNS:
+            if not hasattr(self, name):
+                raise IOError("%s has no %s column" % (path, name))
+
+        # Where the catalog's origin and its frame's velocity are in the
+        # universe; a scenario sets these when the catalog is relative to
+        # one of its bodies.
+        self.locationOffset = numpy.zeros(3)
+        self.velocityOffset = numpy.zeros(3)
+
+        # As for WorldObject.massless, for every body in the catalog at once
+        self.massless = None
+
+
+    def __len__(self):
+        return self.count
+
+
+if __name__ == '__main__':
+    # Converts a text table with a row per body -- mass in kg, location in
+    # km, velocity in km/s, and optionally radius in km and a colour -- to
+    # a catalog.
+    if len(sys.argv) != 3:
+        print "usage: %s TABLE CATALOG" % sys.argv[0]
+        print "TABLE has columns mass x y z vx vy vz [radius [r g b]], separated by spaces or commas"
+        sys.exit(1)
+
+    with open(sys.argv[1]) as table:
+        rows = numpy.loadtxt((line.replace(",", " ") for line in table), ndmin=2)
+    if rows.shape[1] not in (7, 8, 11):
+        print "expected 7, 8 or 11 columns, got %d" % rows.shape[1]
+        sys.exit(1)
+    writeCatalog(
+        sys.argv[2], rows[:, 0], rows[:, 1:4], rows[:, 4:7],
+        rows[:, 7] if rows.shape[1] > 7 else None,
+        rows[:, 8:11] if rows.shape[1] > 8 else None,
+    )
+    print "wrote %d bodies to %s" % (len(rows), sys.argv[2])
@@ -3,6 +3,10 @@ from OpenGL.GL import *
 import pygame
 
 import locale
+import math
+import time
+
+from TextRenderer import TextRenderer
 
 
 class Dashboard(object):
@@ -10,13 +14,25 @@ class Dashboard(object):
     def __init__(self, userSpaceship):
         self.userSpaceship = userSpaceship
         self.font = pygame.font.Font(None, 20)
+        self.text = TextRenderer(self.font)
+        self.renderStats = None
+        self.universe = None
+        # When physics has its own thread, where to read the ship's state
+        # from; see SimulationThread
+        self.simulation = None
+        self.showProfile = False
+        # What to say about the replay, when we're watching one
+        self.replayStatus = None
+        # Keep relativeTo as whatever's closest to the spaceship
+        self.autoRelativeTo = False
+        # Seconds between working out what to show; in between, the last
+        # lot is drawn again.  See FrameScheduler.
+        self.refreshInterval = 0.0
+        self.scheduler = None
+        self._runs = None
+        self._refreshed = None
+        self._size = None
     
-    
-    def _renderText(self, text):
-        textSurface = self.font.render(text, True, (0, 255, 0, 255), (0, 0, 0, 0))
-        textData = pygame.image.tostring(textSurface, "RGBA", True)
-        return textSurface, textData        
-
 
     def _normalise(self, number):            
         if number < 0.1:
@@ -30,21 +46,100 @@ class Dashboard(object):
         return "%sk" % locale.format("%.0f", number, True)
 
 
-    def draw(self, screenWidth, screenHeight):
-        topOffset = 10
-        rightOffset = 10
-        wGap = 10
-        leading = 3
+    def _relativeState(self):
+        # Distance and speed of the spaceship from relativeTo, from the
+        # latest snapshot if the engine's arrays are being written to on
+        # another thread
+        ship, other = self.userSpaceship, self.relativeTo
+        if self.simulation is None:
+            return ship.scalarDistanceRelativeTo(other), ship.scalarVelocityRelativeTo(other)
+        latest = self.simulation.snapshots[1]
+        distance = latest.locations[ship.index] - latest.locations[other.index]
+        velocity = latest.velocities[ship.index] - latest.velocities[other.index]
+        return math.sqrt(distance.dot(distance)), math.sqrt(velocity.dot(velocity))
 
+
+    def _data(self):
+        # The broad phase belongs to the simulation, which may be busy with
+        # it on another thread; what it found is in shipSurroundings.
+        nearest, landedOn, near = None, [], []
+        if self.universe is not None:
+            nearest, landedOn, near = self.universe.shipSurroundings
+        if self.autoRelativeTo:
+            self.relativeTo = nearest or self.relativeTo
+
+        distance, velocity = self._relativeState()
         data = [
-            ("Relative to:", self.relativeTo.name),
-            ("Distance:", "%sm" % self._normalise(self.userSpaceship.scalarDistanceRelativeTo(self.relativeTo))),
-            ("Velocity:", "%sm/s" % self._normalise(self.userSpaceship.scalarVelocityRelativeTo(self.relativeTo))),
+            ("Relative to:", "%s%s" % (self.relativeTo.name, " (nearest)" if self.autoRelativeTo else "")),
+            ("Distance:", "%sm" % self._normalise(distance)),
+            ("Velocity:", "%sm/s" % self._normalise(velocity)),
             ("", ""),
             ("Thrust:", "%sm/s/s" % self._normalise(self.userSpaceship.thrust)),
         ]
 
-        # Draw text, adapted from http://code.activestate.com/recipes/115418/
+        if self.replayStatus is not None:
+            data.append(("Replay:", self.replayStatus))
+        elif self.universe is not None:
+            warp = "%sx" % locale.format("%.0f", self.universe.effectiveWarp, True)
+            if self.universe.effectiveWarp < self.universe.timeWarp:
+                warp = "%s (of %sx)" % (warp, locale.format("%d", self.universe.timeWarp, True))
+            data.append(("Time warp:", warp))
+
+        if landedOn:
+            data.append(("Landed on:", landedOn[0]))
+        elif near:
+            data.append(("In range of:", ", ".join(near)))
+
+        if self.renderStats is not None:
+            data.extend([
+                ("", ""),
+                ("Drawn:", "%(drawn)d (%(instanced)d instanced), %(markers)d as points" % self.renderStats),
+                ("Culled:", "%(culled)d" % self.renderStats),
+            ])
+
+        if self.showProfile and self.universe is not None:
+            profiler = self.universe.profiler
+            data.extend([
+                ("", ""),
+                ("Frame p50/95/99:", "%.1f / %.1f / %.1fms" % tuple(t * 1000 for t in profiler.framePercentiles())),
+            ])
+            if self.scheduler is not None:
+                data.append(("Quality:", "%d of %d%s" % (
+                    len(self.scheduler.qualityLevels) - self.scheduler.level, len(self.scheduler.qualityLevels),
+                    ", %dfps target" % self.scheduler.targetFps if self.scheduler.targetFps else ""
+                )))
+            for name, average in profiler.phaseAverages()[:8]:
+                data.append(("%s:" % name, "%.2fms" % (average * 1000)))
+        return data
+
+
+    def _layout(self, data, screenWidth, screenHeight):
+        topOffset = 10
+        rightOffset = 10
+        wGap = 10
+        leading = 3
+
+        # Labels never change, so their layouts come straight out of the
+        # text renderer's cache; only the values get laid out afresh.
+        maxRight = max(self.text.width(rightLabel) for _, rightLabel in data)
+        rowHeight = self.text.height + leading
+
+        runs = []
+        for rowIndex, (leftLabel, rightLabel) in enumerate(data):
+            y = screenHeight - topOffset - (rowIndex + 1) * rowHeight
+            runs.append((leftLabel, screenWidth - rightOffset - self.text.width(leftLabel) - wGap - maxRight, y))
+            runs.append((rightLabel, screenWidth - rightOffset - maxRight, y))
+        return runs
+
+
+    def draw(self, screenWidth, screenHeight):
+        now = time.time()
+        if (self._runs is None or now - self._refreshed >= self.refreshInterval or
+                self._size != (screenWidth, screenHeight)):
+            self._runs = self._layout(self._data(), screenWidth, screenHeight)
+            self._refreshed = now
+            self._size = screenWidth, screenHeight
+
         glPushMatrix()
         
         glViewport(0, 0, screenWidth, screenHeight)
@@ -53,32 +148,7 @@ class Dashboard(object):
         glOrtho(0.0, screenWidth - 1.0, 0.0, screenHeight - 1.0, -1.0, 1.0)
         glMatrixMode(GL_MODELVIEW)
         glLoadIdentity()
-        
-        renderedData = []
-        maxLeft = 0
-        maxRight = 0
-        maxHeight = 0
-        for leftLabel, rightLabel in data:
-            leftRender = self._renderText(leftLabel)
-            rightRender = self._renderText(rightLabel)
-            renderedData.append((leftRender, rightRender))
-            maxLeft = max(maxLeft, leftRender[0].get_width())
-            maxRight = max(maxRight, rightRender[0].get_width())
-            maxHeight = max(maxHeight, leftRender[0].get_height(), rightRender[0].get_height())
-
-        for rowIndex, ((leftSurface, leftData), (rightSurface, rightData)) in enumerate(renderedData):
-            glRasterPos2i(
-                screenWidth - rightOffset - min(maxLeft, leftSurface.get_width()) - wGap - maxRight,
-                screenHeight - topOffset - (rowIndex + 1) * (maxHeight + leading)
-            )
-            glDrawPixels(leftSurface.get_width(), leftSurface.get_height(), GL_RGBA, GL_UNSIGNED_BYTE, leftData)
-
-            glRasterPos2i(
-                screenWidth - rightOffset - maxRight,
-                screenHeight - topOffset - (rowIndex + 1) * (maxHeight + leading)
-            )
-            glDrawPixels(rightSurface.get_width(), rightSurface.get_height(), GL_RGBA, GL_UNSIGNED_BYTE, rightData)
 
-        glPopMatrix()
-        
+        self.text.draw(self._runs)
 
+        glPopMatrix()
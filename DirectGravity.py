@@ -0,0 +1,40 @@
+import numpy
+
+from WorldObject import G
+
+
+class DirectGravity(object):
+
+    # The all-pairs kernel builds (rows x N x 3) temporaries; doing it a
+    # block of rows at a time keeps memory bounded for large body counts.
+    blockSize = 256
+
+    def accelerations(self, locations, masses, sources=None):
+        # sources, if given, are the indexes of the only bodies whose
+        # gravity counts; everything else is a test particle, and the cost
+        # goes from N**2 to N times the number of sources.
+        count = len(masses)
+        if sources is None:
+            sources = numpy.arange(count)
+        accelerations = numpy.zeros((count, 3), dtype=numpy.float64)
+        if not len(sources):
+            return accelerations
+        # Work in meters for compatibility with G
+        locations = locations * 1000
+        sourceLocations = locations[sources]
+        sourceMasses = masses[sources]
+        # As many rows as keep the temporaries the size they'd be for a
+        # block of blockSize against everything
+        rows = max(self.blockSize, self.blockSize * count // len(sources))
+        for start in range(0, count, rows):
+            end = min(start + rows, count)
+            displacements = locations[start:end, numpy.newaxis, :] - sourceLocations[numpy.newaxis, :, :]
+            distancesSquared = (displacements ** 2).sum(axis=2)
+            # An object doesn't attract itself
+            distancesSquared[sources[numpy.newaxis, :] == numpy.arange(start, end)[:, numpy.newaxis]] = numpy.inf
+            # a = -GM/r**2 along the unit displacement, so -GM * d / r**3
+            weights = sourceMasses[numpy.newaxis, :] / (distancesSquared * numpy.sqrt(distancesSquared))
+            accelerations[start:end] = -G * (displacements * weights[:, :, numpy.newaxis]).sum(axis=1)
+
+        # Back from ms**-2 to our normal units of km
+        return accelerations / 1000
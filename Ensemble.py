@@ -0,0 +1,240 @@
+import copy
+import itertools
+import json
+import math
+import multiprocessing
+import re
+import time
+
+import numpy
+
+from BarnesHutGravity import BarnesHutGravity
+from Kepler import orbitalElements
+from Scenario import scenarioFromDefinition
+from simulate import INTEGRATORS
+from Transforms import Quaternion
+from Universe import Universe
+from WorldObject import G
+
+
+# A parameter is a body, as its name or type, a field, and optionally a
+# component of it, like "UserSpaceship.location[2]"; or "burns".
+PARAMETER = re.compile(r"^(?P<body>[^.]+)\.(?P<field>\w+)(\[(?P<component>\d+)\])?$")
+
+
+def _unit(vector):
+    vector = numpy.asarray(vector, dtype=numpy.float64)
+    return vector / numpy.linalg.norm(vector)
+
+
+def burnDirection(direction, location, velocity):
+    # A named direction relative to the reference body, or a vector
+    if not isinstance(direction, basestring):
+        return _unit(direction)
+    normal = numpy.cross(location, velocity)
+    directions = {
+        "prograde": velocity, "retrograde": -velocity,
+        "normal": normal, "antinormal": -normal,
+        "radial-out": location, "radial-in": -location,
+    }
+    if direction not in directions:
+        raise ValueError("unknown burn direction %r; expected a vector or one of %s" % (
+            direction, ", ".join(sorted(directions))
+        ))
+    return _unit(directions[direction])
+
+
+def pointing(direction):
+    # The orientation that points the spaceship, whose nose is along +z,
+    # in direction
+    direction = _unit(direction)
+    forward = numpy.array((0., 0., 1.))
+    cosine = min(max(numpy.dot(forward, direction), -1.0), 1.0)
+    axis = numpy.cross(forward, direction)
+    if numpy.linalg.norm(axis) < 1e-12:
+        axis = numpy.array((0., 1., 0.))
+    return Quaternion.fromAxisAngle(math.degrees(math.acos(cosine)), axis)
+
+
+def applyOverrides(definition, overrides):
+    # A copy of a scenario definition with the grid's choices for one
+    # variant filled in
+    definition = copy.deepcopy(definition)
+    for parameter, value in overrides.items():
+        if parameter == "burns":
+            continue
+        match = PARAMETER.match(parameter)
+        if match is None:
+            raise ValueError("can't make sense of parameter %r" % parameter)
+        entries = [
+            entry for entry in definition["bodies"]
+            if match.group("body") in (entry.get("name"), entry.get("type"))
+        ]
+        if len(entries) != 1:
+            raise ValueError("parameter %r matches %d bodies; it should match one" % (parameter, len(entries)))
+        entry = entries[0]
+        field = match.group("field")
+        if match.group("component") is None:
+            entry[field] = value
+        else:
+            vector = list(entry.get(field, (0, 0, 0)))
+            vector[int(match.group("component"))] = value
+            entry[field] = vector
+    return definition
+
+
+class Ensemble(object):
+
+    # Lots of headless runs of variations on one scenario, spread over a
+    # pool of processes.  parameters maps parameter names to the values to
+    # try, and every combination is run: for instance
+    #
+    #   Ensemble("scenarios/default.json", {
+    #       "UserSpaceship.location[2]": [6711, 6800, 7000],
+    #       "burns": [[], [{"start": 600, "duration": 20, "thrust": 0.01, "direction": "prograde"}]],
+    #   }, duration=86400, target="Space Station")
+    #
+    # Burns are thrust in km/s/s for a number of seconds, pointing in a
+    # direction relative to the reference body; the ship is turned to
+    # follow it through the burn.  Fuel isn't modelled, so what's used is
+    # reported as delta-v.
+
+    def __init__(self, scenario, parameters, duration, integrator="kepler", stepSize=1.0, theta=None,
+                 target=None, relativeTo=None, sampleInterval=10.0, burnInterval=1.0):
+        self.scenarioFile = scenario
+        with open(scenario) as source:
+            self.definition = json.load(source)
+        self.parameters = parameters
+        self.duration = duration
+        self.integrator = integrator
+        self.stepSize = stepSize
+        self.theta = theta
+        self.target = target
+        self.relativeTo = relativeTo
+        self.sampleInterval = sampleInterval
+        self.burnInterval = burnInterval
+
+
+    def variants(self):
+        names = sorted(self.parameters)
+        return [dict(zip(names, values)) for values in itertools.product(*[self.parameters[name] for name in names])]
+
+
+    def run(self, processes=None):
+        # Results in the same order as variants().  Everything the workers
+        # need that's the same for every run goes to them once, when the
+        # pool starts -- with fork, without being copied at all.
+        variants = list(enumerate(self.variants()))
+        if processes == 1:
+            _startWorker(self)
+            results = [_runVariant(variant) for variant in variants]
+        else:
+            pool = multiprocessing.Pool(processes, _startWorker, (self,))
+            try:
+                results = sorted(pool.imap_unordered(_runVariant, variants), key=lambda result: result["variant"])
+            finally:
+                pool.close()
+                pool.join()
+        return results
+
+
+    def runVariant(self, overrides):
+        started = time.time()
+        definition = applyOverrides(self.definition, overrides)
+        scenario = scenarioFromDefinition(definition, self.scenarioFile)
+        gravitySolver = None
+        if self.theta is not None:
+            gravitySolver = BarnesHutGravity(self.theta)
+        universe = Universe(
+            gravitySolver, INTEGRATORS[self.integrator](self.stepSize), scenario=scenario, headless=True
+        )
+        engine = universe.engine
+        ship = universe.userSpaceship
+
+        byName = dict((obj.name, obj) for obj in universe.objects)
+        reference = byName[self.relativeTo] if self.relativeTo else universe.initialDashboardRelativeTo
+        target = byName[self.target] if self.target else None
+
+        burns = sorted(overrides.get("burns", []), key=lambda burn: burn["start"])
+        # Times at which something changes, so that no interval crosses one
+        boundaries = sorted(set(
+            [burn["start"] for burn in burns] + [burn["start"] + burn["duration"] for burn in burns] + [self.duration]
+        ))
+
+        closest = (float("inf"), None)
+        deltaV = 0.0
+        while engine.time < self.duration - 1e-9:
+            now = engine.time
+            burn = None
+            for candidate in burns:
+                if candidate["start"] <= now < candidate["start"] + candidate["duration"]:
+                    burn = candidate
+            if burn:
+                relativeLocation = numpy.subtract(ship.location, reference.location)
+                relativeVelocity = numpy.subtract(ship.velocity, reference.velocity)
+                ship.orientation = pointing(burnDirection(burn.get("direction", "prograde"), relativeLocation, relativeVelocity))
+                ship.thrust = burn["thrust"]
+                interval = self.burnInterval
+            else:
+                ship.cutThrust()
+                interval = self.sampleInterval
+            nextBoundary = min(boundary for boundary in boundaries if boundary > now + 1e-9)
+            interval = min(interval, nextBoundary - now)
+
+            if target is not None:
+                closest = min(closest, self._closestApproach(ship, target, now, interval))
+
+            # Right up to the end of the interval, even if it's shorter than
+            # a step, so burns start and stop when they should
+            universe.accelerateAndMove(interval, exact=True)
+            deltaV += ship.thrust * (engine.time - now)
+        ship.cutThrust()
+        if target is not None:
+            closest = min(closest, self._closestApproach(ship, target, engine.time, 0))
+
+        relativeLocation = numpy.subtract(ship.location, reference.location)
+        relativeVelocity = numpy.subtract(ship.velocity, reference.velocity)
+        elements = orbitalElements(relativeLocation, relativeVelocity, G * (reference.mass + ship.mass) / 1e9)
+
+        result = {
+            "simulatedSeconds": engine.time,
+            "deltaV": deltaV * 1000,
+            "finalDistance": float(numpy.linalg.norm(relativeLocation)),
+            "finalSpeed": float(numpy.linalg.norm(relativeVelocity)) * 1000,
+            "periapsisAltitude": elements["periapsis"] - reference.radius,
+            "apoapsisAltitude": elements["apoapsis"] - reference.radius,
+            "eccentricity": elements["eccentricity"],
+            "inclination": elements["inclination"],
+            "period": elements["period"],
+            "seconds": time.time() - started,
+        }
+        if target is not None:
+            result["closestApproach"], result["closestApproachTime"] = closest
+        return result
+
+
+    def _closestApproach(self, ship, target, now, interval):
+        # Closest over the next interval, assuming straight-line relative
+        # motion; good to well under a sample's worth of relative movement.
+        separation = numpy.subtract(ship.location, target.location)
+        closingVelocity = numpy.subtract(ship.velocity, target.velocity)
+        speedSquared = numpy.dot(closingVelocity, closingVelocity)
+        when = 0.0
+        if speedSquared > 0:
+            when = min(max(-numpy.dot(separation, closingVelocity) / speedSquared, 0.0), interval)
+        return float(numpy.linalg.norm(separation + closingVelocity * when)), now + when
+
+
+# The ensemble a worker process is running variants of
+_ensemble = None
+
+
+def _startWorker(ensemble):
+    global _ensemble
+    _ensemble = ensemble
+
+
+def _runVariant((index, overrides)):
+    result = {"variant": index}
+    result.update(_ensemble.runVariant(overrides))
+    return result
@@ -0,0 +1,114 @@
+import collections
+import contextlib
+import csv
+import json
+import threading
+import time
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+class FrameProfiler(object):
+
+    # Times named phases of each frame on whichever thread they run on.
+    # Rolling statistics cover the last `history` samples of each; the raw
+    # events are only kept if we're going to export a trace.  Note that
+    # for GL calls this is the CPU time to submit them -- the GPU catches
+    # up later, typically in the buffer flip.
+
+    def __init__(self, history=300, keepEvents=False, maxEvents=500000):
+        self.history = history
+        self.keepEvents = keepEvents
+        self.events = collections.deque(maxlen=maxEvents)
+        self.frameTimes = collections.deque(maxlen=history)
+        self.phaseTimes = {}
+        self.frame = 0
+        self.frameStarted = None
+        self.origin = time.time()
+
+
+    def beginFrame(self):
+        self.frameStarted = time.time()
+
+
+    def endFrame(self):
+        ended = time.time()
+        if self.frameStarted is not None:
+            self.record("frame", self.frameStarted, ended)
+            self.frameTimes.append(ended - self.frameStarted)
+        self.frame += 1
+
+
+    def record(self, name, started, ended):
+        self.phaseTimes.setdefault(name, collections.deque(maxlen=self.history)).append(ended - started)
+        if self.keepEvents:
+            self.events.append((self.frame, threading.current_thread().name, name, started, ended))
+
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.record(name, started, time.time())
+
+
+    def framePercentiles(self):
+        # p50, p95 and p99 frame times in seconds
+        frameTimes = list(self.frameTimes)
+        return tuple(_percentile(frameTimes, fraction) for fraction in (0.5, 0.95, 0.99))
+
+
+    def phaseAverages(self):
+        # (name, mean seconds), slowest first
+        averages = []
+        for name, durations in self.phaseTimes.items():
+            durations = list(durations)
+            if name != "frame" and durations:
+                averages.append((name, sum(durations) / len(durations)))
+        averages.sort(key=lambda (name, average): -average)
+        return averages
+
+
+    def exportChromeTrace(self, filename):
+        # Loads in chrome://tracing or Perfetto
+        threadIds = {}
+        traceEvents = []
+        for frame, threadName, name, started, ended in list(self.events):
+            if threadName not in threadIds:
+                threadIds[threadName] = len(threadIds) + 1
+                traceEvents.append({
+                    "name": "thread_name", "ph": "M", "pid": 1, "tid": threadIds[threadName],
+                    "args": {"name": threadName},
+                })
+            traceEvents.append({
+                "name": name, "ph": "X", "pid": 1, "tid": threadIds[threadName],
+                "ts": (started - self.origin) * 1e6, "dur": (ended - started) * 1e6,
+                "args": {"frame": frame},
+            })
+        with open(filename, "w") as output:
+            json.dump({"traceEvents": traceEvents, "displayTimeUnit": "ms"}, output)
+
+
+    def exportCsv(self, filename):
+        with open(filename, "wb") as output:
+            writer = csv.writer(output)
+            writer.writerow(("frame", "thread", "phase", "start_ms", "duration_ms"))
+            for frame, threadName, name, started, ended in list(self.events):
+                writer.writerow((
+                    frame, threadName, name,
+                    "%.3f" % ((started - self.origin) * 1000), "%.3f" % ((ended - started) * 1000)
+                ))
+
+
+    def export(self, filename):
+        if filename.lower().endswith(".csv"):
+            self.exportCsv(filename)
+        else:
+            self.exportChromeTrace(filename)
@@ -0,0 +1,118 @@
+import collections
+import time
+
+
+# From best to cheapest: how many pixels each polygon edge around a
+# sphere's limb may be, how often the dashboard's numbers are worked out
+# afresh in seconds, and how many orbits ahead the predicted path goes.
+QUALITY_LEVELS = (
+    {"limbSegmentPixels": 6, "hudInterval": 0.0, "predictionOrbits": 2.0},
+    {"limbSegmentPixels": 10, "hudInterval": 0.1, "predictionOrbits": 1.5},
+    {"limbSegmentPixels": 16, "hudInterval": 0.25, "predictionOrbits": 1.0},
+    {"limbSegmentPixels": 24, "hudInterval": 0.5, "predictionOrbits": 0.5},
+)
+
+
+class FrameScheduler(object):
+
+    # Paces the frame loop to a target frame rate, sleeping away whatever
+    # time a frame doesn't need rather than spinning round again, and
+    # trades quality for speed when frames take too long.  Each frame goes
+    #
+    #   beginFrame(), ...work..., workDone(), flip, endFrame()
+    #
+    # and only the work counts against the budget; waiting for the flip
+    # doesn't, since with vsync on that would look like every frame taking
+    # exactly as long as the refresh.
+    #
+    # A targetFps of 0 runs flat out, but still adapts quality to keep up
+    # 60fps or so.
+
+    # Fraction of each frame's time the work may use before quality drops,
+    # and below which it goes back up
+    highWater = 0.85
+    lowWater = 0.5
+
+    # Frames of history the decisions are made on, and how many frames to
+    # leave after a change before making another one; going back up is
+    # more cautious than coming down, so that we don't oscillate.
+    window = 20
+    settleFrames = 30
+    raiseFrames = 120
+
+    # Sleeps shorter than this are done by yielding instead, since the OS
+    # is apt to oversleep by around a millisecond
+    spinSeconds = 0.001
+
+    def __init__(self, targetFps=60, qualityLevels=QUALITY_LEVELS):
+        self.targetFps = targetFps
+        self.qualityLevels = qualityLevels
+        self.level = 0
+        self.workTimes = collections.deque(maxlen=self.window)
+        self.framesSinceChange = 0
+        self.frameStarted = None
+        self.nextDeadline = None
+
+
+    @property
+    def quality(self):
+        return self.qualityLevels[self.level]
+
+
+    def frameLength(self):
+        return 1. / (self.targetFps or 60)
+
+
+    def beginFrame(self):
+        self.frameStarted = time.time()
+        if self.nextDeadline is None:
+            self.nextDeadline = self.frameStarted
+
+
+    def workDone(self):
+        if self.frameStarted is not None:
+            self.workTimes.append(time.time() - self.frameStarted)
+            self._adapt()
+
+
+    def endFrame(self):
+        # Wait until it's time for the next frame.  If we've fallen more
+        # than a frame behind, don't try to catch up with a burst of them.
+        if not self.targetFps:
+            return
+        self.nextDeadline += self.frameLength()
+        now = time.time()
+        if now - self.nextDeadline > self.frameLength():
+            self.nextDeadline = now
+            return
+        self._sleepUntil(self.nextDeadline)
+
+
+    def _sleepUntil(self, deadline):
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            if remaining > self.spinSeconds:
+                time.sleep(remaining - self.spinSeconds)
+            else:
+                time.sleep(0)
+
+
+    def _adapt(self):
+        # Returns whether the quality level changed
+        self.framesSinceChange += 1
+        if len(self.workTimes) < self.window or self.framesSinceChange < self.settleFrames:
+            return False
+        average = sum(self.workTimes) / len(self.workTimes)
+        budget = self.frameLength()
+        if average > self.highWater * budget and self.level < len(self.qualityLevels) - 1:
+            self.level += 1
+        elif (average < self.lowWater * budget and self.level > 0 and
+              self.framesSinceChange >= self.raiseFrames):
+            self.level -= 1
+        else:
+            return False
+        self.framesSinceChange = 0
+        self.workTimes.clear()
+        return True
@@ -0,0 +1,14 @@
+import os
+
+# The simulation has to run on machines with no OpenGL at all, so the
+# world objects get their GL names from here.  Programs that never draw,
+# like simulate.py, set EXPLORER_HEADLESS before importing anything, and
+# PyOpenGL isn't loaded at all.  Otherwise, without PyOpenGL (or a
+# library for it to load) the names are simply missing, and only drawing
+# will fail.
+if not os.environ.get("EXPLORER_HEADLESS"):
+    try:
+        from OpenGL.GL import *
+        from OpenGL.GLU import *
+    except ImportError:
+        pass
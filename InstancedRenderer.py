@@ -0,0 +1,180 @@
+import ctypes
+import math
+
+import numpy
+
+from Graphics import *
+
+from MeshCache import SPHERE_DETAIL_LEVELS, sphereDetailLevels
+
+
+VERTEX_SHADER = """
+#version 120
+attribute vec3 position;
+attribute vec3 offset;
+attribute float scale;
+attribute vec3 color;
+varying vec3 normal;
+varying vec3 eyeLocation;
+varying vec3 baseColor;
+
+void main() {
+    vec4 eye = gl_ModelViewMatrix * vec4(offset + position * scale, 1.0);
+    eyeLocation = eye.xyz;
+    normal = gl_NormalMatrix * position;
+    baseColor = color;
+    gl_Position = gl_ProjectionMatrix * eye;
+}
+"""
+
+# Lit by GL_LIGHT0 like everything else, which the Sun sets up when it
+# draws
+FRAGMENT_SHADER = """
+#version 120
+varying vec3 normal;
+varying vec3 eyeLocation;
+varying vec3 baseColor;
+
+void main() {
+    vec4 light = gl_LightSource[0].position;
+    vec3 direction = light.w == 0.0 ? light.xyz : light.xyz - eyeLocation;
+    float diffuse = max(dot(normalize(normal), normalize(direction)), 0.0);
+    gl_FragColor = vec4(baseColor * (gl_LightSource[0].ambient.rgb + gl_LightSource[0].diffuse.rgb * diffuse), 1.0);
+}
+"""
+
+
+def sphereTriangles(slices, stacks):
+    # A unit sphere as a flat list of triangles, which double as their own
+    # normals
+    theta = numpy.linspace(0, math.pi, stacks + 1)
+    phi = numpy.linspace(0, 2 * math.pi, slices + 1)
+    grid = numpy.empty((stacks + 1, slices + 1, 3), dtype=numpy.float32)
+    grid[:, :, 0] = numpy.sin(theta)[:, numpy.newaxis] * numpy.cos(phi)[numpy.newaxis, :]
+    grid[:, :, 1] = numpy.sin(theta)[:, numpy.newaxis] * numpy.sin(phi)[numpy.newaxis, :]
+    grid[:, :, 2] = numpy.cos(theta)[:, numpy.newaxis]
+    topLeft, topRight = grid[:-1, :-1], grid[:-1, 1:]
+    bottomLeft, bottomRight = grid[1:, :-1], grid[1:, 1:]
+    quads = numpy.stack((topLeft, bottomLeft, bottomRight, topLeft, bottomRight, topRight), axis=2)
+    return numpy.ascontiguousarray(quads.reshape((-1, 3)))
+
+
+class InstancedRenderer(object):
+
+    # Draws any number of spheres in as few calls as possible: everything
+    # about each one that differs -- where it is, how big and what colour --
+    # goes into a buffer of per-instance attributes, and all the spheres at
+    # one level of detail are a single glDrawArraysInstanced.  Locations are
+    # relative to the user's spaceship, as with everything else we draw, so
+    # that the ones nearby are exact in single precision.
+    #
+    # Needs GLSL and instanced arrays; where they're missing, available()
+    # says so and the caller should draw the objects one at a time.
+
+    # Per instance: offset (3), scale (1), color (3)
+    instanceFloats = 7
+
+    def __init__(self):
+        self.supported = None
+        self.program = None
+        self.meshes = {}
+        self.instanceBuffer = None
+
+
+    def available(self):
+        # Only known once there's a context to ask
+        if self.supported is None:
+            self.supported = False
+            if bool(glDrawArraysInstanced) and bool(glVertexAttribDivisor):
+                try:
+                    self._buildProgram()
+                    self.supported = True
+                except (RuntimeError, GLError):
+                    pass
+        return self.supported
+
+
+    def _buildProgram(self):
+        from OpenGL.GL import shaders
+        program = glCreateProgram()
+        glAttachShader(program, shaders.compileShader(VERTEX_SHADER, GL_VERTEX_SHADER))
+        glAttachShader(program, shaders.compileShader(FRAGMENT_SHADER, GL_FRAGMENT_SHADER))
+        # The per-vertex attribute has to be number 0 in a compatibility
+        # context, or nothing is drawn
+        glBindAttribLocation(program, 0, "position")
+        glLinkProgram(program)
+        if glGetProgramiv(program, GL_LINK_STATUS) != GL_TRUE:
+            raise RuntimeError(glGetProgramInfoLog(program))
+        self.program = program
+        self.attributes = dict(
+            (name, glGetAttribLocation(program, name)) for name in ("position", "offset", "scale", "color")
+        )
+        self.instanceBuffer = glGenBuffers(1)
+
+
+    def _mesh(self, detail):
+        if detail not in self.meshes:
+            vertices = sphereTriangles(detail, detail)
+            buffer = glGenBuffers(1)
+            glBindBuffer(GL_ARRAY_BUFFER, buffer)
+            glBufferData(GL_ARRAY_BUFFER, vertices, GL_STATIC_DRAW)
+            self.meshes[detail] = buffer, len(vertices)
+        return self.meshes[detail]
+
+
+    def drawSpheres(self, relativeLocations, radii, colors, pixelRadii):
+        # All the arguments are per sphere.  Returns how many draw calls it
+        # took.
+        count = len(relativeLocations)
+        if not count:
+            return 0
+
+        # Sorted by level of detail, so that each level's instances are
+        # together in the buffer
+        levels = sphereDetailLevels(pixelRadii)
+        order = numpy.argsort(levels, kind="mergesort")
+        levels = levels[order]
+
+        instances = numpy.empty((count, self.instanceFloats), dtype=numpy.float32)
+        instances[:, 0:3] = relativeLocations[order]
+        instances[:, 3] = radii[order]
+        instances[:, 4:7] = colors[order]
+
+        glPushAttrib(GL_ENABLE_BIT)
+        glDisable(GL_TEXTURE_2D)
+        glUseProgram(self.program)
+        glBindBuffer(GL_ARRAY_BUFFER, self.instanceBuffer)
+        glBufferData(GL_ARRAY_BUFFER, instances, GL_STREAM_DRAW)
+
+        attributes = self.attributes
+        for name in ("position", "offset", "scale", "color"):
+            glEnableVertexAttribArray(attributes[name])
+        for name in ("offset", "scale", "color"):
+            glVertexAttribDivisor(attributes[name], 1)
+
+        stride = self.instanceFloats * 4
+        calls = 0
+        starts = numpy.searchsorted(levels, numpy.arange(len(SPHERE_DETAIL_LEVELS) + 1))
+        for level, detail in enumerate(SPHERE_DETAIL_LEVELS):
+            start, end = starts[level], starts[level + 1]
+            if start == end:
+                continue
+            buffer, vertexCount = self._mesh(detail)
+            glBindBuffer(GL_ARRAY_BUFFER, buffer)
+            glVertexAttribPointer(attributes["position"], 3, GL_FLOAT, GL_FALSE, 0, None)
+            glBindBuffer(GL_ARRAY_BUFFER, self.instanceBuffer)
+            base = int(start) * stride
+            glVertexAttribPointer(attributes["offset"], 3, GL_FLOAT, GL_FALSE, stride, ctypes.c_void_p(base))
+            glVertexAttribPointer(attributes["scale"], 1, GL_FLOAT, GL_FALSE, stride, ctypes.c_void_p(base + 12))
+            glVertexAttribPointer(attributes["color"], 3, GL_FLOAT, GL_FALSE, stride, ctypes.c_void_p(base + 16))
+            glDrawArraysInstanced(GL_TRIANGLES, 0, vertexCount, int(end - start))
+            calls += 1
+
+        for name in ("offset", "scale", "color"):
+            glVertexAttribDivisor(attributes[name], 0)
+        for name in ("position", "offset", "scale", "color"):
+            glDisableVertexAttribArray(attributes[name])
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glUseProgram(0)
+        glPopAttrib()
+        return calls
@@ -0,0 +1,187 @@
+import numpy
+
+
+# Butcher tableaux: (nodes, stage coefficients, weights).  The engine's
+# accelerations only depend on position, so the nodes aren't actually
+# needed, but they're kept so the tables read like the textbook ones.
+RK4_TABLEAU = (
+    (0, 0.5, 0.5, 1),
+    (
+        (),
+        (0.5,),
+        (0, 0.5),
+        (0, 0, 1),
+    ),
+    (1 / 6., 1 / 3., 1 / 3., 1 / 6.),
+)
+
+# Dormand-Prince 5(4); the first set of weights is fifth order and the
+# second fourth, and the difference between them is our error estimate.
+DORMAND_PRINCE_TABLEAU = (
+    (0, 1 / 5., 3 / 10., 4 / 5., 8 / 9., 1, 1),
+    (
+        (),
+        (1 / 5.,),
+        (3 / 40., 9 / 40.),
+        (44 / 45., -56 / 15., 32 / 9.),
+        (19372 / 6561., -25360 / 2187., 64448 / 6561., -212 / 729.),
+        (9017 / 3168., -355 / 33., 46732 / 5247., 49 / 176., -5103 / 18656.),
+        (35 / 384., 0, 500 / 1113., 125 / 192., -2187 / 6784., 11 / 84.),
+    ),
+    (35 / 384., 0, 500 / 1113., 125 / 192., -2187 / 6784., 11 / 84., 0),
+    (5179 / 57600., 0, 7571 / 16695., 393 / 640., -92097 / 339200., 187 / 2100., 1 / 40.),
+)
+
+
+def _rungeKuttaStages(engine, locations, velocities, stepSize, coefficients):
+    # Each stage's derivative of (location, velocity) is (velocity, acceleration)
+    locationSlopes = []
+    velocitySlopes = []
+    for stageCoefficients in coefficients:
+        stageLocations = locations.copy()
+        stageVelocities = velocities.copy()
+        for coefficient, locationSlope, velocitySlope in zip(stageCoefficients, locationSlopes, velocitySlopes):
+            if coefficient:
+                stageLocations += stepSize * coefficient * locationSlope
+                stageVelocities += stepSize * coefficient * velocitySlope
+        locationSlopes.append(stageVelocities)
+        velocitySlopes.append(engine.calculateAccelerations(stageLocations))
+    return locationSlopes, velocitySlopes
+
+
+def _combine(values, stepSize, weights, slopes):
+    result = values.copy()
+    for weight, slope in zip(weights, slopes):
+        if weight:
+            result += stepSize * weight * slope
+    return result
+
+
+class FixedStepIntegrator(object):
+
+    def __init__(self, stepSize=1 / 60.):
+        self.stepSize = stepSize
+        # The step as configured, before any limitStepSize; see Universe
+        self.baseStepSize = stepSize
+        # Simulated time we've been asked for but haven't stepped through yet
+        self.accumulator = 0.0
+
+
+    def limitStepSize(self, stepSize):
+        self.stepSize = stepSize
+
+
+    def advance(self, engine, time):
+        self.accumulator += time
+        steps = int(self.accumulator // self.stepSize)
+        self.accumulator -= steps * self.stepSize
+        for _ in range(steps):
+            self.step(engine, self.stepSize)
+        return steps * self.stepSize
+
+
+    def flush(self, engine):
+        # A short step through whatever advance has left over, for when
+        # the time has to come out exact.  Returns how long it was.
+        remaining = self.accumulator
+        self.accumulator = 0.0
+        if remaining > 0:
+            self.step(engine, remaining)
+        return remaining
+
+
+class Leapfrog(FixedStepIntegrator):
+
+    # Kick-drift-kick velocity Verlet.  Symplectic, so orbits don't spiral
+    # in or out over time, and it only needs one new set of forces per
+    # step because the ones at the end of a step start the next.
+    def step(self, engine, stepSize):
+        halfStep = 0.5 * stepSize
+        engine.velocities += halfStep * engine.calculateAccelerations()
+        engine.locations += stepSize * engine.velocities
+        engine.stateChanged()
+        engine.velocities += halfStep * engine.calculateAccelerations()
+
+
+class RungeKutta4(FixedStepIntegrator):
+
+    def step(self, engine, stepSize):
+        nodes, coefficients, weights = RK4_TABLEAU
+        locationSlopes, velocitySlopes = _rungeKuttaStages(
+            engine, engine.locations, engine.velocities, stepSize, coefficients
+        )
+        engine.locations[:] = _combine(engine.locations, stepSize, weights, locationSlopes)
+        engine.velocities[:] = _combine(engine.velocities, stepSize, weights, velocitySlopes)
+        engine.stateChanged()
+
+
+class AdaptiveRungeKutta(object):
+
+    def __init__(self, stepSize=1.0, locationTolerance=1e-3, velocityTolerance=1e-6, maxStepSize=None):
+        # Tolerances are absolute, in km and km/s -- relative ones are
+        # meaningless when the origin is the Sun and we care about meters.
+        self.stepSize = stepSize
+        self.locationTolerance = locationTolerance
+        self.velocityTolerance = velocityTolerance
+        self.maxStepSize = maxStepSize
+        # stepSize is only a first guess, so the longest step as configured,
+        # if any, is what there is to scale up; see Universe
+        self.baseStepSize = maxStepSize
+
+
+    def limitStepSize(self, stepSize):
+        self.maxStepSize = stepSize
+
+
+    def _attempt(self, engine, stepSize):
+        nodes, coefficients, weights, lowOrderWeights = DORMAND_PRINCE_TABLEAU
+        locationSlopes, velocitySlopes = _rungeKuttaStages(
+            engine, engine.locations, engine.velocities, stepSize, coefficients
+        )
+        errorWeights = [high - low for high, low in zip(weights, lowOrderWeights)]
+        locationError = _combine(numpy.zeros_like(engine.locations), stepSize, errorWeights, locationSlopes)
+        velocityError = _combine(numpy.zeros_like(engine.velocities), stepSize, errorWeights, velocitySlopes)
+        error = max(
+            numpy.abs(locationError).max() / self.locationTolerance,
+            numpy.abs(velocityError).max() / self.velocityTolerance
+        )
+        return (
+            error,
+            _combine(engine.locations, stepSize, weights, locationSlopes),
+            _combine(engine.velocities, stepSize, weights, velocitySlopes),
+        )
+
+
+    def advance(self, engine, time):
+        remaining = time
+        while remaining > 0:
+            stepSize = self.stepSize
+            if self.maxStepSize:
+                stepSize = min(stepSize, self.maxStepSize)
+            clipped = stepSize >= remaining
+            if clipped:
+                stepSize = remaining
+
+            error, locations, velocities = self._attempt(engine, stepSize)
+            if error <= 1:
+                engine.locations[:] = locations
+                engine.velocities[:] = velocities
+                engine.stateChanged()
+                remaining -= stepSize
+
+            # Standard step size control for a fifth-order method, with
+            # some safety margin and limits on how fast it can change.
+            if error == 0:
+                factor = 5.0
+            else:
+                factor = min(5.0, max(0.2, 0.9 * error ** -0.2))
+            # A step that was cut short to land on the end of the interval
+            # says nothing useful about how big the next one should be.
+            if not (clipped and error <= 1):
+                self.stepSize = stepSize * factor
+        return time
+
+
+    def flush(self, engine):
+        # advance always lands exactly on the end of the interval
+        return 0.0
@@ -0,0 +1,286 @@
+import math
+
+import numpy
+
+from Integrators import FixedStepIntegrator
+from WorldObject import G
+
+
+def _stumpff(z):
+    # The Stumpff functions C(z) and S(z), with series near zero where the
+    # closed forms cancel catastrophically
+    z = numpy.asarray(z, dtype=numpy.float64)
+    c = numpy.empty_like(z)
+    s = numpy.empty_like(z)
+
+    small = numpy.abs(z) < 1e-3
+    zs = z[small]
+    c[small] = 1. / 2 - zs / 24 + zs ** 2 / 720
+    s[small] = 1. / 6 - zs / 120 + zs ** 2 / 5040
+
+    elliptic = (z >= 1e-3)
+    root = numpy.sqrt(z[elliptic])
+    c[elliptic] = (1 - numpy.cos(root)) / z[elliptic]
+    s[elliptic] = (root - numpy.sin(root)) / root ** 3
+
+    hyperbolic = (z <= -1e-3)
+    root = numpy.sqrt(-z[hyperbolic])
+    c[hyperbolic] = (numpy.cosh(root) - 1) / -z[hyperbolic]
+    s[hyperbolic] = (numpy.sinh(root) - root) / root ** 3
+    return c, s
+
+
+def propagate(locations, velocities, mus, time, tolerance=1e-13, maxIterations=50):
+    # Where each of a set of bodies in two-body orbits will be after time
+    # seconds, exactly, whatever the kind of orbit.  Locations and
+    # velocities are (n, 3), relative to each one's primary, in km and
+    # km/s; mus are G(M + m) for each, in km**3/s**2.  Uses the universal
+    # variable formulation, as in Curtis, "Orbital Mechanics for
+    # Engineering Students", chapter 3.
+    locations = numpy.asarray(locations, dtype=numpy.float64)
+    velocities = numpy.asarray(velocities, dtype=numpy.float64)
+    mus = numpy.asarray(mus, dtype=numpy.float64)
+    count = len(locations)
+    if count == 0 or time == 0:
+        return locations.copy(), velocities.copy()
+
+    r0 = numpy.sqrt((locations ** 2).sum(axis=1))
+    v0Squared = (velocities ** 2).sum(axis=1)
+    radialVelocity = (locations * velocities).sum(axis=1) / r0
+    # Reciprocal of the semi-major axis: positive for ellipses
+    alpha = 2 / r0 - v0Squared / mus
+    rootMu = numpy.sqrt(mus)
+
+    # Whole orbits make no difference to an ellipse, so only propagate
+    # through what's left over; that's what keeps long time warps exact.
+    times = numpy.repeat(float(time), count)
+    elliptic = alpha > 1e-12
+    periods = 2 * numpy.pi / numpy.sqrt(mus[elliptic] * alpha[elliptic] ** 3)
+    times[elliptic] = numpy.fmod(times[elliptic], periods)
+
+    # Starting guesses: from the mean motion for ellipses; otherwise just
+    # the distance we'd go at the current speed, which Newton's method
+    # can get from.
+    chi = rootMu * numpy.abs(alpha) * times
+    chi[~elliptic] = rootMu[~elliptic] * times[~elliptic] / r0[~elliptic]
+
+    for _ in range(maxIterations):
+        z = alpha * chi ** 2
+        c, s = _stumpff(z)
+        function = (
+            r0 * radialVelocity / rootMu * chi ** 2 * c +
+            (1 - alpha * r0) * chi ** 3 * s +
+            r0 * chi - rootMu * times
+        )
+        derivative = (
+            r0 * radialVelocity / rootMu * chi * (1 - z * s) +
+            (1 - alpha * r0) * chi ** 2 * c + r0
+        )
+        change = function / derivative
+        chi -= change
+        if (numpy.abs(change) <= tolerance * numpy.maximum(numpy.abs(chi), 1)).all():
+            break
+
+    z = alpha * chi ** 2
+    c, s = _stumpff(z)
+    f = 1 - chi ** 2 / r0 * c
+    g = times - chi ** 3 / rootMu * s
+    newLocations = f[:, numpy.newaxis] * locations + g[:, numpy.newaxis] * velocities
+    r = numpy.sqrt((newLocations ** 2).sum(axis=1))
+    fDot = rootMu / (r * r0) * (alpha * chi ** 3 * s - chi)
+    gDot = 1 - chi ** 2 / r * c
+    newVelocities = fDot[:, numpy.newaxis] * locations + gDot[:, numpy.newaxis] * velocities
+    return newLocations, newVelocities
+
+
+def orbitalElements(location, velocity, mu):
+    # The shape of the orbit with this relative location and velocity, in
+    # km and km/s, around a primary with mu = G(M + m) in km**3/s**2.
+    # Apoapsis and period are infinite for orbits that don't come back.
+    location = numpy.asarray(location, dtype=numpy.float64)
+    velocity = numpy.asarray(velocity, dtype=numpy.float64)
+    distance = numpy.linalg.norm(location)
+    speed = numpy.linalg.norm(velocity)
+    angularMomentum = numpy.cross(location, velocity)
+    eccentricityVector = numpy.cross(velocity, angularMomentum) / mu - location / distance
+    eccentricity = numpy.linalg.norm(eccentricityVector)
+    energy = speed ** 2 / 2 - mu / distance
+    semiLatusRectum = numpy.dot(angularMomentum, angularMomentum) / mu
+
+    elements = {
+        "eccentricity": eccentricity,
+        "inclination": math.degrees(math.acos(
+            min(max(angularMomentum[2] / numpy.linalg.norm(angularMomentum), -1.0), 1.0)
+        )),
+        "periapsis": semiLatusRectum / (1 + eccentricity),
+        "semiMajorAxis": -mu / (2 * energy) if energy != 0 else float("inf"),
+        "apoapsis": float("inf"),
+        "period": float("inf"),
+    }
+    if energy < 0:
+        elements["apoapsis"] = semiLatusRectum / (1 - eccentricity)
+        elements["period"] = 2 * math.pi * math.sqrt(elements["semiMajorAxis"] ** 3 / mu)
+    return elements
+
+
+class KeplerHybrid(FixedStepIntegrator):
+
+    # Patched conics.  Each time we're asked to advance, every body that's
+    # coasting and is almost entirely under the influence of one heavier
+    # body -- its primary -- is put "on rails", and moves along the exact
+    # two-body orbit around that primary.  Everything else is integrated
+    # numerically with leapfrog steps, with the on-rails bodies where the
+    # closed form says they'll be.  If everything's on rails the whole
+    # interval goes in one go, however long it is.
+    #
+    # A body goes back to being integrated as soon as it's under thrust or
+    # the pull of everything but its primary gets above
+    # perturbationThreshold of its primary's.  When everything's on rails,
+    # each body with nothing heavier to orbit, like the Sun, goes round
+    # the centre of mass of itself and everything in orbit around it, and
+    # that carries on in a straight line.
+
+    # Bodies lighter than this fraction of the heaviest one can't be a
+    # primary, just as for PhysicsEngine.stableStepSize
+    attractorMassRatio = 1e-12
+
+    def __init__(self, stepSize=1 / 60., perturbationThreshold=1e-5):
+        FixedStepIntegrator.__init__(self, stepSize)
+        self.perturbationThreshold = perturbationThreshold
+        self.onRails = numpy.zeros(0, dtype=bool)
+        self.primaries = numpy.zeros(0, dtype=int)
+
+
+    def classify(self, engine):
+        masses = engine.masses
+        locations = engine.locations
+        count = len(masses)
+        attractors = numpy.flatnonzero(masses >= self.attractorMassRatio * masses.max())
+
+        # The primary is whichever heavier attractor pulls hardest
+        displacements = (locations[attractors][numpy.newaxis, :, :] - locations[:, numpy.newaxis, :]) * 1000
+        distancesSquared = (displacements ** 2).sum(axis=2)
+        with numpy.errstate(divide="ignore"):
+            pulls = numpy.where(
+                masses[attractors][numpy.newaxis, :] > masses[:, numpy.newaxis],
+                masses[attractors][numpy.newaxis, :] / distancesSquared, 0
+            )
+        hasPrimary = pulls.max(axis=1) > 0
+        primaries = numpy.where(hasPrimary, attractors[pulls.argmax(axis=1)], -1)
+
+        # How far the acceleration relative to the primary is from what the
+        # primary alone would do
+        accelerations = engine.calculateGravity()
+        withPrimary = numpy.flatnonzero(hasPrimary)
+        relative = (locations[withPrimary] - locations[primaries[withPrimary]]) * 1000
+        distances = numpy.sqrt((relative ** 2).sum(axis=1))
+        mus = G * (masses[withPrimary] + masses[primaries[withPrimary]])
+        twoBody = -mus[:, numpy.newaxis] * relative / distances[:, numpy.newaxis] ** 3 / 1000
+        actual = accelerations[withPrimary] - accelerations[primaries[withPrimary]]
+        perturbations = numpy.zeros(count)
+        perturbations[withPrimary] = (
+            numpy.sqrt(((actual - twoBody) ** 2).sum(axis=1)) / numpy.sqrt((twoBody ** 2).sum(axis=1))
+        )
+
+        candidates = hasPrimary & (perturbations < self.perturbationThreshold)
+        for obj in engine.propelledObjects:
+            if any(obj.thrustAcceleration()):
+                candidates[obj.index] = False
+
+        # A body can only be on rails if its primary's motion is known in
+        # closed form too, or it's at the top of the tree.  Primaries are
+        # always heavier, so going heaviest first settles them first.
+        # Each body's tree is named after the body at the top of it.
+        onRails = numpy.zeros(count, dtype=bool)
+        depths = numpy.zeros(count, dtype=int)
+        trees = numpy.arange(count)
+        for index in numpy.argsort(-masses, kind="mergesort"):
+            primary = primaries[index]
+            if primary != -1:
+                trees[index] = trees[primary]
+            if candidates[index] and (onRails[primary] or primaries[primary] == -1):
+                onRails[index] = True
+                depths[index] = depths[primary] + 1
+
+        self.onRails = onRails
+        self.primaries = primaries
+        self.depths = depths
+        self.trees = trees
+        self.mus = G * (masses + numpy.where(hasPrimary, masses[primaries], 0)) / 1e9
+        return onRails
+
+
+    def _railsMotion(self, engine, time):
+        # Where the on-rails bodies will be relative to their primaries
+        rails = numpy.flatnonzero(self.onRails)
+        primaries = self.primaries[rails]
+        relativeLocations, relativeVelocities = propagate(
+            engine.locations[rails] - engine.locations[primaries],
+            engine.velocities[rails] - engine.velocities[primaries],
+            self.mus[rails], time
+        )
+        return rails, primaries, relativeLocations, relativeVelocities
+
+
+    def _placeRails(self, engine, motion, array, relative):
+        # Down the tree a level at a time, so each primary is already where
+        # it should be before anything orbiting it is placed.
+        rails, primaries = motion[:2]
+        depths = self.depths[rails]
+        for depth in range(1, depths.max() + 1 if len(depths) else 1):
+            level = depths == depth
+            array[rails[level]] = array[primaries[level]] + relative[level]
+
+
+    def _centres(self, weights, array):
+        # The weighted mean of array over each body's tree, for each body;
+        # for a tree with no weight at all, the value for its top body
+        count = len(weights)
+        totals = numpy.bincount(self.trees, weights, count)[self.trees]
+        centres = array[self.trees].copy()
+        weighted = totals > 0
+        for axis in range(3):
+            sums = numpy.bincount(self.trees, weights * array[:, axis], count)[self.trees]
+            centres[weighted, axis] = sums[weighted] / totals[weighted]
+        return centres
+
+
+    def advance(self, engine, time):
+        onRails = self.classify(engine)
+        roots = self.primaries == -1
+        if (onRails | roots).all():
+            total = self.accumulator + time
+            self.accumulator = 0.0
+            # Only what has gravity of its own pulls the top of its tree
+            # around
+            sources = engine.sources()
+            weights = numpy.zeros(len(engine.masses))
+            weights[sources] = engine.masses[sources]
+            startCentres = self._centres(weights, engine.locations)
+            centreVelocities = self._centres(weights, engine.velocities)
+
+            motion = self._railsMotion(engine, total)
+            self._placeRails(engine, motion, engine.locations, motion[2])
+            self._placeRails(engine, motion, engine.velocities, motion[3])
+            # That's everything in the right place relative to the tops of
+            # their trees; now move each tree so that its centre of mass is
+            # where it would have coasted to.
+            engine.locations += startCentres + total * centreVelocities - self._centres(weights, engine.locations)
+            engine.velocities += centreVelocities - self._centres(weights, engine.velocities)
+            engine.stateChanged()
+            return total
+        return FixedStepIntegrator.advance(self, engine, time)
+
+
+    def step(self, engine, stepSize):
+        # Kick-drift-kick for everything that's off the rails, as in
+        # Leapfrog, with everything on them moved exactly.
+        free = ~self.onRails
+        motion = self._railsMotion(engine, stepSize)
+        halfStep = 0.5 * stepSize
+        engine.velocities[free] += halfStep * engine.calculateAccelerations()[free]
+        engine.locations[free] += stepSize * engine.velocities[free]
+        self._placeRails(engine, motion, engine.locations, motion[2])
+        engine.stateChanged()
+        engine.velocities[free] += halfStep * engine.calculateAccelerations()[free]
+        self._placeRails(engine, motion, engine.velocities, motion[3])
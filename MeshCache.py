@@ -0,0 +1,102 @@
+import math
+
+import numpy
+
+from Graphics import *
+
+
+# Tessellations we're prepared to build spheres at.  Keeping it to a few
+# means only a few display lists per sphere.
+SPHERE_DETAIL_LEVELS = (8, 12, 16, 24, 40, 64)
+
+# Aim for polygon edges about this many pixels long around the limb, unless
+# meshCache.limbSegmentPixels says otherwise
+LIMB_SEGMENT_PIXELS = 6
+
+
+def sphereDetail(pixelRadius):
+    # Slices and stacks for a sphere that will be pixelRadius pixels across
+    # on screen; None means we don't know, so have the full 40.
+    if pixelRadius is None:
+        return 40
+    wanted = 2 * math.pi * pixelRadius / meshCache.limbSegmentPixels
+    for detail in SPHERE_DETAIL_LEVELS:
+        if detail >= wanted:
+            return detail
+    return SPHERE_DETAIL_LEVELS[-1]
+
+
+def sphereDetailLevels(pixelRadii):
+    # The same for a whole array of spheres at once, as indexes into
+    # SPHERE_DETAIL_LEVELS
+    wanted = 2 * math.pi * numpy.asarray(pixelRadii, dtype=numpy.float64) / meshCache.limbSegmentPixels
+    return numpy.minimum(numpy.searchsorted(SPHERE_DETAIL_LEVELS, wanted), len(SPHERE_DETAIL_LEVELS) - 1)
+
+
+
+def _quadric(shape, inside, textured, *arguments):
+    quad = gluNewQuadric()
+    if inside:
+        gluQuadricOrientation(quad, GLU_INSIDE)
+    else:
+        gluQuadricOrientation(quad, GLU_OUTSIDE)
+    if textured:
+        gluQuadricTexture(quad, GL_TRUE)
+    else:
+        gluQuadricTexture(quad, GL_FALSE)
+    shape(quad, *arguments)
+    gluDeleteQuadric(quad)
+
+
+class MeshCache(object):
+
+    # Tessellating quadrics through GLU costs a lot of Python-side calls,
+    # so each distinct shape is built once into a display list, and after
+    # that drawing it is a single glCallList.
+
+    def __init__(self):
+        self.displayLists = {}
+        # Coarser to make spheres cheaper; see FrameScheduler
+        self.limbSegmentPixels = LIMB_SEGMENT_PIXELS
+
+
+    def draw(self, key, build):
+        displayList = self.displayLists.get(key)
+        if displayList is None:
+            displayList = glGenLists(1)
+            glNewList(displayList, GL_COMPILE)
+            build()
+            glEndList()
+            self.displayLists[key] = displayList
+        glCallList(displayList)
+
+
+    def sphere(self, radius, slices, stacks, inside=False, textured=False):
+        self.draw(
+            ("sphere", radius, slices, stacks, inside, textured),
+            lambda: _quadric(gluSphere, inside, textured, radius, slices, stacks)
+        )
+
+
+    def cylinder(self, baseRadius, topRadius, height, slices, stacks, inside=False, textured=False):
+        self.draw(
+            ("cylinder", baseRadius, topRadius, height, slices, stacks, inside, textured),
+            lambda: _quadric(gluCylinder, inside, textured, baseRadius, topRadius, height, slices, stacks)
+        )
+
+
+    def disk(self, innerRadius, outerRadius, slices, loops, inside=False, textured=False):
+        self.draw(
+            ("disk", innerRadius, outerRadius, slices, loops, inside, textured),
+            lambda: _quadric(gluDisk, inside, textured, innerRadius, outerRadius, slices, loops)
+        )
+
+
+    def clear(self):
+        for displayList in self.displayLists.values():
+            glDeleteLists(displayList, 1)
+        self.displayLists = {}
+
+
+# Display lists belong to the GL context, and we only ever have one
+meshCache = MeshCache()
@@ -0,0 +1,214 @@
+import math
+import threading
+import traceback
+
+import numpy
+
+from Graphics import *
+
+from DirectGravity import DirectGravity
+from WorldObject import G
+
+
+class OrbitPredictor(threading.Thread):
+
+    # Works out where the user's spaceship is going by running a private
+    # copy of the universe forward on a background thread.  The path is
+    # kept relative to a reference body, so that an orbit around the Earth
+    # draws as an ellipse around the Earth rather than as a spiral round
+    # the Sun.  As time passes, points we've reached are dropped from the
+    # front and the prediction is carried on from where it left off; it's
+    # only started again from scratch when the ship does something new,
+    # the reference body changes or orbits does.
+
+    # Fraction of the ship's orbital timescale per prediction step
+    stepAccuracy = 0.01
+
+    # Bodies lighter than this fraction of the heaviest don't set the step
+    attractorMassRatio = 1e-12
+
+    def __init__(self, orbits=2, maxPoints=8192, maxDuration=30 * 86400, stepsPerCycle=2000):
+        threading.Thread.__init__(self, name="orbit predictor")
+        self.daemon = True
+        self.orbits = orbits
+        self.maxPoints = maxPoints
+        self.maxDuration = maxDuration
+        self.stepsPerCycle = stepsPerCycle
+        self.gravitySolver = DirectGravity()
+        self.running = True
+
+        # The latest state of the universe from update, replaced as a whole
+        self.inputs = None
+        self.wakeUp = threading.Event()
+
+        # Predicted times and ship locations relative to the reference body;
+        # again replaced as a whole so the renderer can pick them up at
+        # any time.
+        self.path = numpy.zeros(0), numpy.zeros((0, 3))
+
+        self.version = None
+        # The version and orbits the last prediction failed for; there's no
+        # trying again until one of them changes.
+        self.failed = None
+        self.predictedOrbits = None
+        self.pathStart = 0
+        self.pathEnd = 0
+
+
+    def update(self, simulatedTime, masses, locations, velocities, shipIndex, referenceIndex,
+               thrustAcceleration, version):
+        # Called from the frame loop with state that nobody's going to
+        # change under us: a snapshot, or copies.
+        self.inputs = (simulatedTime, masses, locations, velocities, shipIndex, referenceIndex,
+                       numpy.array(thrustAcceleration, dtype=numpy.float64), (version, referenceIndex))
+        self.wakeUp.set()
+
+
+    def stop(self):
+        self.running = False
+        self.wakeUp.set()
+        self.join()
+
+
+    def run(self):
+        while self.running:
+            self.wakeUp.wait(0.1)
+            self.wakeUp.clear()
+            inputs = self.inputs
+            if inputs is None or (inputs[-1], self.orbits) == self.failed:
+                continue
+            try:
+                self._predict(inputs)
+            except Exception:
+                # Not worth stopping the explorer for; just don't show an
+                # orbit until there's something new to predict
+                print "Orbit prediction failed:"
+                traceback.print_exc()
+                self.failed = inputs[-1], self.orbits
+                self.version = None
+                self.path = numpy.zeros(0), numpy.zeros((0, 3))
+
+
+    def _predict(self, inputs):
+        simulatedTime = inputs[0]
+        if (inputs[-1] != self.version or self.orbits != self.predictedOrbits or
+                self.pathStart == self.pathEnd or simulatedTime < self.times[self.pathStart]):
+            self._restart(inputs)
+        else:
+            # Forget what's already happened, keeping the last point
+            # before now so that the line reaches the ship.
+            passed = numpy.searchsorted(self.times[self.pathStart:self.pathEnd], simulatedTime, "right")
+            self.pathStart += max(int(passed) - 1, 0)
+        if self._extend() or self.pathStart != self.publishedStart:
+            self.publishedStart = self.pathStart
+            self.path = (
+                self.times[self.pathStart:self.pathEnd].copy(),
+                self.points[self.pathStart:self.pathEnd].copy(),
+            )
+
+
+    def _restart(self, inputs):
+        simulatedTime, masses, locations, velocities, shipIndex, referenceIndex, thrust, version = inputs
+        self.version = version
+        self.predictedOrbits = self.orbits
+        self.masses = numpy.array(masses, dtype=numpy.float64)
+        self.locations = numpy.array(locations, dtype=numpy.float64)
+        self.velocities = numpy.array(velocities, dtype=numpy.float64)
+        self.shipIndex = shipIndex
+        self.referenceIndex = referenceIndex
+        self.thrust = thrust
+        self.attractors = numpy.flatnonzero(self.masses >= self.attractorMassRatio * self.masses.max())
+        self.attractors = self.attractors[self.attractors != shipIndex]
+        self.accelerations = self._accelerations()
+
+        self.time = simulatedTime
+        self.startTime = simulatedTime
+        self.times = numpy.empty(self.maxPoints)
+        self.points = numpy.empty((self.maxPoints, 3))
+        # Total angle swept round the reference body by each point
+        self.angles = numpy.empty(self.maxPoints)
+        self.pathStart = 0
+        self.pathEnd = 0
+        self.publishedStart = None
+        self._append(0.0)
+
+
+    def _accelerations(self):
+        accelerations = self.gravitySolver.accelerations(self.locations, self.masses, self.attractors)
+        accelerations[self.shipIndex] += self.thrust
+        return accelerations
+
+
+    def _relativeShipLocation(self):
+        return self.locations[self.shipIndex] - self.locations[self.referenceIndex]
+
+
+    def _append(self, angle):
+        if self.pathEnd == self.maxPoints:
+            # Out of room: shuffle what we're still using down to the start
+            count = self.pathEnd - self.pathStart
+            for array in (self.times, self.points, self.angles):
+                array[:count] = array[self.pathStart:self.pathEnd]
+            self.pathStart, self.pathEnd = 0, count
+        self.times[self.pathEnd] = self.time
+        self.points[self.pathEnd] = self._relativeShipLocation()
+        self.angles[self.pathEnd] = angle
+        self.pathEnd += 1
+
+
+    def _stepSize(self):
+        # Much as for PhysicsEngine.stableStepSize, but only the ship's
+        # timescale matters here.
+        displacements = (self.locations[self.attractors] - self.locations[self.shipIndex]) * 1000
+        distancesCubed = (displacements ** 2).sum(axis=1) ** 1.5
+        return self.stepAccuracy * math.sqrt((distancesCubed / (G * self.masses[self.attractors])).min())
+
+
+    def _extend(self):
+        # Carries on the prediction until it covers enough orbits ahead of
+        # the ship, or as far as we're prepared to go, a cycle's worth of
+        # steps at a time.  Returns whether anything was added.
+        steps = 0
+        target = 2 * math.pi * self.orbits
+        while (steps < self.stepsPerCycle and
+               self.angles[self.pathEnd - 1] - self.angles[self.pathStart] < target and
+               self.pathEnd - self.pathStart < self.maxPoints and
+               self.time - self.times[self.pathStart] < self.maxDuration):
+            before = self._relativeShipLocation()
+
+            # Leapfrog, as in Integrators, with the step chosen afresh each
+            # time; not symplectic any more, but plenty for a preview.
+            stepSize = self._stepSize()
+            self.velocities += 0.5 * stepSize * self.accelerations
+            self.locations += stepSize * self.velocities
+            self.accelerations = self._accelerations()
+            self.velocities += 0.5 * stepSize * self.accelerations
+            self.time += stepSize
+
+            after = self._relativeShipLocation()
+            cosine = numpy.dot(before, after) / (numpy.linalg.norm(before) * numpy.linalg.norm(after))
+            self._append(self.angles[self.pathEnd - 1] + math.acos(min(max(cosine, -1.0), 1.0)))
+            steps += 1
+        return steps > 0
+
+
+    def draw(self, shipLocation, referenceLocation, color=(0.3, 0.8, 1.0, 0.6)):
+        # Locations are the ones the universe was just drawn with, so the
+        # path lines up with the bodies on screen.
+        times, points = self.path
+        if len(points) < 2:
+            return
+        vertices = (points + (numpy.asarray(referenceLocation) - numpy.asarray(shipLocation))).astype(numpy.float32)
+
+        glPushAttrib(GL_ENABLE_BIT | GL_CURRENT_BIT | GL_COLOR_BUFFER_BIT | GL_LINE_BIT)
+        glPushClientAttrib(GL_CLIENT_VERTEX_ARRAY_BIT)
+        glDisable(GL_LIGHTING)
+        glDisable(GL_TEXTURE_2D)
+        glEnable(GL_BLEND)
+        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+        glColor4f(*color)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glVertexPointer(3, GL_FLOAT, 0, vertices)
+        glDrawArrays(GL_LINE_STRIP, 0, len(vertices))
+        glPopClientAttrib()
+        glPopAttrib()
@@ -0,0 +1,141 @@
+import numpy
+
+from DirectGravity import DirectGravity
+from Integrators import Leapfrog
+from WorldObject import G
+
+
+class PhysicsEngine(object):
+
+    # Fraction of the shortest orbital timescale in the system that we're
+    # prepared to take as a single step
+    stepAccuracy = 0.01
+
+    # Bodies lighter than this fraction of the heaviest one don't count as
+    # attractors when working out that timescale
+    attractorMassRatio = 1e-12
+
+    # Bodies lighter than this fraction of the heaviest one are test
+    # particles unless they say otherwise: they feel everything else's
+    # gravity, but aren't sources of any themselves.  A spaceship around
+    # the Sun is 5e-25 of it; the smallest asteroid worth simulating a
+    # good deal more.
+    testParticleMassRatio = 1e-20
+
+    def __init__(self, objects, gravitySolver=None, integrator=None, catalogs=()):
+        if gravitySolver is None:
+            gravitySolver = DirectGravity()
+        self.gravitySolver = gravitySolver
+
+        if integrator is None:
+            integrator = Leapfrog()
+        self.integrator = integrator
+
+        # Simulated seconds since the start
+        self.time = 0.0
+
+        self.objects = list(objects)
+        self.catalogs = list(catalogs)
+        count = len(self.objects) + sum(len(catalog) for catalog in self.catalogs)
+
+        self.masses = numpy.empty(count, dtype=numpy.float64)
+        self.locations = numpy.empty((count, 3), dtype=numpy.float64)
+        self.velocities = numpy.empty((count, 3), dtype=numpy.float64)
+
+        # Explicit choices of massless or not, where anything's made one
+        self.forcedMassless = numpy.zeros(count, dtype=bool)
+        self.forcedMassive = numpy.zeros(count, dtype=bool)
+
+        # Bodies that have been put somewhere new since the last tick,
+        # rather than travelling there, like the user's spaceship when it
+        # jumps; Universe tells BroadPhase, then clears them.
+        self.jumped = numpy.zeros(count, dtype=bool)
+
+        for index, obj in enumerate(self.objects):
+            self.masses[index] = obj.mass
+            self.forcedMassless[index] = obj.massless is True
+            self.forcedMassive[index] = obj.massless is False
+            self.locations[index] = obj.location
+            self.velocities[index] = obj.velocity
+            obj.attach(self, index)
+
+        # Bodies from catalogs come after the objects, with no object of
+        # their own; their columns are copied across a whole catalog at a
+        # time.
+        start = len(self.objects)
+        for catalog in self.catalogs:
+            end = start + len(catalog)
+            self.masses[start:end] = catalog.masses
+            self.locations[start:end] = catalog.locations
+            self.locations[start:end] += catalog.locationOffset
+            self.velocities[start:end] = catalog.velocities
+            self.velocities[start:end] += catalog.velocityOffset
+            self.forcedMassless[start:end] = catalog.massless is True
+            self.forcedMassive[start:end] = catalog.massless is False
+            start = end
+
+        self.propelledObjects = [obj for obj in self.objects if obj.propelled]
+        self.spinningObjects = [obj for obj in self.objects if obj.rotationPeriod]
+
+        self.stateChanged()
+
+
+    def stateChanged(self):
+        # Anything that writes to locations or masses must call this so that
+        # we don't reuse stale gravity.
+        self._gravity = None
+
+
+    def sources(self):
+        # Indexes of the bodies whose gravity counts; the rest are test
+        # particles
+        if not len(self.masses):
+            return numpy.zeros(0, dtype=numpy.intp)
+        light = self.masses < self.testParticleMassRatio * self.masses.max()
+        massless = (light & ~self.forcedMassive) | self.forcedMassless
+        return numpy.flatnonzero(~massless)
+
+
+    def calculateGravity(self, locations=None):
+        if locations is not None:
+            return self.gravitySolver.accelerations(locations, self.masses, self.sources())
+        if self._gravity is None:
+            self._gravity = self.gravitySolver.accelerations(self.locations, self.masses, self.sources())
+        return self._gravity
+
+
+    def calculateAccelerations(self, locations=None):
+        accelerations = self.calculateGravity(locations).copy()
+        for obj in self.propelledObjects:
+            accelerations[obj.index] += obj.thrustAcceleration()
+        return accelerations
+
+
+    def accelerateAndMove(self, time, exact=False):
+        # The integrator moves everything at once from forces calculated on
+        # a consistent snapshot of the universe, in fixed substeps if it
+        # uses them, and tells us how much simulated time actually passed.
+        # Fixed substeps leave part of a step over for next time, unless
+        # exact is set, when that's stepped through as well.
+        elapsed = self.integrator.advance(self, time)
+        if exact:
+            elapsed += self.integrator.flush(self)
+        self.time += elapsed
+
+        for obj in self.spinningObjects:
+            obj.spin(elapsed)
+
+
+    def stableStepSize(self):
+        # The shortest timescale sqrt(r**3 / G(M + m)) between any body and
+        # anything heavy enough to matter is roughly its orbital period over
+        # 2 pi; a small fraction of that keeps the integrators stable.
+        if len(self.masses) < 2:
+            return float("inf")
+        attractors = numpy.flatnonzero(self.masses >= self.attractorMassRatio * self.masses.max())
+        displacements = (self.locations[:, numpy.newaxis, :] - self.locations[attractors][numpy.newaxis, :, :]) * 1000
+        distancesCubed = ((displacements ** 2).sum(axis=2)) ** 1.5
+        totalMasses = self.masses[:, numpy.newaxis] + self.masses[attractors][numpy.newaxis, :]
+        # No body is its own attractor
+        distancesCubed[attractors, numpy.arange(len(attractors))] = numpy.inf
+        return self.stepAccuracy * numpy.sqrt((distancesCubed / (G * totalMasses)).min())
@@ -0,0 +1,242 @@
+import bisect
+import json
+import os
+import time
+
+import numpy
+
+from Transforms import Quaternion
+
+
+MAGIC = "EXPREC01"
+
+HEADER_DTYPE = numpy.dtype([
+    ("magic", "S8"),
+    ("bodyCount", "<u4"),
+    ("capacity", "<u4"),
+    # Records ever written; the oldest one still there is written - capacity
+    ("written", "<u8"),
+])
+
+# The records start on a boundary like this
+ALIGNMENT = 64
+
+
+def _recordDtype(bodyCount):
+    # Locations need all of float64 to tell a space station from the ship
+    # at solar system distances; velocities and thrust are fine in float32.
+    return numpy.dtype([
+        ("time", "<f8"),
+        ("locations", "<f8", (bodyCount, 3)),
+        ("velocities", "<f4", (bodyCount, 3)),
+        ("orientation", "<f8", (4,)),
+        ("thrust", "<f4"),
+    ])
+
+
+def _eventsPath(path):
+    return path + ".events"
+
+
+class Recorder(object):
+
+    # Keeps the last `capacity` ticks of every object's location and
+    # velocity, plus the user's spaceship's orientation and thrust, in a
+    # memory-mapped ring buffer; records are in time order around the ring,
+    # so the time column doubles as an index into it.  Whatever the user
+    # did goes to a JSON-lines log alongside.
+
+    def __init__(self, path, universe, capacity=216000):
+        self.path = path
+        self.bodyCount = len(universe.objects)
+        recordDtype = _recordDtype(self.bodyCount)
+        recordsOffset = (HEADER_DTYPE.itemsize + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+        with open(path, "wb") as recording:
+            recording.truncate(recordsOffset + recordDtype.itemsize * capacity)
+        self.header = numpy.memmap(path, dtype=HEADER_DTYPE, mode="r+", shape=(1,))
+        self.header["magic"] = MAGIC
+        self.header["bodyCount"] = self.bodyCount
+        self.header["capacity"] = capacity
+        self.header["written"] = 0
+        self.records = numpy.memmap(path, dtype=recordDtype, mode="r+", offset=recordsOffset, shape=(capacity,))
+        self.capacity = capacity
+        self.written = 0
+
+        self.events = open(_eventsPath(path), "w")
+        self._writeEvent({
+            "time": universe.engine.time,
+            "event": "start",
+            "names": [obj.name for obj in universe.objects],
+            "scenario": universe.scenario.filename,
+        })
+
+
+    def record(self, universe):
+        engine = universe.engine
+        ship = universe.userSpaceship
+        record = self.records[self.written % self.capacity]
+        record["time"] = engine.time
+        record["locations"] = engine.locations[:self.bodyCount]
+        record["velocities"] = engine.velocities[:self.bodyCount]
+        orientation = ship.orientation
+        record["orientation"] = (orientation.w, orientation.x, orientation.y, orientation.z)
+        record["thrust"] = ship.thrust
+        # Only count it once it's all there
+        self.written += 1
+        self.header["written"] = self.written
+
+
+    def _writeEvent(self, event):
+        self.events.write(json.dumps(event) + "\n")
+        self.events.flush()
+
+
+    def logged(self, function, engine):
+        # Wraps up a command so that it's logged with the simulated time at
+        # which it actually happens.
+        def run(*arguments):
+            self._writeEvent({
+                "time": engine.time,
+                "wallTime": time.time(),
+                "event": function.__name__,
+                "arguments": arguments,
+            })
+            return function(*arguments)
+        return run
+
+
+    def close(self):
+        self.records.flush()
+        self.header.flush()
+        self.events.close()
+
+
+class Replay(object):
+
+    # Reads back a recording.  Seeking is a binary search on the time
+    # column, and between two records positions are filled in with cubic
+    # Hermite interpolation from both ends' velocities, which keeps orbits
+    # round even when the ticks were a long way apart.
+
+    def __init__(self, path):
+        header = numpy.memmap(path, dtype=HEADER_DTYPE, mode="r", shape=(1,))[0]
+        if header["magic"] != MAGIC:
+            raise IOError("%s is not a recording" % path)
+        self.bodyCount = int(header["bodyCount"])
+        capacity = int(header["capacity"])
+        written = int(header["written"])
+        recordsOffset = (HEADER_DTYPE.itemsize + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+        records = numpy.memmap(path, dtype=_recordDtype(self.bodyCount), mode="r", offset=recordsOffset, shape=(capacity,))
+        if written == 0:
+            raise IOError("%s has nothing recorded in it" % path)
+
+        # Once it's wrapped, the ring is two runs in time order: from the
+        # oldest record to the end of the file, then from the start of the
+        # file up to the newest.
+        oldest = written % capacity if written > capacity else 0
+        self.count = min(written, capacity)
+        self.segments = [records[oldest:self.count], records[:oldest]]
+        self.times = [segment["time"] for segment in self.segments]
+
+        self.events = []
+        self.names = None
+        self.scenario = None
+        if os.path.exists(_eventsPath(path)):
+            with open(_eventsPath(path)) as events:
+                for line in events:
+                    event = json.loads(line)
+                    if event["event"] == "start":
+                        self.names = event["names"]
+                        self.scenario = event.get("scenario")
+                    else:
+                        self.events.append((event["time"], event["event"]))
+        self.eventTimes = [eventTime for eventTime, _ in self.events]
+
+
+    def __len__(self):
+        return self.count
+
+
+    def _record(self, index):
+        first = len(self.segments[0])
+        if index < first:
+            return self.segments[0][index]
+        return self.segments[1][index - first]
+
+
+    @property
+    def startTime(self):
+        return float(self._record(0)["time"])
+
+
+    @property
+    def endTime(self):
+        return float(self._record(self.count - 1)["time"])
+
+
+    def find(self, simulatedTime):
+        # Index of the last record at or before simulatedTime, or -1 if
+        # they're all after it.
+        first = len(self.segments[0])
+        if first and self.times[0][-1] > simulatedTime:
+            return int(numpy.searchsorted(self.times[0], simulatedTime, "right")) - 1
+        return first + int(numpy.searchsorted(self.times[1], simulatedTime, "right")) - 1
+
+
+    def stateAt(self, simulatedTime):
+        # (locations, velocities, orientation, thrust) at simulatedTime,
+        # clamped to what was recorded.
+        index = min(max(self.find(simulatedTime), 0), self.count - 1)
+        before = self._record(index)
+        if index == self.count - 1 or simulatedTime <= before["time"]:
+            return (before["locations"].copy(), before["velocities"].astype(numpy.float64),
+                    Quaternion(*before["orientation"]), float(before["thrust"]))
+
+        after = self._record(index + 1)
+        span = after["time"] - before["time"]
+        t = (simulatedTime - before["time"]) / span
+        velocitiesBefore = before["velocities"].astype(numpy.float64)
+        velocitiesAfter = after["velocities"].astype(numpy.float64)
+        locations = (
+            (2 * t ** 3 - 3 * t ** 2 + 1) * before["locations"] +
+            (t ** 3 - 2 * t ** 2 + t) * span * velocitiesBefore +
+            (-2 * t ** 3 + 3 * t ** 2) * after["locations"] +
+            (t ** 3 - t ** 2) * span * velocitiesAfter
+        )
+        velocities = velocitiesBefore + (velocitiesAfter - velocitiesBefore) * t
+
+        # Normalised lerp between the orientations, the short way round
+        orientationBefore = before["orientation"]
+        orientationAfter = after["orientation"]
+        if numpy.dot(orientationBefore, orientationAfter) < 0:
+            orientationAfter = -orientationAfter
+        orientation = Quaternion(*(orientationBefore + (orientationAfter - orientationBefore) * t)).normalised()
+
+        return locations, velocities, orientation, float(before["thrust"])
+
+
+    def apply(self, universe, simulatedTime):
+        # Puts the universe into the state it was in at simulatedTime,
+        # without any physics.
+        if len(universe.objects) != self.bodyCount:
+            raise ValueError("recording has %d objects but the universe has %d" % (self.bodyCount, len(universe.objects)))
+        locations, velocities, orientation, thrust = self.stateAt(simulatedTime)
+        engine = universe.engine
+        engine.locations[:self.bodyCount] = locations
+        engine.velocities[:self.bodyCount] = velocities
+        engine.jumped[:self.bodyCount] = True
+        engine.time = min(max(simulatedTime, self.startTime), self.endTime)
+        engine.stateChanged()
+        universe.userSpaceship.orientation = orientation
+        universe.userSpaceship.thrust = thrust
+        for obj in engine.spinningObjects:
+            obj.rotation = (360. * engine.time / obj.rotationPeriod) % 360
+
+
+    def lastEvent(self, simulatedTime):
+        # The most recent (time, name) of whatever the user did, if anything
+        index = bisect.bisect_right(self.eventTimes, simulatedTime) - 1
+        if index < 0:
+            return None
+        return self.events[index]
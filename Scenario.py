@@ -0,0 +1,129 @@
+import json
+import os
+
+from Catalog import Catalog
+from Earth import Earth
+from SpaceStation import SpaceStation
+from Sun import Sun
+from UserSpaceship import UserSpaceship
+
+
+# What a body's "type" can be
+BODY_TYPES = dict((cls.__name__, cls) for cls in (Sun, Earth, UserSpaceship, SpaceStation))
+
+# Attributes a body's "render" section may set
+RENDER_HINTS = ("radius", "markerColor", "color", "textureFile")
+
+
+class Scenario(object):
+
+    # The starting state of a universe, as read from a JSON file like this:
+    #
+    #   {
+    #     "description": "...",
+    #     "bodies": [
+    #       {"type": "Sun", "location": [0, 0, 0], "velocity": [0, 0, 0]},
+    #       {"type": "Earth", "relativeTo": "The Sun",
+    #        "location": [79262956, -128906582, -13927363], "velocity": [24.85, 15.34, 2.499],
+    #        "render": {"markerColor": [0.4, 0.6, 1]}},
+    #       ...
+    #     ],
+    #     "catalogs": [{"file": "belt.cat", "relativeTo": "The Sun"}],
+    #     "dashboardRelativeTo": "Earth"
+    #   }
+    #
+    # Locations are in km and velocities in km/s; with relativeTo, they're
+    # relative to a body earlier in the list, found by name.  "mass" and
+    # "name" are optional and default to whatever the type has.  Catalogs
+    # are the binary files from Catalog.py, for when there are far too many
+    # bodies to list one by one; their paths are relative to the scenario.
+    # Bodies and catalogs can say "massless": true to be test particles,
+    # which feel gravity without causing any, or false to always count as
+    # a source of it; otherwise it goes by mass (see PhysicsEngine).
+
+    def __init__(self, filename, description, objects, catalogs, userSpaceship, dashboardRelativeTo):
+        self.filename = filename
+        self.description = description
+        self.objects = objects
+        self.catalogs = catalogs
+        self.userSpaceship = userSpaceship
+        self.dashboardRelativeTo = dashboardRelativeTo
+
+
+def _vector(filename, entry, key):
+    value = entry.get(key, (0, 0, 0))
+    if len(value) != 3:
+        raise ValueError("%s: %s of %s should have three components" % (filename, key, entry))
+    return tuple(float(component) for component in value)
+
+
+def loadScenario(filename):
+    with open(filename) as source:
+        return scenarioFromDefinition(json.load(source), filename)
+
+
+def scenarioFromDefinition(definition, filename):
+    # definition is what's in a scenario file, already parsed; filename is
+    # where it came from, for error messages and to find catalogs relative
+    # to.
+    objects = []
+    byName = {}
+
+    def find(name):
+        if name not in byName:
+            raise ValueError("%s: no body called %r before it's referred to" % (filename, name))
+        return byName[name]
+
+    for entry in definition.get("bodies", []):
+        cls = BODY_TYPES.get(entry.get("type"))
+        if cls is None:
+            raise ValueError("%s: unknown body type %r; expected one of %s" % (
+                filename, entry.get("type"), ", ".join(sorted(BODY_TYPES))
+            ))
+
+        x, y, z = _vector(filename, entry, "location")
+        vX, vY, vZ = _vector(filename, entry, "velocity")
+        if "relativeTo" in entry:
+            primary = find(entry["relativeTo"])
+            location = primary.offset(x, y, z)
+            velocity = primary.relativeVelocity(vX, vY, vZ)
+        else:
+            location = x, y, z
+            velocity = vX, vY, vZ
+
+        obj = cls(location, velocity)
+        if "mass" in entry:
+            obj.mass = float(entry["mass"])
+        if "name" in entry:
+            obj.name = entry["name"]
+        if "massless" in entry:
+            obj.massless = bool(entry["massless"])
+        for hint, value in entry.get("render", {}).items():
+            if hint not in RENDER_HINTS:
+                raise ValueError("%s: unknown render hint %r for %s" % (filename, hint, obj.name))
+            setattr(obj, hint, tuple(value) if isinstance(value, list) else value)
+
+        objects.append(obj)
+        byName[obj.name] = obj
+
+    userSpaceships = [obj for obj in objects if isinstance(obj, UserSpaceship)]
+    if len(userSpaceships) != 1:
+        raise ValueError("%s: needs exactly one UserSpaceship, found %d" % (filename, len(userSpaceships)))
+
+    catalogs = []
+    for entry in definition.get("catalogs", []):
+        catalog = Catalog(os.path.join(os.path.dirname(filename), entry["file"]))
+        if "relativeTo" in entry:
+            primary = find(entry["relativeTo"])
+            catalog.locationOffset[:] = primary.location
+            catalog.velocityOffset[:] = primary.velocity
+        if "massless" in entry:
+            catalog.massless = bool(entry["massless"])
+        catalogs.append(catalog)
+
+    if "dashboardRelativeTo" in definition:
+        dashboardRelativeTo = find(definition["dashboardRelativeTo"])
+    else:
+        dashboardRelativeTo = objects[0]
+
+    return Scenario(filename, definition.get("description", ""), objects, catalogs, userSpaceships[0], dashboardRelativeTo)
@@ -0,0 +1,110 @@
+import collections
+import sys
+import threading
+import time
+import traceback
+
+
+class Snapshot(object):
+
+    # The state of the universe after one tick.  Never modified once it's
+    # published, so the renderer can use it without any locking.
+
+    def __init__(self, simulatedTime, wallTime, locations, velocities):
+        self.simulatedTime = simulatedTime
+        self.wallTime = wallTime
+        self.locations = locations
+        self.velocities = velocities
+
+
+class SimulationThread(threading.Thread):
+
+    # Runs the universe at a fixed tick rate on its own thread, so that a
+    # slow physics step doesn't cost frames and waiting for vsync doesn't
+    # cost physics.  NumPy and PyOpenGL both let go of the GIL while they
+    # work, so the two really do overlap.
+
+    def __init__(self, universe, tickRate=60):
+        threading.Thread.__init__(self, name="simulation")
+        self.daemon = True
+        self.universe = universe
+        self.tickLength = 1. / tickRate
+        self.running = True
+        # What stopped the simulation, as sys.exc_info(), for the main loop
+        # to raise again; see check
+        self.error = None
+
+        # Commands from the UI, as (function, arguments).  deque's append and
+        # popleft are atomic, so producer and consumer never need a lock.
+        self.commands = collections.deque()
+
+        # The previous and latest snapshots, always replaced together as a
+        # single tuple so that readers see a consistent pair.
+        first = self._snapshot()
+        self.snapshots = first, first
+
+
+    def _snapshot(self):
+        engine = self.universe.engine
+        return Snapshot(engine.time, time.time(), engine.locations.copy(), engine.velocities.copy())
+
+
+    def post(self, function, *arguments):
+        self.commands.append((function, arguments))
+
+
+    def stop(self):
+        self.running = False
+        self.join()
+
+
+    def check(self):
+        # Called by the main loop, so that anything that went wrong over here
+        # stops the program, with the traceback from where it happened.
+        if self.error is not None:
+            exceptionType, value, tb = self.error
+            raise exceptionType, value, tb
+
+
+    def run(self):
+        nextTick = time.time()
+        while self.running:
+            try:
+                self._tick()
+            except Exception:
+                print "The simulation has stopped:"
+                traceback.print_exc()
+                self.error = sys.exc_info()
+                self.running = False
+                return
+
+            nextTick += self.tickLength
+            delay = nextTick - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -0.25:
+                # We've fallen a long way behind, presumably because the steps
+                # are too expensive; give up on catching up.
+                nextTick = time.time()
+
+
+    def _tick(self):
+        while self.commands:
+            function, arguments = self.commands.popleft()
+            function(*arguments)
+
+        with self.universe.profiler.phase("physics"):
+            self.universe.accelerateAndMove(self.tickLength)
+        self.snapshots = self.snapshots[1], self._snapshot()
+
+
+    def interpolatedLocations(self):
+        # Render one tick in the past, so that there's almost always a pair
+        # of snapshots either side of the time we're drawing.
+        previous, latest = self.snapshots
+        span = latest.wallTime - previous.wallTime
+        if span <= 0:
+            return latest.locations
+        fraction = (time.time() - self.tickLength - previous.wallTime) / span
+        fraction = min(max(fraction, 0.0), 1.0)
+        return previous.locations + (latest.locations - previous.locations) * fraction
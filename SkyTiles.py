@@ -0,0 +1,319 @@
+import collections
+import json
+import math
+import os
+import threading
+
+import numpy
+
+from Graphics import *
+
+from MeshCache import meshCache
+
+
+# The pyramid's description, in its directory alongside the tiles
+INDEX = "sky.json"
+
+
+def tilePath(directory, level, x, y):
+    return os.path.join(directory, str(level), "%d-%d.jpg" % (x, y))
+
+
+def tileGrid(level):
+    # Tiles across and down at a level.  The sky is a longitude-latitude
+    # image twice as wide as it is high, so level 0 is two tiles side by
+    # side, and each level after that doubles both.
+    return 2 ** (level + 1), 2 ** level
+
+
+def buildPyramid(imageFile, directory, tileSize=512, levels=None):
+    # Cut a big sky image into tiles at every level of detail from two
+    # tiles for the whole sky up to about the image's own resolution.  This
+    # needs the whole image in memory once, which is fine for something
+    # done once, offline; the point is that the explorer never does.
+    import pygame
+
+    source = pygame.image.load(imageFile)
+    if source.get_bitsize() not in (24, 32):
+        converted = pygame.Surface(source.get_size(), 0, 32)
+        converted.blit(source, (0, 0))
+        source = converted
+    if levels is None:
+        levels = max(int(round(math.log(source.get_width() / (2. * tileSize), 2))), 0) + 1
+
+    for level in range(levels):
+        across, down = tileGrid(level)
+        size = (across * tileSize, down * tileSize)
+        scaled = source if size == source.get_size() else pygame.transform.smoothscale(source, size)
+        levelDirectory = os.path.dirname(tilePath(directory, level, 0, 0))
+        if not os.path.isdir(levelDirectory):
+            os.makedirs(levelDirectory)
+        for x in range(across):
+            for y in range(down):
+                tile = scaled.subsurface((x * tileSize, y * tileSize, tileSize, tileSize)).copy()
+                pygame.image.save(tile, tilePath(directory, level, x, y))
+        print "level %d: %d x %d tiles" % (level, across, down)
+        del scaled
+
+    with open(os.path.join(directory, INDEX), "w") as index:
+        json.dump({"tileSize": tileSize, "levels": levels, "source": os.path.basename(imageFile)}, index)
+
+
+def skyDirections(s, t):
+    # Where texture coordinates (s, t) end up on the sky, as unit vectors:
+    # the same mapping as gluSphere's when it's drawn inside out, so that
+    # tiles line up with the whole-sky texture underneath.
+    s, t = numpy.broadcast_arrays(numpy.asarray(s, dtype=numpy.float64), numpy.asarray(t, dtype=numpy.float64))
+    theta = 2 * math.pi * s
+    rho = math.pi * (1 - t)
+    return numpy.stack((-numpy.sin(theta) * numpy.sin(rho), numpy.cos(theta) * numpy.sin(rho), numpy.cos(rho)), axis=-1)
+
+
+class Tile(object):
+
+    def __init__(self, key, texture, displayList, size):
+        self.key = key
+        self.texture = texture
+        self.displayList = displayList
+        self.size = size
+
+
+class SkyTiles(object):
+
+    # A sky too big to load in one go, drawn from a pyramid of tiles made
+    # by buildPyramid.  The coarsest level goes up as one texture straight
+    # away; on top of it go tiles from the level that matches the screen's
+    # resolution, for the part of the sky in view.  A worker thread decodes
+    # them, coarser ones and the middle of the view first, and the main
+    # thread uploads a few a frame.  Tiles that haven't been drawn for a
+    # while are thrown away, least recently used first, to keep what's on
+    # the GPU within memoryBudget bytes.
+
+    # Quads along each side of a tile's patch of sphere
+    patchSegments = 8
+
+    # Tile uploads per frame; each one is a glTexImage2D of a megabyte or so
+    uploadsPerFrame = 4
+
+    def __init__(self, directory, memoryBudget=256 << 20):
+        self.directory = directory
+        with open(os.path.join(directory, INDEX)) as index:
+            description = json.load(index)
+        self.tileSize = description["tileSize"]
+        self.levels = description["levels"]
+        self.memoryBudget = memoryBudget
+        self.tileBytes = self.tileSize * self.tileSize * 4
+
+        self.baseTexture = None
+        # Uploaded tiles, least recently drawn first
+        self.tiles = collections.OrderedDict()
+        self.used = 0
+        # Per level, where each tile's middle is on the sky and how far
+        # from that its corners go, in radians
+        self.bounds = {}
+
+        # Shared with the worker: what it should load next, best first,
+        # what it's loading now, and what it's finished
+        self.condition = threading.Condition()
+        self.wanted = []
+        self.loading = set()
+        self.ready = collections.deque()
+        self.worker = None
+
+
+    def _decode(self, key):
+        import pygame
+
+        surface = pygame.image.load(tilePath(self.directory, *key))
+        return pygame.image.tostring(surface, "RGBX", True)
+
+
+    def _work(self):
+        while True:
+            with self.condition:
+                while not self.wanted:
+                    self.condition.wait()
+                key = self.wanted.pop(0)
+                self.loading.add(key)
+            try:
+                pixels = self._decode(key)
+            except Exception, e:
+                print "Couldn't load sky tile %s: %s" % (tilePath(self.directory, *key), e)
+                pixels = None
+            self.ready.append((key, pixels))
+            with self.condition:
+                self.loading.discard(key)
+
+
+    def _texture(self, pixels, width, height):
+        texture = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, texture)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, width, height, 0, GL_RGBA, GL_UNSIGNED_BYTE, pixels)
+        return texture
+
+
+    def _loadBase(self):
+        # Level 0 is small enough to decode here and now
+        left, right = [numpy.frombuffer(self._decode((0, x, 0)), dtype=numpy.uint8) for x in (0, 1)]
+        size = self.tileSize
+        pixels = numpy.hstack((left.reshape((size, size, 4)), right.reshape((size, size, 4))))
+        self.baseTexture = self._texture(numpy.ascontiguousarray(pixels), 2 * size, size)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
+
+
+    def _patch(self, radius, key):
+        # The tile's piece of the sphere, as a display list
+        level, x, y = key
+        across, down = tileGrid(level)
+        steps = numpy.linspace(0, 1, self.patchSegments + 1)
+        displayList = glGenLists(1)
+        glNewList(displayList, GL_COMPILE)
+        for row in range(self.patchSegments):
+            # Tiles count down from the top of the image, and t up from the
+            # bottom
+            tileT = steps[row:row + 2]
+            directions = skyDirections(
+                (x + steps[:, numpy.newaxis]) / across, 1 - (y + 1 - tileT[numpy.newaxis, :]) / down
+            )
+            glBegin(GL_QUAD_STRIP)
+            for column, s in enumerate(steps):
+                for corner in (1, 0):
+                    glTexCoord2f(s, tileT[corner])
+                    glNormal3f(*-directions[column, corner])
+                    glVertex3f(*(radius * directions[column, corner]))
+            glEnd()
+        glEndList()
+        return displayList
+
+
+    def _bounds(self, level):
+        if level not in self.bounds:
+            across, down = tileGrid(level)
+            xs, ys = numpy.meshgrid(numpy.arange(across), numpy.arange(down), indexing="ij")
+            xs, ys = xs.ravel(), ys.ravel()
+            middles = skyDirections((xs + 0.5) / across, 1 - (ys + 0.5) / down)
+            # The corners and the middles of the edges
+            extents = numpy.zeros(len(xs))
+            for dx, dy in ((0, 0), (0.5, 0), (1, 0), (0, 0.5), (1, 0.5), (0, 1), (0.5, 1), (1, 1)):
+                edge = skyDirections((xs + dx) / across, 1 - (ys + dy) / down)
+                cosines = numpy.clip((middles * edge).sum(axis=1), -1, 1)
+                extents = numpy.maximum(extents, numpy.arccos(cosines))
+            self.bounds[level] = xs, ys, middles, extents
+        return self.bounds[level]
+
+
+    def _visible(self, level, view, halfAngle):
+        # The tiles at a level that might be on screen, nearest the middle
+        # of the view first
+        xs, ys, middles, extents = self._bounds(level)
+        angles = numpy.arccos(numpy.clip(middles.dot(view), -1, 1))
+        inView = numpy.flatnonzero(angles < halfAngle + extents)
+        inView = inView[numpy.argsort(angles[inView], kind="mergesort")]
+        return [(level, int(xs[index]), int(ys[index])) for index in inView]
+
+
+    def _view(self, camera):
+        # Which way the camera's looking in the sky's frame, the angle from
+        # there to the corners of the screen, and pixels per radian in the
+        # middle.  The camera looks down its own -z.
+        view = -numpy.array(camera.orientation.rotationMatrix()[2])
+        halfV = math.radians(camera.fovV) / 2
+        halfAngle = math.atan(math.tan(halfV) * math.hypot(1, camera.width / float(camera.height)))
+        return view, halfAngle, camera.pixelScale
+
+
+    def _wantedLevel(self, pixelsPerRadian):
+        # The coarsest level with at least a texel per pixel
+        for level in range(self.levels):
+            if tileGrid(level)[0] * self.tileSize / (2 * math.pi) >= pixelsPerRadian:
+                return level
+        return self.levels - 1
+
+
+    def _upload(self, radius):
+        for _ in range(self.uploadsPerFrame):
+            if not self.ready:
+                return
+            key, pixels = self.ready.popleft()
+            if pixels is None or key in self.tiles:
+                continue
+            texture = self._texture(pixels, self.tileSize, self.tileSize)
+            self.tiles[key] = Tile(key, texture, self._patch(radius, key), self.tileBytes)
+            self.used += self.tileBytes
+
+
+    def _evict(self, drawn):
+        while self.used > self.memoryBudget and self.tiles:
+            key, tile = next(self.tiles.iteritems())
+            if key in drawn:
+                return
+            del self.tiles[key]
+            glDeleteTextures([tile.texture])
+            glDeleteLists(tile.displayList, 1)
+            self.used -= tile.size
+
+
+    def draw(self, radius, camera=None):
+        # Without a camera, there's no knowing what's in view, so it's just
+        # the coarsest level
+        if self.baseTexture is None:
+            self._loadBase()
+        glBindTexture(GL_TEXTURE_2D, self.baseTexture)
+        meshCache.sphere(radius, 40, 40, inside=True, textured=True)
+        if self.levels < 2 or camera is None:
+            return
+
+        self._upload(radius)
+        view, halfAngle, pixelsPerRadian = self._view(camera)
+        # Everything in view from level 1 up to the one we want, coarsest
+        # first, but no more than fits in the budget
+        visible = []
+        for level in range(1, self._wantedLevel(pixelsPerRadian) + 1):
+            visible.extend(self._visible(level, view, halfAngle))
+        del visible[self.memoryBudget // self.tileBytes:]
+
+        # Draw coarsest first, so that the finer tiles cover them
+        drawn = set()
+        for key in visible:
+            tile = self.tiles.get(key)
+            if tile is not None:
+                glBindTexture(GL_TEXTURE_2D, tile.texture)
+                glCallList(tile.displayList)
+                self.tiles[key] = self.tiles.pop(key)
+                drawn.add(key)
+        self._evict(drawn)
+
+        with self.condition:
+            decoded = set(key for key, _ in list(self.ready))
+            self.wanted = [
+                key for key in visible
+                if key not in self.tiles and key not in self.loading and key not in decoded
+            ]
+            if self.wanted:
+                self.condition.notify()
+        if self.worker is None:
+            self.worker = threading.Thread(target=self._work, name="sky tile loader")
+            self.worker.daemon = True
+            self.worker.start()
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+
+    parser = OptionParser(usage="%prog [options] IMAGE DIRECTORY")
+    parser.description = (
+        "Cut a sky image, in longitude and latitude, into a pyramid of tiles in DIRECTORY for the "
+        "explorer to stream in as it needs them."
+    )
+    parser.add_option("--tile-size", type="int", default=512,
+                      help="width and height of each tile in pixels [default: %default]")
+    parser.add_option("--levels", type="int", default=None,
+                      help="levels of detail [default: enough to reach the image's own resolution]")
+    options, positional = parser.parse_args()
+    if len(positional) != 2:
+        parser.error("expected an image and a directory")
+    buildPyramid(positional[0], positional[1], options.tile_size, options.levels)
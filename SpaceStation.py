@@ -1,7 +1,6 @@
-from OpenGL.GL import *
-from OpenGL.GLU import *
+from Graphics import *
 
-from Utils import LoadTexture
+from MeshCache import meshCache
 from WorldObject import WorldObject
 
 class SpaceStation(WorldObject):
@@ -9,6 +8,9 @@ class SpaceStation(WorldObject):
     def __init__(self, location, velocity):
         WorldObject.__init__(self, 1000000000, location, velocity)
         self.name = "Space Station"
+        self.radius = 1
+        # Docking range
+        self.proximityRange = 2
         self.rotationPeriod = 5 * 60
         self.rotation = 0
 
@@ -27,7 +29,11 @@ class SpaceStation(WorldObject):
 
     def draw(self):
         glRotatef(self.rotation, 0, 0, 1)
-        
+        # Everything else is the same every frame, so it's compiled once
+        meshCache.draw("space station", self._drawStructure)
+
+
+    def _drawStructure(self):
         self._selectColor((1, 1, 1), False)
 
         quad = gluNewQuadric()
@@ -75,9 +81,3 @@ class SpaceStation(WorldObject):
             gluCylinder(quad, 0.01, 0.01, 1, 30, 30)
             gluDeleteQuadric(quad)
             glRotatef(30, 0, 1, 0)
-
-            
-    def accelerateAndMove(self, restOfUniverse, time):
-        WorldObject.accelerateAndMove(self, restOfUniverse, time)
-        self.rotation += 360 / (self.rotationPeriod / time)
-
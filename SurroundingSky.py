@@ -1,38 +1,49 @@
-from OpenGL.GL import *
-from OpenGL.GLU import *
+import os
 
-from Utils import LoadTexture
+from Graphics import *
+
+from MeshCache import meshCache
+from SkyTiles import INDEX, SkyTiles
+from TextureCache import textureLoader
 
 class SurroundingSky(object):
     
-    def __init__(self):
+    def __init__(self, tileDirectory="sky-tiles"):
         self.radius = 10000000
-        self.texture = LoadTexture("gigapixel-milky-way.jpg")
-
+        self.textureFile = "gigapixel-milky-way.jpg"
+        self.texture = None
+        # If the image has been cut into tiles with SkyTiles.py, stream
+        # them in rather than loading the whole thing
+        self.tiles = None
+        if os.path.exists(os.path.join(tileDirectory, INDEX)):
+            self.tiles = SkyTiles(tileDirectory)
+        else:
+            print "No sky tiles in %s; showing %s scaled down to one texture." % (tileDirectory, self.textureFile)
+            print "For the full resolution sky, run: python SkyTiles.py %s %s" % (self.textureFile, tileDirectory)
+
+
+    def draw(self, camera=None):
+        if self.texture is None and self.tiles is None:
+            # Never more than the card can take in one texture, however big
+            # the image is
+            self.texture = textureLoader.request(self.textureFile, glGetIntegerv(GL_MAX_TEXTURE_SIZE))
 
-    def draw(self):
         glPushMatrix()
         
         glDisable(GL_DEPTH_TEST) 
 
-        quad = gluNewQuadric()
-
-        gluQuadricOrientation(quad, GLU_INSIDE)
-        gluQuadricTexture(quad, GL_TRUE)
-        
         glMaterialfv(GL_FRONT, GL_AMBIENT, (0, 0, 0, 0));
         glMaterialfv(GL_FRONT, GL_DIFFUSE, (0, 0, 0, 0));
         glMaterialfv(GL_FRONT, GL_SPECULAR, (0, 0, 0, 0));
         glMaterialf(GL_FRONT, GL_SHININESS, 0);
         glMaterialfv(GL_FRONT, GL_EMISSION, (1, 1, 1, 1));
         
-        glBindTexture(GL_TEXTURE_2D, self.texture)
-        gluSphere(quad, self.radius, 40, 40)
-        
-        gluDeleteQuadric(quad)
+        if self.tiles is not None:
+            self.tiles.draw(self.radius, camera)
+        else:
+            glBindTexture(GL_TEXTURE_2D, self.texture.texture)
+            meshCache.sphere(self.radius, 40, 40, inside=True, textured=True)
 
         glEnable(GL_DEPTH_TEST) 
 
         glPopMatrix()
-
-
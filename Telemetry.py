@@ -0,0 +1,372 @@
+import asyncore
+import collections
+import json
+import os
+import socket
+import stat
+import struct
+import threading
+import time
+
+import numpy
+
+
+# Every frame on the wire is this header -- payload length, kind, sequence
+# number and simulated time -- followed by its payload.
+FRAME = struct.Struct("<IBQd")
+
+# A HELLO frame's payload is JSON describing the stream, and comes first on
+# every connection.  A FULL frame is every body's state; a DELTA is what's
+# changed since the frame before it, so it's only any use to a client that
+# has that frame.
+HELLO, FULL, DELTA = 1, 2, 3
+
+COUNT = struct.Struct("<I")
+
+STATE_DTYPE = numpy.dtype([
+    ("location", "<f8", (3,)),
+    ("velocity", "<f8", (3,)),
+    ("thrust", "<f4"),
+    ("rotation", "<f4"),
+    ("orientation", "<f4", (4,)),
+])
+
+# A DELTA has two sections, each a count, that many body indexes, and that
+# many records: changes in where bodies are and how fast they're going, and
+# new values for anything else about them that's changed.
+MOTION_DTYPE = numpy.dtype([
+    ("location", "<f4", (3,)),
+    ("velocity", "<f4", (3,)),
+])
+ATTITUDE_DTYPE = numpy.dtype([
+    ("thrust", "<f4"),
+    ("rotation", "<f4"),
+    ("orientation", "<f4", (4,)),
+])
+
+INDEX_DTYPE = numpy.dtype("<u4")
+
+
+def parseAddress(address):
+    # "host:port" for TCP, anything else is the path of a Unix socket
+    host, separator, port = address.rpartition(":")
+    if separator and port.isdigit():
+        return host or "127.0.0.1", int(port)
+    return address
+
+
+def _family(address):
+    return socket.AF_INET if isinstance(address, tuple) else socket.AF_UNIX
+
+
+def _frame(kind, sequence, simulatedTime, payload):
+    return FRAME.pack(len(payload), kind, sequence, simulatedTime) + payload
+
+
+def _section(indexes, records):
+    return (COUNT.pack(len(indexes)) + indexes.astype(INDEX_DTYPE).tostring() + records.tostring())
+
+
+def _readSection(payload, offset, dtype):
+    count, = COUNT.unpack_from(payload, offset)
+    offset += COUNT.size
+    indexes = numpy.frombuffer(payload, dtype=INDEX_DTYPE, count=count, offset=offset)
+    offset += INDEX_DTYPE.itemsize * count
+    records = numpy.frombuffer(payload, dtype=dtype, count=count, offset=offset)
+    return indexes, records, offset + dtype.itemsize * count
+
+
+def applyDelta(state, payload):
+    # What both ends do to get from one frame's state to the next, which
+    # has to be exactly the same arithmetic on each, or they drift apart.
+    indexes, motion, offset = _readSection(payload, 0, MOTION_DTYPE)
+    state["location"][indexes] += motion["location"].astype(numpy.float64)
+    state["velocity"][indexes] += motion["velocity"].astype(numpy.float64)
+    indexes, attitude, offset = _readSection(payload, offset, ATTITUDE_DTYPE)
+    for field in ATTITUDE_DTYPE.names:
+        state[field][indexes] = attitude[field]
+
+
+class TelemetryConnection(asyncore.dispatcher):
+
+    def __init__(self, server, connection):
+        asyncore.dispatcher.__init__(self, connection, map=server.map)
+        self.server = server
+        self.buffer = collections.deque()
+        self.buffered = 0
+        # Sequence number of the last frame queued for this client, which a
+        # DELTA has to follow on from; None until it's had a FULL one.
+        self.lastSequence = None
+        self.dropped = 0
+        self.queue(server.hello)
+
+
+    def queue(self, frame):
+        self.buffer.append(frame)
+        self.buffered += len(frame)
+
+
+    def offer(self, sequence, full, delta):
+        # Keep up with the frames if we can.  A client that's too far
+        # behind misses some, and then has to start again from a FULL one.
+        if self.lastSequence is not None and self.lastSequence + 1 == sequence:
+            frame = delta
+        else:
+            frame = full
+        if frame is None or self.buffered + len(frame) > self.server.maxBuffered:
+            if frame is not None or self.lastSequence is not None:
+                self.dropped += 1
+            self.lastSequence = None
+            self.server.fullRequests += 1
+            return
+        self.queue(frame)
+        self.lastSequence = sequence
+
+
+    def writable(self):
+        return bool(self.buffer)
+
+
+    def handle_read(self):
+        # Clients have nothing to say; this is just to notice them going
+        self.recv(4096)
+
+
+    def handle_write(self):
+        while self.buffer:
+            frame = self.buffer[0]
+            sent = self.send(frame)
+            self.buffered -= sent
+            if sent < len(frame):
+                self.buffer[0] = frame[sent:]
+                return
+            self.buffer.popleft()
+
+
+    def handle_close(self):
+        self.close()
+
+
+class TelemetryServer(asyncore.dispatcher):
+
+    # Streams the state of every object in the universe to whoever connects
+    # to address, at up to rate frames a second.  Call publish every tick
+    # from whichever thread runs the simulation; it encodes the frame and
+    # hands it over, and everything to do with the sockets happens on a
+    # thread of our own, so the simulation never waits for a client.  Each
+    # client has a buffer of at most maxBuffered bytes, and if it can't
+    # keep up it's skipped until there's room, then sent a FULL frame to
+    # start again from.
+    #
+    # Locations and velocities go out as float32 changes from the state
+    # the clients already have, rather than from the real one, so that
+    # rounding never builds up.
+
+    # How long the network thread waits for the sockets before looking for
+    # new frames, in seconds
+    pollInterval = 0.005
+
+    def __init__(self, address, names, rate=30.0, maxBuffered=1 << 20):
+        self.map = {}
+        asyncore.dispatcher.__init__(self, map=self.map)
+        self.address = address
+        self.names = list(names)
+        self.rate = rate
+        self.maxBuffered = maxBuffered
+
+        if _family(address) == socket.AF_UNIX and os.path.exists(address):
+            if not stat.S_ISSOCK(os.stat(address).st_mode):
+                raise IOError("%s exists and isn't a socket" % address)
+            # Left behind by a server that didn't get to shut down
+            os.unlink(address)
+        self.create_socket(_family(address), socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind(address)
+        self.listen(5)
+        self.boundAddress = self.socket.getsockname()
+
+        self.hello = _frame(HELLO, 0, 0.0, json.dumps({"names": self.names, "rate": rate}))
+        # The state as the clients have it
+        self.state = numpy.zeros(len(self.names), dtype=STATE_DTYPE)
+        self.sequence = 0
+        self.lastPublished = None
+
+        # Frames waiting for the network thread, as (sequence, FULL frame
+        # or None, DELTA frame).  If that thread gets a long way behind, the
+        # oldest are thrown away, and clients resynchronise.
+        self.frames = collections.deque(maxlen=64)
+        # Bumped by the network thread whenever a client needs a FULL frame,
+        # and caught up with by publish when it makes one
+        self.fullRequests = 0
+        self.fullRequestsServed = 0
+
+        self.running = False
+        self.thread = None
+
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._serve, name="telemetry")
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        for dispatcher in self.map.values():
+            dispatcher.close()
+        if _family(self.address) == socket.AF_UNIX and os.path.exists(self.address):
+            os.unlink(self.address)
+
+
+    def clients(self):
+        return [dispatcher for dispatcher in self.map.values() if isinstance(dispatcher, TelemetryConnection)]
+
+
+    def handle_accept(self):
+        accepted = self.accept()
+        if accepted is not None:
+            TelemetryConnection(self, accepted[0])
+            self.fullRequests += 1
+
+
+    def _serve(self):
+        while self.running:
+            asyncore.loop(timeout=self.pollInterval, map=self.map, count=1)
+            while self.frames:
+                sequence, full, delta = self.frames.popleft()
+                for client in self.clients():
+                    client.offer(sequence, full, delta)
+
+
+    def _gather(self, universe):
+        engine = universe.engine
+        count = len(self.names)
+        state = numpy.zeros(count, dtype=STATE_DTYPE)
+        state["location"] = engine.locations[:count]
+        state["velocity"] = engine.velocities[:count]
+        for index, obj in enumerate(universe.objects[:count]):
+            state["thrust"][index] = getattr(obj, "thrust", 0)
+            state["rotation"][index] = getattr(obj, "rotation", 0)
+            orientation = getattr(obj, "orientation", None)
+            if orientation is None:
+                state["orientation"][index] = (1, 0, 0, 0)
+            else:
+                state["orientation"][index] = (orientation.w, orientation.x, orientation.y, orientation.z)
+        return state
+
+
+    def _delta(self, new):
+        motion = numpy.zeros(len(new), dtype=MOTION_DTYPE)
+        motion["location"] = new["location"] - self.state["location"]
+        motion["velocity"] = new["velocity"] - self.state["velocity"]
+        moved = numpy.flatnonzero(
+            motion["location"].any(axis=1) | motion["velocity"].any(axis=1)
+        )
+        attitude = numpy.zeros(len(new), dtype=ATTITUDE_DTYPE)
+        for field in ATTITUDE_DTYPE.names:
+            attitude[field] = new[field]
+        turned = numpy.flatnonzero(
+            (attitude["thrust"] != self.state["thrust"]) |
+            (attitude["rotation"] != self.state["rotation"]) |
+            (attitude["orientation"] != self.state["orientation"]).any(axis=1)
+        )
+        return _section(moved, motion[moved]) + _section(turned, attitude[turned])
+
+
+    def publish(self, universe):
+        now = time.time()
+        if self.lastPublished is not None and now - self.lastPublished < 1. / self.rate:
+            return
+        self.lastPublished = now
+        simulatedTime = universe.engine.time
+
+        state = self._gather(universe)
+        self.sequence += 1
+        if self.sequence == 1:
+            # Nothing to be a change from yet
+            self.state = state
+            delta = None
+        else:
+            payload = self._delta(state)
+            applyDelta(self.state, payload)
+            delta = _frame(DELTA, self.sequence, simulatedTime, payload)
+        full = None
+        requests = self.fullRequests
+        if requests != self.fullRequestsServed or delta is None:
+            self.fullRequestsServed = requests
+            full = _frame(FULL, self.sequence, simulatedTime, self.state.tostring())
+        self.frames.append((self.sequence, full, delta))
+
+
+class TelemetryClient(object):
+
+    # Reads the stream from a TelemetryServer.  After update(), names,
+    # sequence, time and state are as of the latest frame, and state is an
+    # array of STATE_DTYPE with a row per name.
+
+    def __init__(self, address, timeout=None):
+        self.socket = socket.socket(_family(address), socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+        self.socket.connect(address)
+        self.names = None
+        self.rate = None
+        self.sequence = None
+        self.time = None
+        self.state = None
+        # Frames that were no use because one before them went missing
+        self.skipped = 0
+
+
+    def close(self):
+        # Shut down first, so that a thread waiting in update() wakes up
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.socket.close()
+
+
+    def _read(self, size):
+        chunks = []
+        while size:
+            chunk = self.socket.recv(size)
+            if not chunk:
+                raise EOFError("telemetry server went away")
+            chunks.append(chunk)
+            size -= len(chunk)
+        return "".join(chunks)
+
+
+    def readFrame(self):
+        # The next frame, as (kind, sequence, simulated time, payload)
+        length, kind, sequence, simulatedTime = FRAME.unpack(self._read(FRAME.size))
+        return kind, sequence, simulatedTime, self._read(length)
+
+
+    def update(self):
+        # Reads until a frame changes the state, and returns its sequence
+        # number
+        while True:
+            kind, sequence, simulatedTime, payload = self.readFrame()
+            if kind == HELLO:
+                hello = json.loads(payload)
+                self.names = hello["names"]
+                self.rate = hello["rate"]
+                continue
+            if kind == FULL:
+                self.state = numpy.frombuffer(payload, dtype=STATE_DTYPE).copy()
+            elif kind == DELTA and self.state is not None and sequence == self.sequence + 1:
+                applyDelta(self.state, payload)
+            else:
+                self.skipped += 1
+                continue
+            self.sequence = sequence
+            self.time = simulatedTime
+            return sequence
+
+
+    def byName(self, name):
+        return self.state[self.names.index(name)]
@@ -0,0 +1,168 @@
+import locale
+import string
+
+import numpy
+import pygame
+
+from Graphics import *
+
+
+def _nextPowerOfTwo(value):
+    power = 1
+    while power < value:
+        power *= 2
+    return power
+
+
+class TextRenderer(object):
+
+    # Every glyph the font has to offer goes into one texture, once, and
+    # strings are drawn as textured quads out of it.  That's instead of
+    # rasterising each string with pygame and pushing its pixels through
+    # glDrawPixels every frame.
+
+    columns = 16
+    maxCachedLayouts = 512
+
+    def __init__(self, font, color=(0, 1, 0, 1)):
+        self.font = font
+        self.color = color
+        self.height = font.get_height()
+        self.characters = set(unicode(string.printable.strip() + " "))
+        self.texture = None
+        self._buildAtlas()
+
+
+    def _buildAtlas(self):
+        characters = sorted(self.characters)
+        surfaces = [self.font.render(character, True, (255, 255, 255)) for character in characters]
+
+        cellWidth = max(surface.get_width() for surface in surfaces) + 1
+        cellHeight = self.height + 1
+        rows = (len(characters) + self.columns - 1) // self.columns
+        self.atlasWidth = _nextPowerOfTwo(self.columns * cellWidth)
+        self.atlasHeight = _nextPowerOfTwo(rows * cellHeight)
+
+        atlas = pygame.Surface((self.atlasWidth, self.atlasHeight), pygame.SRCALPHA, 32)
+        atlas.fill((255, 255, 255, 0))
+        self.glyphs = {}
+        for index, (character, surface) in enumerate(zip(characters, surfaces)):
+            x = (index % self.columns) * cellWidth
+            y = (index // self.columns) * cellHeight
+            atlas.blit(surface, (x, y))
+            width, height = surface.get_size()
+            # The atlas is uploaded upside-down relative to pygame, so the
+            # top of the glyph has the larger v.
+            self.glyphs[character] = (
+                width,
+                height,
+                float(x) / self.atlasWidth,
+                1 - float(y + height) / self.atlasHeight,
+                float(x + width) / self.atlasWidth,
+                1 - float(y) / self.atlasHeight,
+            )
+
+        self.atlasData = pygame.image.tostring(atlas, "RGBA", True)
+        self.textureDirty = True
+        self.layouts = {}
+
+
+    def _upload(self):
+        if self.texture is None:
+            self.texture = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, self.texture)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, self.atlasWidth, self.atlasHeight, 0,
+                     GL_RGBA, GL_UNSIGNED_BYTE, self.atlasData)
+        self.textureDirty = False
+
+
+    def _decode(self, text):
+        # locale.format hands back byte strings, which may have non-ASCII
+        # thousands separators in them
+        if isinstance(text, str):
+            return text.decode(locale.getpreferredencoding(), "replace")
+        return text
+
+
+    def _addCharacters(self, texts):
+        # Anything new goes into the atlas in a single rebuild, which throws
+        # away every layout made with the old one
+        newCharacters = set()
+        for text in texts:
+            newCharacters.update(self._decode(text))
+        newCharacters -= self.characters
+        if newCharacters:
+            self.characters |= newCharacters
+            self._buildAtlas()
+
+
+    def layout(self, text):
+        text = self._decode(text)
+        cached = self.layouts.get(text)
+        if cached is not None:
+            return cached
+
+        self._addCharacters([text])
+
+        vertices = numpy.zeros((len(text) * 4, 2), dtype=numpy.float32)
+        textureCoordinates = numpy.zeros((len(text) * 4, 2), dtype=numpy.float32)
+        x = 0
+        for index, character in enumerate(text):
+            width, height, left, bottom, right, top = self.glyphs[character]
+            vertices[index * 4:index * 4 + 4] = ((x, 0), (x + width, 0), (x + width, height), (x, height))
+            textureCoordinates[index * 4:index * 4 + 4] = ((left, bottom), (right, bottom), (right, top), (left, top))
+            x += width
+
+        if len(self.layouts) >= self.maxCachedLayouts:
+            self.layouts = {}
+        layout = vertices, textureCoordinates, x
+        self.layouts[text] = layout
+        return layout
+
+
+    def width(self, text):
+        return self.layout(text)[2]
+
+
+    def draw(self, runs):
+        # runs is a sequence of (text, x, y) with (x, y) the bottom-left
+        # corner in window coordinates; they all go out in one draw call.
+        # The atlas has to have every character in it before any of them
+        # are laid out, or a rebuild for a later run leaves the earlier
+        # ones pointing at the old atlas.
+        self._addCharacters([text for text, _, _ in runs])
+        layouts = [(self.layout(text), x, y) for text, x, y in runs]
+        if not layouts:
+            return
+        if self.textureDirty:
+            self._upload()
+
+        vertices = numpy.concatenate([
+            layoutVertices + numpy.array((x, y), dtype=numpy.float32) for (layoutVertices, _, _), x, y in layouts
+        ])
+        textureCoordinates = numpy.concatenate([layoutCoordinates for (_, layoutCoordinates, _), _, _ in layouts])
+        if not len(vertices):
+            return
+
+        glPushAttrib(GL_ENABLE_BIT | GL_CURRENT_BIT | GL_COLOR_BUFFER_BIT | GL_TEXTURE_BIT)
+        glPushClientAttrib(GL_CLIENT_VERTEX_ARRAY_BIT)
+
+        glDisable(GL_LIGHTING)
+        glDisable(GL_DEPTH_TEST)
+        glEnable(GL_TEXTURE_2D)
+        glEnable(GL_BLEND)
+        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+        glTexEnvi(GL_TEXTURE_ENV, GL_TEXTURE_ENV_MODE, GL_MODULATE)
+        glBindTexture(GL_TEXTURE_2D, self.texture)
+        glColor4f(*self.color)
+
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+        glVertexPointer(2, GL_FLOAT, 0, vertices)
+        glTexCoordPointer(2, GL_FLOAT, 0, textureCoordinates)
+        glDrawArrays(GL_QUADS, 0, len(vertices))
+
+        glPopClientAttrib()
+        glPopAttrib()
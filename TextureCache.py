@@ -0,0 +1,252 @@
+import collections
+import hashlib
+import json
+import os
+import Queue
+import struct
+import threading
+
+import numpy
+
+from Graphics import *
+
+
+MAGIC = "EXPTEX01"
+HEADER = struct.Struct("<8sII")
+LEVEL = struct.Struct("<IIQ")
+
+
+def _nextPowerOfTwo(value):
+    power = 1
+    while power < value:
+        power *= 2
+    return power
+
+
+def _hashFile(filename):
+    digest = hashlib.sha1()
+    with open(filename, "rb") as source:
+        while True:
+            block = source.read(1 << 20)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _loadIndex(path):
+    try:
+        with open(path) as index:
+            return json.load(index)
+    except (IOError, ValueError):
+        return {}
+
+
+def _writeIndex(path, index):
+    temporaryPath = "%s.%d.tmp" % (path, os.getpid())
+    with open(temporaryPath, "w") as output:
+        json.dump(index, output)
+    os.rename(temporaryPath, path)
+
+
+def _decode(filename, maxSize):
+    import pygame
+
+    surface = pygame.image.load(filename)
+    # gluBuild2DMipmaps used to rescale to powers of two for us; now we do
+    # it, and at the same time bring it down within the size limit.
+    width = min(_nextPowerOfTwo(surface.get_width()), maxSize)
+    height = min(_nextPowerOfTwo(surface.get_height()), maxSize)
+    if (width, height) != surface.get_size():
+        if surface.get_bitsize() not in (24, 32):
+            converted = pygame.Surface(surface.get_size(), 0, 32)
+            converted.blit(surface, (0, 0))
+            surface = converted
+        surface = pygame.transform.smoothscale(surface, (width, height))
+    data = pygame.image.tostring(surface, "RGBX", True)
+    return numpy.frombuffer(data, dtype=numpy.uint8).reshape((height, width, 4))
+
+
+def _mipChain(image):
+    levels = [image]
+    while image.shape[0] > 1 or image.shape[1] > 1:
+        height, width = image.shape[:2]
+        # Box filter down by two in each dimension that's still bigger than
+        # one pixel.
+        pixels = image.astype(numpy.uint16)
+        if height > 1:
+            pixels = pixels[0::2] + pixels[1::2]
+        else:
+            pixels = pixels * 2
+        if width > 1:
+            pixels = pixels[:, 0::2] + pixels[:, 1::2]
+        else:
+            pixels = pixels * 2
+        image = ((pixels + 2) // 4).astype(numpy.uint8)
+        levels.append(image)
+    return levels
+
+
+def _writeCache(path, levels):
+    temporaryPath = "%s.%d.tmp" % (path, os.getpid())
+    with open(temporaryPath, "wb") as cache:
+        cache.write(HEADER.pack(MAGIC, len(levels), 0))
+        offset = HEADER.size + LEVEL.size * len(levels)
+        for level in levels:
+            height, width = level.shape[:2]
+            cache.write(LEVEL.pack(width, height, offset))
+            offset += level.nbytes
+        for level in levels:
+            cache.write(level.tostring())
+    # Rename into place so that a half-written file is never picked up
+    os.rename(temporaryPath, path)
+
+
+def _mapCache(path):
+    with open(path, "rb") as cache:
+        magic, levelCount, _ = HEADER.unpack(cache.read(HEADER.size))
+        if magic != MAGIC:
+            raise IOError("%s is not a texture cache file" % path)
+        levelInfo = [LEVEL.unpack(cache.read(LEVEL.size)) for _ in range(levelCount)]
+    mapped = numpy.memmap(path, dtype=numpy.uint8, mode="r")
+    return [
+        mapped[offset:offset + width * height * 4].reshape((height, width, 4))
+        for width, height, offset in levelInfo
+    ]
+
+
+class CachedTexture(object):
+
+    def __init__(self, loader, filename, maxSize):
+        self.loader = loader
+        self.filename = filename
+        self.maxSize = maxSize
+        self.loadedTexture = None
+        self.error = None
+
+
+    @property
+    def texture(self):
+        # Until the real thing arrives, everything gets drawn with a plain
+        # placeholder so that we don't hold up the first frame.
+        if self.loadedTexture is None:
+            return self.loader.placeholder()
+        return self.loadedTexture
+
+
+class TextureLoader(object):
+
+    # Decoding big JPEGs and building their mipmaps is slow, so it's done
+    # once, on a worker thread, and the results are kept on disk keyed by a
+    # hash of the source file and the size limit.  After that, loading is
+    # a memory map and some glTexImage2D calls.  Hashing a big image isn't
+    # free either, so the hashes are kept in an index beside the cache,
+    # and a file is only hashed again when its size or mtime changes.
+
+    def __init__(self, cacheDirectory=None, maxSize=4096):
+        if cacheDirectory is None:
+            cacheDirectory = os.path.join(os.path.expanduser("~"), ".explorer", "textures")
+        self.cacheDirectory = cacheDirectory
+        self.maxSize = maxSize
+        self.requests = Queue.Queue()
+        self.ready = collections.deque()
+        self.textures = {}
+        self.placeholderTexture = None
+        self.worker = None
+        # Absolute path -> [size, mtime, hash], read when first needed
+        self.index = None
+        self.indexLock = threading.Lock()
+
+
+    def request(self, filename, maxSize=None):
+        # maxSize can only bring the loader's own limit down
+        maxSize = self.maxSize if maxSize is None else min(maxSize, self.maxSize)
+        texture = self.textures.get((filename, maxSize))
+        if texture is None:
+            texture = CachedTexture(self, filename, maxSize)
+            self.textures[(filename, maxSize)] = texture
+            self.requests.put(texture)
+            if self.worker is None:
+                self.worker = threading.Thread(target=self._work, name="texture loader")
+                self.worker.daemon = True
+                self.worker.start()
+        return texture
+
+
+    def fileHash(self, filename):
+        filename = os.path.abspath(filename)
+        status = os.stat(filename)
+        key = [status.st_size, status.st_mtime]
+        indexPath = os.path.join(self.cacheDirectory, "index.json")
+        with self.indexLock:
+            if self.index is None:
+                self.index = _loadIndex(indexPath)
+            entry = self.index.get(filename)
+            if entry is None or entry[:2] != key:
+                entry = key + [_hashFile(filename)]
+                self.index[filename] = entry
+                if not os.path.isdir(self.cacheDirectory):
+                    os.makedirs(self.cacheDirectory)
+                _writeIndex(indexPath, self.index)
+            return entry[2]
+
+
+    def cachePath(self, filename, maxSize=None):
+        if maxSize is None:
+            maxSize = self.maxSize
+        return os.path.join(self.cacheDirectory, "%s-%d.mip" % (self.fileHash(filename), maxSize))
+
+
+    def loadLevels(self, filename, maxSize=None):
+        if maxSize is None:
+            maxSize = self.maxSize
+        path = self.cachePath(filename, maxSize)
+        if not os.path.exists(path):
+            if not os.path.isdir(self.cacheDirectory):
+                os.makedirs(self.cacheDirectory)
+            _writeCache(path, _mipChain(_decode(filename, maxSize)))
+        return _mapCache(path)
+
+
+    def _work(self):
+        while True:
+            texture = self.requests.get()
+            try:
+                levels = self.loadLevels(texture.filename, texture.maxSize)
+            except Exception, e:
+                texture.error = e
+                levels = None
+            self.ready.append((texture, levels))
+
+
+    def placeholder(self):
+        if self.placeholderTexture is None:
+            self.placeholderTexture = glGenTextures(1)
+            glBindTexture(GL_TEXTURE_2D, self.placeholderTexture)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+            glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, 1, 1, 0, GL_RGBA, GL_UNSIGNED_BYTE, "\x40\x40\x40\xff")
+        return self.placeholderTexture
+
+
+    def uploadPending(self):
+        # GL calls have to happen on the thread that owns the context, so
+        # the main loop calls this every frame to pick up finished loads.
+        while self.ready:
+            texture, levels = self.ready.popleft()
+            if levels is None:
+                print "Couldn't load %s: %s" % (texture.filename, texture.error)
+                continue
+            glTexture = glGenTextures(1)
+            glBindTexture(GL_TEXTURE_2D, glTexture)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_NEAREST)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+            for levelNumber, level in enumerate(levels):
+                height, width = level.shape[:2]
+                glTexImage2D(GL_TEXTURE_2D, levelNumber, GL_RGBA, width, height, 0,
+                             GL_RGBA, GL_UNSIGNED_BYTE, numpy.ascontiguousarray(level))
+            texture.loadedTexture = glTexture
+
+
+# Shared, like the GL context the textures end up in
+textureLoader = TextureLoader()
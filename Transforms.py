@@ -0,0 +1,77 @@
+import math
+
+
+class Quaternion(object):
+
+    def __init__(self, w=1.0, x=0.0, y=0.0, z=0.0):
+        self.w = w
+        self.x = x
+        self.y = y
+        self.z = z
+
+
+    @classmethod
+    def fromAxisAngle(cls, angle, axis):
+        # Same arguments as glRotatef: angle in degrees, axis needn't be
+        # normalised.
+        axisX, axisY, axisZ = axis
+        length = math.sqrt(axisX ** 2 + axisY ** 2 + axisZ ** 2)
+        halfAngle = math.radians(angle) / 2
+        scale = math.sin(halfAngle) / length
+        return cls(math.cos(halfAngle), axisX * scale, axisY * scale, axisZ * scale)
+
+
+    def __mul__(self, other):
+        # Composes like matrices: (a * b) rotates by b first, then a
+        return Quaternion(
+            self.w * other.w - self.x * other.x - self.y * other.y - self.z * other.z,
+            self.w * other.x + self.x * other.w + self.y * other.z - self.z * other.y,
+            self.w * other.y - self.x * other.z + self.y * other.w + self.z * other.x,
+            self.w * other.z + self.x * other.y - self.y * other.x + self.z * other.w
+        )
+
+
+    def __repr__(self):
+        return "Quaternion(%r, %r, %r, %r)" % (self.w, self.x, self.y, self.z)
+
+
+    def normalised(self):
+        # Repeatedly multiplying lets rounding errors creep in, which would
+        # start to scale and shear things; renormalising keeps it a rotation.
+        length = math.sqrt(self.w ** 2 + self.x ** 2 + self.y ** 2 + self.z ** 2)
+        return Quaternion(self.w / length, self.x / length, self.y / length, self.z / length)
+
+
+    def conjugate(self):
+        return Quaternion(self.w, -self.x, -self.y, -self.z)
+
+
+    def rotationMatrix(self):
+        # 3x3, as rows
+        w, x, y, z = self.w, self.x, self.y, self.z
+        return (
+            (1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y)),
+            (2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x)),
+            (2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y)),
+        )
+
+
+    def rotate(self, vector):
+        vX, vY, vZ = vector
+        (r00, r01, r02), (r10, r11, r12), (r20, r21, r22) = self.rotationMatrix()
+        return (
+            r00 * vX + r01 * vY + r02 * vZ,
+            r10 * vX + r11 * vY + r12 * vZ,
+            r20 * vX + r21 * vY + r22 * vZ
+        )
+
+
+    def matrix(self):
+        # 4x4 in OpenGL's column-major order, ready for glMultMatrixf
+        (r00, r01, r02), (r10, r11, r12), (r20, r21, r22) = self.rotationMatrix()
+        return (
+            r00, r10, r20, 0,
+            r01, r11, r21, 0,
+            r02, r12, r22, 0,
+            0, 0, 0, 1
+        )
@@ -1,45 +1,121 @@
-from Earth import Earth
-from SpaceStation import SpaceStation
-from Sun import Sun
-from SurroundingSky import SurroundingSky
-from UserSpaceship import UserSpaceship
+import collections
+import os
+import time
+
+import numpy
+
+from Graphics import *
+
+from BroadPhase import BroadPhase
+from FrameProfiler import FrameProfiler
+from PhysicsEngine import PhysicsEngine
+from Scenario import loadScenario
 
 
 class Universe(object):
 
-    def __init__(self):
-        self.sky = SurroundingSky()
+    # Objects smaller than this on screen are drawn as a single point
+    markerPixelRadius = 0.5
+
+    TIME_WARPS = (1, 10, 100, 1000, 10000, 100000)
+
+    # Fraction of each interval's wall-clock time that physics may use
+    # before we start turning the time warp down
+    computeBudget = 0.6
+
+    # Where the universe starts out if we're not told otherwise
+    defaultScenario = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scenarios", "default.json")
+
+    def __init__(self, gravitySolver=None, integrator=None, extraObjects=(), scenario=None, headless=False):
+        # headless leaves out the sky and the renderers, for programs that
+        # never draw; see simulate.py
+        self.sky = None
+        if not headless:
+            from SurroundingSky import SurroundingSky
+            self.sky = SurroundingSky()
+
+        # scenario is a Scenario, or the name of a file to load one from;
+        # see Scenario for the format, and the scenarios directory for some
+        # other interesting starting points.
+        if scenario is None:
+            scenario = self.defaultScenario
+        if isinstance(scenario, basestring):
+            scenario = loadScenario(scenario)
+        self.scenario = scenario
+        self.userSpaceship = scenario.userSpaceship
 
-        sun = Sun((0, 0, 0), (0, 0, 0))
+        self.objects = list(scenario.objects)
+        # Anything else to put in the same universe, like the asteroids that
+        # benchmark.py uses to see how we scale
+        self.objects.extend(extraObjects)
 
-        earth = Earth(sun.offset(79262956, -128906582, -13927363), (24.85, 15.34, 2.499))
+        # Leave gravitySolver as None for the exact all-pairs sum, or pass
+        # in something like BarnesHutGravity(theta=0.5) for big scenes.
+        # Likewise the integrator defaults to fixed-step Leapfrog; see
+        # Integrators for the others.
+        self.engine = PhysicsEngine(self.objects, gravitySolver, integrator, scenario.catalogs)
 
-        # Some interesting values:
-        #  Distant orbit
-        #self.userSpaceship = UserSpaceship(earth.offset(0, 0, 19999), earth.relativeVelocity(-4.4667, 0, 0))
-        #  Roughly as high as the ISS
-        self.userSpaceship = UserSpaceship(earth.offset(0, 0, earth.radius + 340), earth.relativeVelocity(-7.73, 0, 0))
-        #  GEO
-        # self.userSpaceship = UserSpaceship(earth.offset(0, 0, 42164), earth.relativeVelocity(-3.07, 0, 0))
-        #  Here's a good resource for finding velocity for a circular orbit at a given altitude,
-        #  though you need to remember that it's altitude and not distance from the centre of the
-        #  Earth: <http://home.att.net/~ntdoug/UCM2.html>
+        # The step size we use at normal speed, or for integrators that
+        # choose their own, the most they may take, with None for no limit;
+        # time warp scales it up, as far as stability allows.
+        self.baseStepSize = self.engine.integrator.baseStepSize
+        # What the user asked for, and what we can actually keep up with
+        self.timeWarp = 1
+        self.effectiveWarp = 1
 
-        spaceStation = SpaceStation(earth.offset(1, 1, earth.radius + 335), earth.relativeVelocity(-7.73, 0, 0))
+        # For every body, including the ones in catalogs
+        self.radii = numpy.concatenate(
+            [numpy.array([obj.radius for obj in self.objects], dtype=numpy.float64)] +
+            [catalog.radii for catalog in scenario.catalogs]
+        )
+        self.markerColors = numpy.concatenate(
+            [numpy.array([obj.markerColor for obj in self.objects], dtype=numpy.float32).reshape((-1, 3))] +
+            [catalog.colors for catalog in scenario.catalogs]
+        ).astype(numpy.float32)
+        # Everything that can be drawn as an instanced sphere, which is what
+        # catalog bodies look like close up
+        self.instanced = numpy.concatenate([
+            numpy.array([obj.instanceMesh == "sphere" for obj in self.objects], dtype=bool),
+            numpy.ones(len(self.radii) - len(self.objects), dtype=bool),
+        ])
+        self.instancedRenderer = None
+        if not headless:
+            from InstancedRenderer import InstancedRenderer
+            self.instancedRenderer = InstancedRenderer()
 
-        self.objects = []
-        self.objects.append(sun)
-        self.objects.append(earth)
-        self.objects.append(self.userSpaceship)
-        self.objects.append(spaceStation)
+        # Which bodies are touching or near one another, kept up to date
+        # every tick; catalog bodies have no range of their own.
+        self.broadPhase = BroadPhase(self.radii, numpy.concatenate([
+            numpy.array([obj.proximityRange for obj in self.objects], dtype=numpy.float64),
+            numpy.zeros(len(self.radii) - len(self.objects)),
+        ]))
+        self.broadPhase.update(self.engine.locations, self.engine.velocities)
+        # What the dashboard says about the user's spaceship's surroundings;
+        # see _surroundings.  Worked out on whichever thread runs the
+        # simulation, while the broad phase is in one piece, and only ever
+        # replaced as a whole, so the renderer can read it at any time.
+        self.shipSurroundings = self._surroundings()
+        # The latest collision and proximity events, as (simulated time,
+        # kind, name, name); see BroadPhase.update for the kinds.
+        self.events = collections.deque(maxlen=100)
 
-        self.initialDashboardRelativeTo = earth
+        # Counts from the last draw: drawn in full, drawn as points, culled,
+        # and how many of those drawn in full were instanced
+        self.renderStats = {"drawn": 0, "markers": 0, "culled": 0, "instanced": 0}
+        self.profiler = FrameProfiler()
+        # Gets every tick, if we're being recorded; see Recorder
+        self.recorder = None
+        # Likewise, if we're streaming to other programs; see Telemetry
+        self.telemetry = None
 
+        self.initialDashboardRelativeTo = scenario.dashboardRelativeTo
 
-    def draw(self):
+
+    def draw(self, camera=None, locations=None):
         # Draw the sky separately...
         if self.sky:
-            self.sky.draw()
+            with self.profiler.phase("sky"):
+                self.sky.draw(camera)
         
         # In a normal OpenGL scene, we'd now do something like this:
         #   glTranslatef(-cX, -cY, -cZ)
@@ -53,13 +129,181 @@ class Universe(object):
         # starts jiggling around.  It's better to have objects that are
         # close to the camera close to the origin so that nearby objects
         # are positioned accurately, and distant ones can be out.
-        cX, cY, cZ = self.userSpaceship.location
-        for obj in self.objects:
-            obj.positionAndDraw(-cX, -cY, -cZ)
+        #
+        # locations, if given, are where to draw everything instead of where
+        # the engine currently has it.
+        if locations is None:
+            locations = self.engine.locations
+        cX, cY, cZ = locations[self.userSpaceship.index]
+        relativeLocations = locations - (cX, cY, cZ)
+        if camera is None:
+            for obj, location in zip(self.objects, locations):
+                obj.positionAndDraw(-cX, -cY, -cZ, location=location)
+            catalogBodies = len(locations) - len(self.objects)
+            if catalogBodies:
+                self._drawMarkers(relativeLocations[len(self.objects):], self.markerColors[len(self.objects):])
+            self.renderStats = {"drawn": len(self.objects), "markers": catalogBodies, "culled": 0, "instanced": 0}
+            return
+
+        # Work out what's actually worth drawing for everything in one go,
+        # rather than asking each object in turn.  Without instancing,
+        # bodies from catalogs have nothing to draw them in any detail, so
+        # they're only ever markers.
+        visible, pixelRadii = camera.cull(self.radii, relativeLocations)
+        full = visible & (pixelRadii >= self.markerPixelRadius)
+        if self.instancedRenderer is not None and self.instancedRenderer.available():
+            instanced = full & self.instanced
+        else:
+            instanced = numpy.zeros_like(full)
+            full[len(self.objects):] = False
+        markers = visible & ~full
+
+        for index in numpy.flatnonzero(full & ~instanced):
+            obj = self.objects[index]
+            with self.profiler.phase("draw %s" % obj.name):
+                obj.positionAndDraw(-cX, -cY, -cZ, camera, locations[index])
+        if instanced.any():
+            with self.profiler.phase("instanced"):
+                self.instancedRenderer.drawSpheres(
+                    relativeLocations[instanced], self.radii[instanced],
+                    self.markerColors[instanced], pixelRadii[instanced]
+                )
+        if markers.any():
+            with self.profiler.phase("markers"):
+                self._drawMarkers(relativeLocations[markers], self.markerColors[markers])
+
+        drawn = int(full.sum())
+        markerCount = int(markers.sum())
+        self.renderStats = {
+            "drawn": drawn,
+            "markers": markerCount,
+            "culled": len(locations) - drawn - markerCount,
+            "instanced": int(instanced.sum()),
+        }
+
+
+    def _drawMarkers(self, relativeLocations, colors):
+        glPushAttrib(GL_ENABLE_BIT | GL_POINT_BIT)
+        glPushClientAttrib(GL_CLIENT_VERTEX_ARRAY_BIT)
+        glDisable(GL_LIGHTING)
+        glDisable(GL_TEXTURE_2D)
+        glPointSize(2)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_COLOR_ARRAY)
+        glVertexPointer(3, GL_FLOAT, 0, relativeLocations.astype(numpy.float32))
+        glColorPointer(3, GL_FLOAT, 0, numpy.ascontiguousarray(colors))
+        glDrawArrays(GL_POINTS, 0, len(relativeLocations))
+        glPopClientAttrib()
+        glPopAttrib()
 
         
-    def accelerateAndMove(self, time):
-        for objectToMove in self.objects:
-            objectToMove.accelerateAndMove(self.objects, time)
+    def changeTimeWarp(self, change):
+        index = self.TIME_WARPS.index(self.timeWarp) + change
+        self.timeWarp = self.TIME_WARPS[min(max(index, 0), len(self.TIME_WARPS) - 1)]
+        self.effectiveWarp = min(self.effectiveWarp, self.timeWarp)
+
+
+    def accelerateAndMove(self, interval, exact=False):
+        # exact steps all the way to the end of the interval, rather than
+        # leaving what doesn't make a whole step for next time; see
+        # PhysicsEngine.accelerateAndMove
+        started = time.time()
+
+        # Substeps as long as the warp calls for, but not lengthened so far
+        # that orbits go unstable; the integrator covers the interval with
+        # as many of them as it takes.  Unwarped, they're whatever size the
+        # integrator was made with.
+        stepSize = self.baseStepSize
+        if stepSize is not None and self.effectiveWarp > 1:
+            stepSize = max(stepSize, min(stepSize * self.effectiveWarp, self.engine.stableStepSize()))
+        self.engine.integrator.limitStepSize(stepSize)
+        startTime = self.engine.time
+        self.engine.accelerateAndMove(interval * self.effectiveWarp, exact)
+        self._detectCollisions(self.engine.time - startTime)
+        self.shipSurroundings = self._surroundings()
+        if self.recorder is not None:
+            self.recorder.record(self)
+        if self.telemetry is not None:
+            self.telemetry.publish(self)
+
+        self._adjustWarp(interval, time.time() - started)
+
+
+    def _detectCollisions(self, interval):
+        engine = self.engine
+        events = self.broadPhase.update(engine.locations, engine.velocities, interval, engine.jumped)
+        engine.jumped[:] = False
+        for kind, first, second in events:
+            self.events.append((engine.time, kind, self.bodyName(first), self.bodyName(second)))
+
+        # Nothing much happens when other things collide, but the user's
+        # spaceship lands on whatever it runs into: it's put back on the
+        # surface, moving with it, for as long as it's pushing into it.
+        ship = self.userSpaceship
+        for other in self.broadPhase.partners(ship.index, self.broadPhase.contacts):
+            normal = self.broadPhase.contactNormal(ship.index, other)
+            engine.locations[ship.index] = engine.locations[other] + normal * (self.radii[other] + ship.radius)
+            relativeVelocity = engine.velocities[ship.index] - engine.velocities[other]
+            inwards = numpy.dot(relativeVelocity, normal)
+            if inwards < 0:
+                engine.velocities[ship.index] = engine.velocities[other]
+            engine.stateChanged()
+            self.broadPhase.locations[ship.index] = engine.locations[ship.index]
+            self.broadPhase.velocities[ship.index] = engine.velocities[ship.index]
+            # Not where anything predicting the ship thought it would be
+            ship.trajectoryVersion += 1
+
+
+    def bodyName(self, index):
+        if index < len(self.objects):
+            return self.objects[index].name
+        return "catalog body %d" % (index - len(self.objects))
+
+
+    def nearestObject(self, obj):
+        # Whichever named object's surface is closest to obj
+        candidates = numpy.zeros(len(self.radii), dtype=bool)
+        candidates[:len(self.objects)] = True
+        found, _ = self.broadPhase.nearest(obj.index, 1, candidates)
+        if not len(found):
+            return None
+        return self.objects[found[0]]
+
+
+    def _surroundings(self):
+        # The nearest named object to the user's spaceship, and the names
+        # of whatever it's landed on and whatever it's in range of
+        ship = self.userSpaceship
+        return (
+            self.nearestObject(ship),
+            [self.bodyName(other) for other in self.broadPhase.partners(ship.index, self.broadPhase.contacts)],
+            [self.bodyName(other) for other in self.broadPhase.partners(ship.index, self.broadPhase.nearby)],
+        )
+
+
+    def _adjustWarp(self, interval, computeTime):
+        # Going over budget costs warp rather than frame rate; once there's
+        # room again, creep back up towards what was asked for.
+        if interval <= 0:
+            return
+        budget = self.computeBudget * interval
+        if computeTime > budget and self.effectiveWarp > 1:
+            self.effectiveWarp = max(1, self.effectiveWarp * max(0.5, budget / computeTime))
+        elif computeTime < budget / 2 and self.effectiveWarp < self.timeWarp:
+            self.effectiveWarp = min(self.timeWarp, self.effectiveWarp * 2)
+
 
-            
+    def dumpState(self):
+        return {
+            "time": self.engine.time,
+            "objects": [
+                {
+                    "name": obj.name,
+                    "mass": obj.mass,
+                    "location": obj.location,
+                    "velocity": obj.velocity,
+                }
+                for obj in self.objects
+            ],
+            "catalogBodies": len(self.engine.masses) - len(self.objects),
+        }
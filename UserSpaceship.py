@@ -1,64 +1,79 @@
 import math
 
-from OpenGL.GL import *
-from OpenGL.GLU import *
+from Graphics import *
 
+from MeshCache import meshCache
+from Transforms import Quaternion
 from WorldObject import WorldObject
 
 
 class UserSpaceship(WorldObject):
 
+    propelled = True
+
     def __init__(self, location, velocity):
         WorldObject.__init__(self, 1000000, location, velocity)
-        self.thrust = 0
-        
-        glPushMatrix()
-        glLoadIdentity()
-        glRotatef(180, 0, 1, 0)
-        self.rotationMatrix = glGetFloatv(GL_MODELVIEW_MATRIX)
-        glPopMatrix()
+        self.name = "User Spaceship"
+        self.radius = 0.05
+        # Goes up whenever the user does something that changes where we're
+        # heading, so that anything predicting it knows to start again.
+        self.trajectoryVersion = 0
+        self.__thrust = 0
+
+        # Orientation is kept on the CPU and only handed to GL when we draw,
+        # so steering and thrust never have to read anything back from it.
+        self.orientation = Quaternion.fromAxisAngle(180, (0, 1, 0))
+
+
+    @property
+    def rotationMatrix(self):
+        return self.orientation.matrix()
 
 
     def rotateBy(self, angle, (axisX, axisY, axisZ)):
-        glPushMatrix()
-        glLoadMatrixf(self.rotationMatrix)
-        glRotatef(angle, axisX, axisY, axisZ)
-        self.rotationMatrix = glGetFloatv(GL_MODELVIEW_MATRIX)
-        glPopMatrix()
+        # Same as glRotatef on top of the current orientation, so the
+        # rotation is about the spaceship's own axes.
+        rotation = Quaternion.fromAxisAngle(angle, (axisX, axisY, axisZ))
+        self.orientation = (self.orientation * rotation).normalised()
+        self.trajectoryVersion += 1
 
 
     def jump(self):
         x, y, z = self.location
         dX, dY, dZ = self.vectorPointingForward(250000)
         self.location = x + dX, y + dY, z + dZ
+        self.trajectoryVersion += 1
         
 
+    def adjustThrust(self, change):
+        self.thrust += change
+
+
+    def cutThrust(self):
+        self.thrust = 0
+
+
     @property
     def thrust(self):
         return self.__thrust
 
     @thrust.setter
     def thrust(self, value):
+        value = max(value, 0)
+        if value != self.__thrust:
+            self.trajectoryVersion += 1
         self.__thrust = value
-        if self.__thrust < 0:
-            self.__thrust = 0
 
 
     def vectorPointingForward(self, length):
-        glPushMatrix()
-        glLoadMatrixf(self.rotationMatrix)
-        glTranslatef(0, 0, length)
-        rotated = glGetFloatv(GL_MODELVIEW_MATRIX)
-        glPopMatrix()
-        rX, rY, rZ, _ = rotated[3]
-        return rX, rY, rZ
-
-
-    def calculateAccelerationVector(self, restOfUniverse):
-        aX, aY, aZ = WorldObject.calculateAccelerationVector(self, restOfUniverse)
-        tX, tY, tZ = self.vectorPointingForward(self.thrust)
-        return aX + tX, aY + tY, aZ + tZ
-        
+        return self.orientation.rotate((0, 0, length))
+
+
+    def thrustAcceleration(self):
+        if not self.thrust:
+            return 0, 0, 0
+        return self.vectorPointingForward(self.thrust)
+
 
     def _selectColor(self, color, emission):
         r, g, b = color
@@ -89,12 +104,14 @@ class UserSpaceship(WorldObject):
             color = (1, 1, 1)
             emission = False
 
-        quad = gluNewQuadric()
-        gluQuadricOrientation(quad, GLU_INSIDE)
         self._selectColor(color, emission)
-        gluDisk(quad, 0, baseRadius, 30, 30)
-        gluDeleteQuadric(quad)
+        meshCache.disk(0, baseRadius, 30, 30, inside=True)
+
+        # The rest never changes, so it's compiled once
+        meshCache.draw("user spaceship", lambda: self._drawBody(length, baseRadius))
+
 
+    def _drawBody(self, length, baseRadius):
         # Tailfins
 
         self._selectColor((1, 1, 1), False)
@@ -1,4 +1,4 @@
-from OpenGL.GL import *
+from Graphics import *
 
 import math
 
@@ -9,16 +9,112 @@ G = 6.67428 * 10**-11
 
 class WorldObject(object):
 
+    # Objects that accelerate under their own power set this and
+    # implement thrustAcceleration
+    propelled = False
+
+    # Seconds per revolution for objects that spin; see spin
+    rotationPeriod = None
+
+    # Size of a sphere that contains the object, in km
+    radius = 0
+
+    # What we look like when we're too small to draw properly
+    markerColor = (1, 1, 1)
+
+    # Objects that look like nothing more than a sphere of their marker
+    # colour set this to "sphere", and then however many of them there are
+    # they're drawn in one go; see InstancedRenderer
+    instanceMesh = None
+
+    # How close to our surface, in km, something else has to come before
+    # it counts as being near us; see BroadPhase
+    proximityRange = 0
+
+    # Whether we're a test particle, pulled on by gravity but too light to
+    # pull on anything else.  None leaves it to the physics engine, which
+    # goes by how our mass compares with the heaviest body's.
+    massless = None
+
     def __init__(self, mass, location, velocity):
+        self.engine = None
+        self.index = None
+        self.screenRadius = None
         self.mass = mass
         self.location = location
         self.velocity = velocity
 
-    def positionAndDraw(self, offsetX, offsetY, offsetZ):
+
+    def attach(self, engine, index):
+        # From now on our state lives in the engine's arrays, and we're
+        # just a view onto row number index of them.
+        self.engine = engine
+        self.index = index
+
+
+    @property
+    def mass(self):
+        if self.engine is None:
+            return self.__mass
+        return self.engine.masses[self.index]
+
+    @mass.setter
+    def mass(self, value):
+        if self.engine is None:
+            self.__mass = value
+        else:
+            self.engine.masses[self.index] = value
+            self.engine.stateChanged()
+
+
+    @property
+    def location(self):
+        if self.engine is None:
+            return self.__location
+        return tuple(self.engine.locations[self.index])
+
+    @location.setter
+    def location(self, value):
+        if self.engine is None:
+            self.__location = tuple(value)
+        else:
+            self.engine.locations[self.index] = value
+            self.engine.jumped[self.index] = True
+            self.engine.stateChanged()
+
+
+    @property
+    def velocity(self):
+        if self.engine is None:
+            return self.__velocity
+        return tuple(self.engine.velocities[self.index])
+
+    @velocity.setter
+    def velocity(self, value):
+        if self.engine is None:
+            self.__velocity = tuple(value)
+        else:
+            self.engine.velocities[self.index] = value
+
+
+    def positionAndDraw(self, offsetX, offsetY, offsetZ, camera=None, location=None):
+        # location lets the caller draw us somewhere other than where the
+        # engine has us right now, e.g. interpolated between two ticks.
+        if location is None:
+            location = self.location
+        x, y, z = location
+        x, y, z = x + offsetX, y + offsetY, z + offsetZ
+
+        # How big we'll be on screen in pixels, so that draw can pick a level
+        # of detail to suit.
+        if camera is None:
+            self.screenRadius = None
+        else:
+            self.screenRadius = camera.projectedRadius(self.radius, (x, y, z))
+
         glPushMatrix()
 
-        x, y, z = self.location
-        glTranslatef(x + offsetX, y + offsetY, z + offsetZ)
+        glTranslatef(x, y, z)
 
         self.draw()
 
@@ -47,62 +143,9 @@ class WorldObject(object):
         return math.sqrt((oX - sX) ** 2 + (oY - sY) ** 2 + (oZ - sZ) ** 2)
 
 
-    def calculateAccelerationVector(self, restOfUniverse):
-        acceleration = (0, 0, 0)
-        for attractiveObject in restOfUniverse:
-            if self == attractiveObject:
-                continue
-
-            # Calculate displacement in meters (for compatibility with G)
-            displacement = (
-                (self.location[0] - attractiveObject.location[0]) * 1000,
-                (self.location[1] - attractiveObject.location[1]) * 1000,
-                (self.location[2] - attractiveObject.location[2]) * 1000
-            )
-            distanceSquared = displacement[0] ** 2 + displacement[1] ** 2 + displacement[2] ** 2
-            # F=ma => a = F/m, and F = -GMm/r**2, so we can cancel out m to get acceleration
-            scalarAcceleration = - (G * attractiveObject.mass) / distanceSquared
-            distance = math.sqrt(distanceSquared)
-            unitDisplacement = (
-                displacement[0] / distance,
-                displacement[1] / distance,
-                displacement[2] / distance,
-            )
-            aX, aY, aZ = acceleration
-            acceleration = (
-                aX + scalarAcceleration * unitDisplacement[0],
-                aY + scalarAcceleration * unitDisplacement[1],
-                aZ + scalarAcceleration * unitDisplacement[2]
-            )             
-
-        # Because all of the calculations above were in meters, we now have acceleration in
-        # ms**-2.  Convert to km to fit our normal units...
-        aX, aY, aZ = acceleration
-        aX /= 1000
-        aY /= 1000
-        aZ /= 1000
-
-        return aX, aY, aZ
-
-
-    def accelerateAndMove(self, restOfUniverse, time):
-        aX, aY, aZ = self.calculateAccelerationVector(restOfUniverse)
-        x, y, z = self.location
-        vX, vY, vZ = self.velocity
-        
-        # s = ut + 0.5at**2
-        timeSquared = time ** 2
-        self.location = (
-            x + vX * time + 0.5 * aX * timeSquared,
-            y + vY * time + 0.5 * aY * timeSquared,
-            z + vZ * time + 0.5 * aZ * timeSquared
-        )
-
-        # v = u + at
-        self.velocity = (
-            vX + aX * time,
-            vY + aY * time,
-            vZ + aZ * time
-        )
+    def thrustAcceleration(self):
+        return 0, 0, 0
 
 
+    def spin(self, time):
+        self.rotation += 360. * time / self.rotationPeriod
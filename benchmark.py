@@ -0,0 +1,487 @@
+import os
+
+# The draw benchmarks never open a window; they render into an off-screen
+# context, which has to be chosen before anything imports OpenGL.  Set
+# PYOPENGL_PLATFORM=osmesa to use OSMesa instead of EGL.
+os.environ.setdefault("PYOPENGL_PLATFORM", "egl")
+os.environ.setdefault("EGL_PLATFORM", "surfaceless")
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import ctypes
+import json
+import math
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+import numpy
+
+from BarnesHutGravity import BarnesHutGravity
+from DirectGravity import DirectGravity
+from Graphics import *
+from Integrators import AdaptiveRungeKutta, Leapfrog, RungeKutta4
+from Kepler import KeplerHybrid
+from MeshCache import meshCache, sphereDetail
+from Scenario import loadScenario
+from TextureCache import TextureLoader
+from Universe import Universe
+from WorldObject import WorldObject, G
+
+
+FORMAT_VERSION = 1
+
+SUN_MASS = 1.9891 * 10**30
+
+
+class Asteroid(WorldObject):
+
+    radius = 0.5
+    markerColor = (0.6, 0.6, 0.6)
+    instanceMesh = "sphere"
+
+    def __init__(self, number, mass, location, velocity):
+        WorldObject.__init__(self, mass, location, velocity)
+        self.name = "Asteroid %d" % number
+
+
+    def draw(self):
+        detail = sphereDetail(self.screenRadius)
+        meshCache.sphere(self.radius, detail, detail)
+
+
+def asteroidBelt(count, seed=0):
+    # Small bodies on roughly circular orbits around the Sun, out beyond
+    # the Earth so that they don't change what the ship is doing.
+    random = numpy.random.RandomState(seed)
+    radii = random.uniform(3.3e8, 4.8e8, count)
+    angles = random.uniform(0, 2 * numpy.pi, count)
+    heights = random.normal(0, 2e7, count)
+    speeds = numpy.sqrt(G * SUN_MASS / (radii * 1000)) / 1000
+    masses = 10 ** random.uniform(12, 16, count)
+    return [
+        Asteroid(
+            number, masses[number],
+            (radii[number] * math.cos(angles[number]), radii[number] * math.sin(angles[number]), heights[number]),
+            (-speeds[number] * math.sin(angles[number]), speeds[number] * math.cos(angles[number]), 0),
+        )
+        for number in range(count)
+    ]
+
+
+class Debris(Asteroid):
+
+    radius = 0.002
+
+
+def debrisField(count, scenario, seed=0):
+    # Small bits and pieces scattered around the ship, close enough that
+    # they're all drawn properly rather than as points
+    random = numpy.random.RandomState(seed)
+    ship = scenario.userSpaceship
+    offsets = random.uniform(-1, 1, (count, 3))
+    offsets[:, 2] -= 1.5
+    return [
+        Debris(number, 1.0, ship.offset(*offsets[number]), ship.velocity)
+        for number in range(count)
+    ]
+
+
+def _timed(function, *arguments):
+    started = time.time()
+    result = function(*arguments)
+    return time.time() - started, result
+
+
+def benchmarkThroughput(bodyCounts, directLimit, minSeconds, stepSize=1.0):
+    results = []
+    for bodies in bodyCounts:
+        # The last is the asteroids as test particles, with only the Sun,
+        # Earth and so on pulling on anything
+        solvers = []
+        if bodies <= directLimit:
+            solvers.append(("direct", DirectGravity(), False))
+        if bodies >= 1000:
+            solvers.append(("barnes-hut", BarnesHutGravity(), False))
+        solvers.append(("test-particles", DirectGravity(), True))
+        for solverName, solver, massless in solvers:
+            asteroids = asteroidBelt(max(bodies - 4, 0))
+            for asteroid in asteroids:
+                asteroid.massless = massless
+            setup, universe = _timed(Universe, solver, Leapfrog(stepSize), asteroids)
+            # One step to warm up, then as many as fit in minSeconds
+            universe.accelerateAndMove(stepSize)
+            startTime = universe.engine.time
+            started = time.time()
+            while True:
+                universe.accelerateAndMove(stepSize)
+                elapsed = time.time() - started
+                if elapsed >= minSeconds:
+                    break
+            steps = int(round((universe.engine.time - startTime) / stepSize))
+            results.append({
+                "bodies": len(universe.objects),
+                "solver": solverName,
+                "steps": steps,
+                "seconds": elapsed,
+                "setupSeconds": setup,
+                "bodyStepsPerSecond": len(universe.objects) * steps / elapsed,
+            })
+            print >> sys.stderr, "throughput: %7d bodies, %-14s %12.0f body-steps/s" % (
+                len(universe.objects), solverName, results[-1]["bodyStepsPerSecond"]
+            )
+    return results
+
+
+def _energy(engine):
+    # Total kinetic plus potential energy, in joules
+    masses = engine.masses
+    velocities = engine.velocities * 1000
+    kinetic = 0.5 * (masses * (velocities ** 2).sum(axis=1)).sum()
+    locations = engine.locations * 1000
+    potential = 0.0
+    for index in range(len(masses) - 1):
+        distances = numpy.sqrt(((locations[index + 1:] - locations[index]) ** 2).sum(axis=1))
+        potential -= G * masses[index] * (masses[index + 1:] / distances).sum()
+    return kinetic + potential
+
+
+def _angularMomentum(engine):
+    # About the centre of mass, in kg m^2/s
+    masses = engine.masses[:, numpy.newaxis]
+    totalMass = masses.sum()
+    locations = engine.locations * 1000
+    velocities = engine.velocities * 1000
+    locations = locations - (masses * locations).sum(axis=0) / totalMass
+    velocities = velocities - (masses * velocities).sum(axis=0) / totalMass
+    return (masses * numpy.cross(locations, velocities)).sum(axis=0)
+
+
+def _orbitalEnergy(satellite, primary):
+    # Specific energy of satellite's orbit around primary.  The Sun's tide
+    # changes it by less than a part in 10^7, so any more drift than that
+    # is the integrator.
+    dX, dY, dZ = [(a - b) * 1000 for a, b in zip(satellite.location, primary.location)]
+    vX, vY, vZ = [(a - b) * 1000 for a, b in zip(satellite.velocity, primary.velocity)]
+    return (vX ** 2 + vY ** 2 + vZ ** 2) / 2 - G * primary.mass / math.sqrt(dX ** 2 + dY ** 2 + dZ ** 2)
+
+
+def _relativeDrift(value, initial):
+    return float(numpy.linalg.norm(numpy.subtract(value, initial)) / numpy.linalg.norm(initial))
+
+
+def benchmarkDrift(duration, sampleInterval=600.0):
+    integrators = [
+        ("leapfrog", Leapfrog(1.0)),
+        ("rk4", RungeKutta4(1.0)),
+        ("adaptive", AdaptiveRungeKutta()),
+        ("kepler", KeplerHybrid(1.0)),
+    ]
+    results = []
+    for name, integrator in integrators:
+        universe = Universe(None, integrator, headless=True)
+        engine = universe.engine
+        ship = universe.userSpaceship
+        earth = universe.initialDashboardRelativeTo
+        initialEnergy = _energy(engine)
+        initialAngularMomentum = _angularMomentum(engine)
+        initialOrbitalEnergy = _orbitalEnergy(ship, earth)
+
+        worst = {"energyDrift": 0.0, "angularMomentumDrift": 0.0, "shipOrbitEnergyDrift": 0.0}
+        started = time.time()
+        while engine.time < duration:
+            universe.accelerateAndMove(min(sampleInterval, duration - engine.time))
+            drifts = {
+                "energyDrift": _relativeDrift(_energy(engine), initialEnergy),
+                "angularMomentumDrift": _relativeDrift(_angularMomentum(engine), initialAngularMomentum),
+                "shipOrbitEnergyDrift": _relativeDrift(_orbitalEnergy(ship, earth), initialOrbitalEnergy),
+            }
+            for key in worst:
+                worst[key] = max(worst[key], drifts[key])
+
+        result = {"integrator": name, "simulatedSeconds": engine.time, "seconds": time.time() - started}
+        result.update(("final" + key[0].upper() + key[1:], value) for key, value in drifts.items())
+        result.update(("max" + key[0].upper() + key[1:], value) for key, value in worst.items())
+        results.append(result)
+        print >> sys.stderr, "drift: %-10s energy %.2e, angular momentum %.2e, ship orbit %.2e" % (
+            name, result["maxEnergyDrift"], result["maxAngularMomentumDrift"], result["maxShipOrbitEnergyDrift"]
+        )
+    return results
+
+
+def benchmarkStartup(textureFile):
+    results = {}
+    results["universeSeconds"], _ = _timed(Universe)
+
+    cacheDirectory = tempfile.mkdtemp(prefix="explorer-benchmark-")
+    try:
+        loader = TextureLoader(cacheDirectory)
+        # First time round the texture gets decoded, scaled and mipmapped;
+        # after that it's just hashed and mapped from the cache.
+        results["textureDecodeSeconds"], _ = _timed(loader.loadLevels, textureFile)
+        results["textureCachedSeconds"], levels = _timed(loader.loadLevels, textureFile)
+        results["textureBytes"] = sum(level.nbytes for level in levels)
+        del levels
+    finally:
+        shutil.rmtree(cacheDirectory, ignore_errors=True)
+
+    print >> sys.stderr, "startup: %s" % ", ".join("%s %.3g" % item for item in sorted(results.items()))
+    return results
+
+
+def headlessContext(width, height):
+    # Returns something that has to be kept alive for as long as the
+    # context is in use.
+    if os.environ["PYOPENGL_PLATFORM"] == "osmesa":
+        from OpenGL import arrays, osmesa
+        context = osmesa.OSMesaCreateContextExt(osmesa.OSMESA_RGBA, 24, 0, 0, None)
+        buffer = arrays.GLubyteArray.zeros((height, width, 4))
+        if not osmesa.OSMesaMakeCurrent(context, buffer, GL_UNSIGNED_BYTE, width, height):
+            raise RuntimeError("couldn't make the OSMesa context current")
+        return context, buffer
+
+    from OpenGL import EGL
+    display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+    major, minor = EGL.EGLint(), EGL.EGLint()
+    if not EGL.eglInitialize(display, ctypes.pointer(major), ctypes.pointer(minor)):
+        raise RuntimeError("couldn't initialise EGL")
+    attributes = (EGL.EGLint * 13)(
+        EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+        EGL.EGL_RED_SIZE, 8, EGL.EGL_GREEN_SIZE, 8, EGL.EGL_BLUE_SIZE, 8, EGL.EGL_DEPTH_SIZE, 24,
+        EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT, EGL.EGL_NONE,
+    )
+    config = EGL.EGLConfig()
+    configCount = EGL.EGLint()
+    if not EGL.eglChooseConfig(display, attributes, ctypes.pointer(config), 1, ctypes.pointer(configCount)) \
+            or not configCount.value:
+        raise RuntimeError("no suitable EGL config")
+    surface = EGL.eglCreatePbufferSurface(
+        display, config, (EGL.EGLint * 5)(EGL.EGL_WIDTH, width, EGL.EGL_HEIGHT, height, EGL.EGL_NONE)
+    )
+    EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+    context = EGL.eglCreateContext(display, config, EGL.EGL_NO_CONTEXT, None)
+    if not EGL.eglMakeCurrent(display, surface, surface, context):
+        raise RuntimeError("couldn't make the EGL context current")
+    return display, surface, context
+
+
+def _frameTimes(ui, frames):
+    times = []
+    for _ in range(frames):
+        started = time.time()
+        ui.profiler.beginFrame()
+        ui.draw()
+        glFinish()
+        ui.profiler.endFrame()
+        times.append(time.time() - started)
+    return times
+
+
+def benchmarkDraw(resolution, frames, beltBodies):
+    import locale
+    import pygame
+
+    import explorer
+    from Dashboard import Dashboard
+    from FrameProfiler import FrameProfiler
+    from TextureCache import textureLoader
+
+    context = headlessContext(*resolution)
+    pygame.init()
+    locale.setlocale(locale.LC_ALL, "")
+
+    results = {"renderer": glGetString(GL_RENDERER), "resolution": list(resolution), "scenes": {}}
+
+    ui = explorer.UI()
+    ui.resolution = resolution
+    ui.initGL()
+    universe = Universe()
+    # The night sky image isn't in the repository, and doesn't change how
+    # much work a frame is; leave it out so that nothing waits on it.
+    universe.sky = None
+    results["textRendererSeconds"], ui.dashboard = _timed(Dashboard, universe.userSpaceship)
+    ui.dashboard.relativeTo = universe.initialDashboardRelativeTo
+    ui.dashboard.universe = universe
+    ui.universe = universe
+
+    # Wait for the Earth's texture, so that its upload is timed on its own
+    earth = universe.initialDashboardRelativeTo
+    loaded = textureLoader.request(earth.textureFile)
+    while not textureLoader.ready and loaded.error is None:
+        time.sleep(0.01)
+    results["textureUploadSeconds"], _ = _timed(textureLoader.uploadPending)
+    results["firstFrameSeconds"] = _frameTimes(ui, 1)[0]
+
+    scenes = [("default", universe)]
+    if beltBodies:
+        belt = Universe(extraObjects=asteroidBelt(beltBodies))
+        belt.sky = None
+        scenes.append(("belt %d" % len(belt.objects), belt))
+
+        # The same debris field drawn instanced and then, if instancing
+        # works at all here, one object at a time
+        scenario = loadScenario(Universe.defaultScenario)
+        debris = Universe(extraObjects=debrisField(beltBodies, scenario), scenario=scenario)
+        debris.sky = None
+        scenes.append(("debris %d" % beltBodies, debris))
+        if debris.instancedRenderer.available():
+            scenario = loadScenario(Universe.defaultScenario)
+            separate = Universe(extraObjects=debrisField(beltBodies, scenario), scenario=scenario)
+            separate.sky = None
+            separate.instancedRenderer.supported = False
+            scenes.append(("debris %d, not instanced" % beltBodies, separate))
+
+    for name, scene in scenes:
+        ui.universe = ui.dashboard.universe = scene
+        ui.profiler = scene.profiler = FrameProfiler()
+        _frameTimes(ui, 3)
+        ui.profiler = scene.profiler = FrameProfiler()
+        times = sorted(_frameTimes(ui, frames))
+        results["scenes"][name] = {
+            "frames": frames,
+            "medianMilliseconds": times[len(times) // 2] * 1000,
+            "p95Milliseconds": times[min(int(0.95 * len(times)), len(times) - 1)] * 1000,
+            "phaseMilliseconds": dict((phase, average * 1000) for phase, average in ui.profiler.phaseAverages()),
+            "renderStats": dict(scene.renderStats),
+        }
+        print >> sys.stderr, "draw: %-12s %.2fms median" % (name, results["scenes"][name]["medianMilliseconds"])
+
+    del context
+    return results
+
+
+def _gitRevision():
+    try:
+        process = subprocess.Popen(
+            ["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        )
+        output, _ = process.communicate()
+        if process.returncode == 0:
+            return output.strip()
+    except OSError:
+        pass
+    return None
+
+
+def metrics(report):
+    # Everything worth comparing between two runs, flattened to name: value
+    flattened = {}
+    for result in report.get("throughput", []):
+        flattened["throughput/%s/%d bodyStepsPerSecond" % (result["solver"], result["bodies"])] = result["bodyStepsPerSecond"]
+    for result in report.get("drift", []):
+        for key in ("maxEnergyDrift", "maxAngularMomentumDrift", "maxShipOrbitEnergyDrift", "seconds"):
+            flattened["drift/%s %s" % (result["integrator"], key)] = result[key]
+    for key, value in report.get("startup", {}).items():
+        flattened["startup %s" % key] = value
+    draw = report.get("draw", {})
+    for key in ("textRendererSeconds", "textureUploadSeconds", "firstFrameSeconds"):
+        if key in draw:
+            flattened["draw %s" % key] = draw[key]
+    for name, scene in draw.get("scenes", {}).items():
+        flattened["draw/%s medianMilliseconds" % name] = scene["medianMilliseconds"]
+        flattened["draw/%s p95Milliseconds" % name] = scene["p95Milliseconds"]
+    return flattened
+
+
+def compare(oldFilename, newFilename):
+    with open(oldFilename) as old:
+        oldMetrics = metrics(json.load(old))
+    with open(newFilename) as new:
+        newMetrics = metrics(json.load(new))
+    print "%-55s %14s %14s %9s" % ("metric", "old", "new", "change")
+    for name in sorted(set(oldMetrics) | set(newMetrics)):
+        oldValue, newValue = oldMetrics.get(name), newMetrics.get(name)
+        if oldValue is None or newValue is None:
+            change = "-"
+        elif oldValue == 0:
+            change = "n/a"
+        else:
+            change = "%+.1f%%" % ((newValue - oldValue) / abs(oldValue) * 100)
+        print "%-55s %14s %14s %9s" % (
+            name,
+            "-" if oldValue is None else "%.4g" % oldValue,
+            "-" if newValue is None else "%.4g" % newValue,
+            change,
+        )
+
+
+def parseArguments(arguments):
+    parser = OptionParser(usage="%prog [options]\n       %prog --compare OLD.json NEW.json")
+    parser.description = "Time the physics and rendering and write the results as JSON, or compare two sets of results."
+    parser.add_option("--output", default=None,
+                      help="file to write the results to [default: stdout]")
+    parser.add_option("--bodies", default="4,100,1000,10000,100000",
+                      help="comma-separated body counts for the throughput runs [default: %default]")
+    parser.add_option("--direct-limit", type="int", default=5000,
+                      help="largest body count to time the exact all-pairs gravity at [default: %default]")
+    parser.add_option("--min-seconds", type="float", default=2.0,
+                      help="wall-clock time to spend on each throughput run [default: %default]")
+    parser.add_option("--drift-seconds", type="float", default=86400.0,
+                      help="simulated seconds for the energy and angular momentum runs [default: %default]")
+    parser.add_option("--frames", type="int", default=50,
+                      help="frames to time for each draw benchmark [default: %default]")
+    parser.add_option("--belt", type="int", default=10000,
+                      help="asteroids in the crowded draw benchmark [default: %default]")
+    parser.add_option("--no-draw", action="store_true", default=False,
+                      help="skip the draw benchmarks")
+    parser.add_option("--quick", action="store_true", default=False,
+                      help="much shorter runs, for checking that everything works")
+    parser.add_option("--compare", action="store_true", default=False,
+                      help="print the change in each metric between two result files")
+    options, positional = parser.parse_args(arguments)
+    if options.compare and len(positional) != 2:
+        parser.error("--compare needs the old and new result files")
+    if not options.compare and positional:
+        parser.error("unexpected arguments")
+    if options.quick:
+        options.bodies = "4,1000"
+        options.minSeconds = 0.2
+        options.driftSeconds = 3600.0
+        options.frames = 5
+        options.belt = 1000
+    else:
+        options.minSeconds = options.min_seconds
+        options.driftSeconds = options.drift_seconds
+    return options, positional
+
+
+def main(arguments):
+    options, positional = parseArguments(arguments)
+    if options.compare:
+        compare(*positional)
+        return
+
+    report = {
+        "formatVersion": FORMAT_VERSION,
+        "revision": _gitRevision(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "numpy": numpy.__version__,
+        "machine": sys.platform,
+    }
+    report["throughput"] = benchmarkThroughput(
+        [int(count) for count in options.bodies.split(",")], options.direct_limit, options.minSeconds
+    )
+    report["drift"] = benchmarkDrift(options.driftSeconds)
+    report["startup"] = benchmarkStartup("envisat-earth.jpg")
+    if not options.no_draw:
+        try:
+            report["draw"] = benchmarkDraw((640, 480), options.frames, options.belt)
+        except Exception, e:
+            print >> sys.stderr, "skipping draw benchmarks: %s" % e
+            report["draw"] = {"skipped": str(e)}
+    report["metrics"] = metrics(report)
+
+    results = json.dumps(report, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, "w") as output:
+            output.write(results)
+    else:
+        print results
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,4 +1,6 @@
 import locale
+import sys
+from optparse import OptionParser
 
 from OpenGL.GL import *
 from OpenGL.GLU import *
@@ -6,9 +8,19 @@ from OpenGL.GLU import *
 import pygame
 from pygame.locals import *
 
+from Camera import Camera
 from Dashboard import Dashboard
+from FrameProfiler import FrameProfiler
+from FrameScheduler import FrameScheduler
+from Kepler import KeplerHybrid
+from MeshCache import meshCache
+from OrbitPredictor import OrbitPredictor
+from Recorder import Recorder, Replay
+from SimulationThread import SimulationThread
+from Telemetry import TelemetryServer, parseAddress
+from TextureCache import textureLoader
+from Transforms import Quaternion
 from Universe import Universe
-from Utils import LoadTexture
 
 
 class UI(object):
@@ -28,6 +40,42 @@ class UI(object):
 
         self.cameraDistance = 0.6
 
+        # Run physics on its own thread rather than between frames
+        self.threadedPhysics = True
+        self.simulation = None
+
+        self.profiler = FrameProfiler()
+        # Paces frames and picks how much detail we can afford
+        self.scheduler = FrameScheduler()
+        # Where to write the profiler's trace on exit, if anywhere
+        self.traceFile = None
+
+        # The scenario file to start from, or None for the usual one
+        self.scenario = None
+        # Coast along closed-form orbits wherever we can; see Kepler
+        self.kepler = False
+
+        # Where to record to, if anywhere, and how many ticks to keep
+        self.recordFile = None
+        self.recordCapacity = 216000
+        self.recorder = None
+
+        # Where to stream telemetry to, if anywhere, and how often
+        self.telemetryAddress = None
+        self.telemetryRate = 30.0
+        self.telemetry = None
+
+        self.orbitPredictor = None
+        self.showOrbit = True
+
+        # A recording to watch instead of running the simulation
+        self.replayFile = None
+        self.replay = None
+        self.replayTime = 0.0
+        self.replaySpeed = 1.0
+        self.replayPaused = False
+        self.cameraOrientation = Quaternion()
+
 
     def resize(self, width, height):
         if height == 0:
@@ -48,33 +96,103 @@ class UI(object):
         glHint(GL_PERSPECTIVE_CORRECTION_HINT, GL_NICEST)
         glEnable(GL_TEXTURE_2D)
 
-        glPushMatrix()
-        glLoadIdentity()
-        self.cameraRotationMatrix = glGetFloatv(GL_MODELVIEW_MATRIX)
-        glPopMatrix()
+        textureLoader.maxSize = min(textureLoader.maxSize, glGetIntegerv(GL_MAX_TEXTURE_SIZE))
+
+
+    def command(self, function, *arguments):
+        # Anything that changes the simulation goes through here, so that
+        # when physics has its own thread it happens between ticks.
+        if self.recorder:
+            function = self.recorder.logged(function, self.universe.engine)
+        if self.simulation:
+            self.simulation.post(function, *arguments)
+        else:
+            function(*arguments)
 
 
     def handleKeys(self, key):
+        if key == K_p:
+            self.dashboard.showProfile = not self.dashboard.showProfile
+            return
+        if key == K_o:
+            self.showOrbit = not self.showOrbit
+            return
+        if key == K_n:
+            self.dashboard.autoRelativeTo = not self.dashboard.autoRelativeTo
+            return
+        if self.replay:
+            self.handleReplayKeys(key)
+            return
+
+        userSpaceship = self.universe.userSpaceship
         if key == K_LESS or key == K_COMMA:
-            self.universe.userSpaceship.thrust -= 1
+            self.command(userSpaceship.adjustThrust, -1)
         elif key == K_GREATER or key == K_PERIOD:
-            self.universe.userSpaceship.thrust += 1
+            self.command(userSpaceship.adjustThrust, 1)
         elif key == K_SLASH:
-            self.universe.userSpaceship.thrust = 0
+            self.command(userSpaceship.cutThrust)
         elif key == K_s:
-            self.universe.userSpaceship.rotateBy(3, (1, 0, 0))
+            self.command(userSpaceship.rotateBy, 3, (1, 0, 0))
         elif key == K_w:
-            self.universe.userSpaceship.rotateBy(-3, (1, 0, 0))
+            self.command(userSpaceship.rotateBy, -3, (1, 0, 0))
         elif key == K_q:
-            self.universe.userSpaceship.rotateBy(3, (0, 1, 0))
+            self.command(userSpaceship.rotateBy, 3, (0, 1, 0))
         elif key == K_e:
-            self.universe.userSpaceship.rotateBy(-3, (0, 1, 0))
+            self.command(userSpaceship.rotateBy, -3, (0, 1, 0))
         elif key == K_a:
-            self.universe.userSpaceship.rotateBy(3, (0, 0, 1))
+            self.command(userSpaceship.rotateBy, 3, (0, 0, 1))
         elif key == K_d:
-            self.universe.userSpaceship.rotateBy(-3, (0, 0, 1))
+            self.command(userSpaceship.rotateBy, -3, (0, 0, 1))
         elif key == K_j:
-            self.universe.userSpaceship.jump()
+            self.command(userSpaceship.jump)
+        elif key == K_RIGHTBRACKET:
+            self.command(self.universe.changeTimeWarp, 1)
+        elif key == K_LEFTBRACKET:
+            self.command(self.universe.changeTimeWarp, -1)
+
+
+    def handleReplayKeys(self, key):
+        # Watching a recording, the keys move us around in it instead of
+        # flying the spaceship
+        if key == K_SPACE:
+            self.replayPaused = not self.replayPaused
+        elif key == K_RIGHTBRACKET:
+            self.replaySpeed *= 2
+        elif key == K_LEFTBRACKET:
+            self.replaySpeed /= 2
+        elif key == K_r:
+            self.replaySpeed = -self.replaySpeed
+        elif key == K_RIGHT:
+            self.seekReplay(self.replayTime + 10 * max(1, abs(self.replaySpeed)))
+        elif key == K_LEFT:
+            self.seekReplay(self.replayTime - 10 * max(1, abs(self.replaySpeed)))
+        elif key == K_HOME:
+            self.seekReplay(self.replay.startTime)
+        elif key == K_END:
+            self.seekReplay(self.replay.endTime)
+
+
+    def seekReplay(self, simulatedTime):
+        self.replayTime = min(max(simulatedTime, self.replay.startTime), self.replay.endTime)
+        self.replay.apply(self.universe, self.replayTime)
+
+        status = "%ss of %ss, %gx" % (
+            locale.format("%.1f", self.replayTime - self.replay.startTime, True),
+            locale.format("%.1f", self.replay.endTime - self.replay.startTime, True),
+            self.replaySpeed,
+        )
+        if self.replayPaused:
+            status += ", paused"
+        lastEvent = self.replay.lastEvent(self.replayTime)
+        if lastEvent is not None:
+            status += " (%s)" % lastEvent[1]
+        self.dashboard.replayStatus = status
+
+
+    def advanceReplay(self, interval):
+        if self.replayPaused:
+            interval = 0
+        self.seekReplay(self.replayTime + interval * self.replaySpeed)
 
 
     def handleMousedown(self, event):
@@ -102,43 +220,88 @@ class UI(object):
             deltaX = nowX - thenX
             deltaY = nowY - thenY
 
-            glPushMatrix()
-            glLoadIdentity()
-            glRotatef(float(deltaX) / (360. / self.fovV), 0, 1, 0)
-            glRotatef(float(deltaY) / (360. / self.fovV), 1, 0, 0)
-            glMultMatrixf(self.cameraRotationMatrix)            
-            self.cameraRotationMatrix = glGetFloatv(GL_MODELVIEW_MATRIX)
-            glPopMatrix()
+            # The drag rotates about the screen's axes, so it goes on the
+            # outside of the existing camera rotation.
+            yaw = Quaternion.fromAxisAngle(float(deltaX) / (360. / self.fovV), (0, 1, 0))
+            pitch = Quaternion.fromAxisAngle(float(deltaY) / (360. / self.fovV), (1, 0, 0))
+            self.cameraOrientation = (yaw * pitch * self.cameraOrientation).normalised()
 
             self.dragLastEvent = nowX, nowY
 
 
-    def handleEvent(self):
-        event = pygame.event.poll()
-        if event.type == NOEVENT:
-            return
-        elif event.type == KEYDOWN:
-            self.handleKeys(event.key)
-        elif event.type == MOUSEBUTTONDOWN:
-            self.handleMousedown(event)
-        elif event.type == MOUSEBUTTONUP:
-            self.handleMouseup(event)
-        elif event.type == MOUSEMOTION:
-            self.handleMousemove(event)
-        elif event.type == QUIT:
-            self.done = True
+    def handleEvents(self):
+        # Everything that's come in since the last frame, so that nothing
+        # backs up behind a slow one
+        for event in pygame.event.get():
+            if event.type == KEYDOWN:
+                self.handleKeys(event.key)
+            elif event.type == MOUSEBUTTONDOWN:
+                self.handleMousedown(event)
+            elif event.type == MOUSEBUTTONUP:
+                self.handleMouseup(event)
+            elif event.type == MOUSEMOTION:
+                self.handleMousemove(event)
+            elif event.type == QUIT:
+                self.done = True
+
+
+    def applyQuality(self):
+        quality = self.scheduler.quality
+        meshCache.limbSegmentPixels = quality["limbSegmentPixels"]
+        self.dashboard.refreshInterval = quality["hudInterval"]
+        if self.orbitPredictor:
+            self.orbitPredictor.orbits = quality["predictionOrbits"]
 
 
     def draw(self):
+        with self.profiler.phase("textures"):
+            textureLoader.uploadPending()
+
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
         glLoadIdentity()
         self.resize(*self.resolution)
         
         glTranslatef(0, 0, -self.cameraDistance)
-        glMultMatrixf(self.cameraRotationMatrix)
+        glMultMatrixf(self.cameraOrientation.matrix())
         
-        self.universe.draw()
-        self.dashboard.draw(*self.resolution)
+        locations = None
+        if self.simulation:
+            locations = self.simulation.interpolatedLocations()
+        self.universe.draw(Camera(
+            self.fovV, self.resolution, self.cameraDistance, self.cameraOrientation,
+            self.minClipping, self.maxClipping
+        ), locations)
+        if self.orbitPredictor and self.showOrbit:
+            with self.profiler.phase("orbit"):
+                self.drawOrbit(locations)
+        self.dashboard.renderStats = self.universe.renderStats
+        with self.profiler.phase("dashboard"):
+            self.dashboard.draw(*self.resolution)
+
+
+    def drawOrbit(self, locations):
+        universe = self.universe
+        engine = universe.engine
+        userSpaceship = universe.userSpaceship
+        relativeTo = self.dashboard.relativeTo
+        count = len(universe.objects)
+
+        # Hand the predictor the newest state there is, in arrays that
+        # nothing else will write to.
+        if self.simulation:
+            latest = self.simulation.snapshots[1]
+            simulatedTime, currentLocations, velocities = latest.simulatedTime, latest.locations[:count], latest.velocities[:count]
+        else:
+            simulatedTime, currentLocations, velocities = engine.time, engine.locations[:count].copy(), engine.velocities[:count].copy()
+        self.orbitPredictor.update(
+            simulatedTime, engine.masses[:count].copy(), currentLocations, velocities,
+            userSpaceship.index, relativeTo.index,
+            userSpaceship.thrustAcceleration(), userSpaceship.trajectoryVersion
+        )
+
+        if locations is None:
+            locations = engine.locations
+        self.orbitPredictor.draw(locations[userSpaceship.index], locations[relativeTo.index])
 
 
     def main(self):
@@ -159,27 +322,117 @@ class UI(object):
 
             self.resize(*self.resolution)
             self.initGL()
-            self.universe = Universe()
+            scenario = self.scenario
+            if self.replayFile:
+                self.replay = Replay(self.replayFile)
+                self.replayTime = self.replay.startTime
+                scenario = scenario or self.replay.scenario
+            integrator = None
+            if self.kepler:
+                integrator = KeplerHybrid()
+            self.universe = Universe(integrator=integrator, scenario=scenario)
+            self.universe.profiler = self.profiler
+            self.profiler.keepEvents = bool(self.traceFile)
             self.dashboard = Dashboard(self.universe.userSpaceship)
             self.dashboard.relativeTo = self.universe.initialDashboardRelativeTo
+            self.dashboard.universe = self.universe
+            self.dashboard.scheduler = self.scheduler
+
+            if self.recordFile and not self.replay:
+                self.recorder = Recorder(self.recordFile, self.universe, self.recordCapacity)
+                self.universe.recorder = self.recorder
+
+            if self.telemetryAddress and not self.replay:
+                self.telemetry = TelemetryServer(
+                    parseAddress(self.telemetryAddress), [obj.name for obj in self.universe.objects], self.telemetryRate
+                )
+                self.telemetry.start()
+                self.universe.telemetry = self.telemetry
+
+            self.orbitPredictor = OrbitPredictor()
+            self.orbitPredictor.start()
+
+            if self.threadedPhysics and not self.replay:
+                self.simulation = SimulationThread(self.universe)
+                self.simulation.start()
+                self.dashboard.simulation = self.simulation
 
             frames = 0
             ticks = pygame.time.get_ticks()
             lastTicks = ticks
             while not self.done:
-                self.handleEvent()
+                if self.simulation:
+                    self.simulation.check()
+                self.scheduler.beginFrame()
+                self.profiler.beginFrame()
+                with self.profiler.phase("events"):
+                    self.handleEvents()
+                self.applyQuality()
                 self.draw()
                 currentTicks = pygame.time.get_ticks()
-                self.universe.accelerateAndMove(float(currentTicks - lastTicks) / 1000)
-                pygame.display.flip()
+                if self.replay:
+                    with self.profiler.phase("replay"):
+                        self.advanceReplay(float(currentTicks - lastTicks) / 1000)
+                elif not self.simulation:
+                    with self.profiler.phase("physics"):
+                        self.universe.accelerateAndMove(float(currentTicks - lastTicks) / 1000)
+                self.scheduler.workDone()
+                with self.profiler.phase("flip"):
+                    pygame.display.flip()
+                self.profiler.endFrame()
+                self.scheduler.endFrame()
                 frames += 1
                 lastTicks = currentTicks
 
             print "fps:  %d" % ((frames * 1000) / (pygame.time.get_ticks() - ticks))
+            print "frame times (p50/p95/p99): %.1f / %.1f / %.1fms" % tuple(
+                t * 1000 for t in self.profiler.framePercentiles()
+            )
+            if self.traceFile:
+                self.profiler.export(self.traceFile)
 
         finally:
+            if self.simulation:
+                self.simulation.stop()
+            if self.orbitPredictor:
+                self.orbitPredictor.stop()
+            if self.recorder:
+                self.recorder.close()
+            if self.telemetry:
+                self.telemetry.stop()
             pygame.quit()
 
 if __name__ == '__main__':
-    UI().main()
+    parser = OptionParser()
+    parser.add_option("--trace", default=None,
+                      help="write a per-phase frame trace to this file on exit: CSV if it ends .csv, otherwise Chrome trace JSON")
+    parser.add_option("--scenario", default=None,
+                      help="start from this scenario file instead of scenarios/default.json")
+    parser.add_option("--kepler", action="store_true", default=False,
+                      help="move coasting bodies along exact two-body orbits, which makes big time warps cheap")
+    parser.add_option("--record", default=None,
+                      help="record every tick and everything you do to this file, for --replay")
+    parser.add_option("--record-ticks", type="int", default=216000,
+                      help="how many of the most recent ticks to keep in the recording [default: %default]")
+    parser.add_option("--replay", default=None,
+                      help="watch a recording made with --record instead of running the simulation")
+    parser.add_option("--telemetry", default=None,
+                      help="stream every object's state to clients connecting to HOST:PORT, or a Unix socket at this path")
+    parser.add_option("--telemetry-rate", type="float", default=30.0,
+                      help="telemetry frames per second [default: %default]")
+    parser.add_option("--fps", type="int", default=60,
+                      help="frame rate to aim for, or 0 to draw as fast as possible [default: %default]")
+    options, _ = parser.parse_args(sys.argv[1:])
+
+    ui = UI()
+    ui.traceFile = options.trace
+    ui.scenario = options.scenario
+    ui.kepler = options.kepler
+    ui.recordFile = options.record
+    ui.recordCapacity = options.record_ticks
+    ui.replayFile = options.replay
+    ui.telemetryAddress = options.telemetry
+    ui.telemetryRate = options.telemetry_rate
+    ui.scheduler.targetFps = options.fps
+    ui.main()
 
@@ -0,0 +1,71 @@
+import os
+
+# Nothing here is ever drawn, so don't even load OpenGL; see Graphics.
+os.environ.setdefault("EXPLORER_HEADLESS", "1")
+
+import json
+import sys
+import time
+from optparse import OptionParser
+
+from BarnesHutGravity import BarnesHutGravity
+from Integrators import AdaptiveRungeKutta, Leapfrog, RungeKutta4
+from Kepler import KeplerHybrid
+from Universe import Universe
+
+
+INTEGRATORS = {
+    "leapfrog": Leapfrog,
+    "rk4": RungeKutta4,
+    "adaptive": AdaptiveRungeKutta,
+    "kepler": KeplerHybrid,
+}
+
+
+def parseArguments(arguments):
+    parser = OptionParser(usage="%prog [options] SECONDS")
+    parser.description = "Run the universe with no display for SECONDS of simulated time, as fast as possible, and dump the final state as JSON."
+    parser.add_option("--integrator", choices=sorted(INTEGRATORS), default="leapfrog",
+                      help="one of %s [default: %%default]" % ", ".join(sorted(INTEGRATORS)))
+    parser.add_option("--step", type="float", default=1.0,
+                      help="integrator step in simulated seconds [default: %default]")
+    parser.add_option("--theta", type="float", default=None,
+                      help="use Barnes-Hut gravity with this opening angle instead of the exact sum")
+    parser.add_option("--scenario", default=None,
+                      help="start from this scenario file instead of scenarios/default.json")
+    parser.add_option("--output", default=None,
+                      help="file to write the final state to [default: stdout]")
+    options, positional = parser.parse_args(arguments)
+    if len(positional) != 1:
+        parser.error("expected the number of seconds to simulate")
+    return options, float(positional[0])
+
+
+def main(arguments):
+    options, duration = parseArguments(arguments)
+
+    gravitySolver = None
+    if options.theta is not None:
+        gravitySolver = BarnesHutGravity(options.theta)
+    universe = Universe(
+        gravitySolver, INTEGRATORS[options.integrator](options.step), scenario=options.scenario, headless=True
+    )
+
+    started = time.time()
+    universe.accelerateAndMove(duration, exact=True)
+    elapsed = time.time() - started
+
+    state = json.dumps(universe.dumpState(), indent=2)
+    if options.output:
+        with open(options.output, "w") as output:
+            output.write(state)
+    else:
+        print state
+
+    sys.stderr.write("simulated %.1fs in %.2fs (%.0fx real time)\n" % (
+        universe.engine.time, elapsed, universe.engine.time / max(elapsed, 1e-9)
+    ))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,96 @@
+import os
+
+# Each run is one process; stop numerical libraries starting threads of
+# their own on top, which only gets in the way.
+for variable in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+    os.environ.setdefault(variable, "1")
+# ...and nothing is ever drawn, so don't even load OpenGL; see Graphics.
+os.environ.setdefault("EXPLORER_HEADLESS", "1")
+
+import csv
+import json
+import sys
+import time
+from optparse import OptionParser
+
+from Ensemble import Ensemble
+from simulate import INTEGRATORS
+from Universe import Universe
+
+
+COLUMNS = (
+    "closestApproach", "closestApproachTime", "deltaV", "periapsisAltitude", "apoapsisAltitude",
+    "eccentricity", "inclination", "period", "finalDistance", "finalSpeed", "simulatedSeconds", "seconds",
+)
+
+
+def parseArguments(arguments):
+    parser = OptionParser(usage="%prog [options] GRID")
+    parser.description = (
+        "Run every combination of the parameters in the JSON file GRID against a scenario, "
+        "in parallel, and write a table of how each one turned out.  GRID looks like "
+        '{"UserSpaceship.location[2]": [6711, 7000], "burns": [[], [{"start": 600, "duration": 20, '
+        '"thrust": 0.01, "direction": "prograde"}]]}.'
+    )
+    parser.add_option("--scenario", default=Universe.defaultScenario,
+                      help="scenario to vary [default: scenarios/default.json]")
+    parser.add_option("--duration", type="float", default=86400.0,
+                      help="simulated seconds for each run [default: %default]")
+    parser.add_option("--integrator", choices=sorted(INTEGRATORS), default="kepler",
+                      help="one of %s [default: %%default]" % ", ".join(sorted(INTEGRATORS)))
+    parser.add_option("--step", type="float", default=1.0,
+                      help="integrator step in simulated seconds [default: %default]")
+    parser.add_option("--theta", type="float", default=None,
+                      help="use Barnes-Hut gravity with this opening angle instead of the exact sum")
+    parser.add_option("--target", default=None,
+                      help="body to report the ship's closest approach to, e.g. \"Space Station\"")
+    parser.add_option("--relative-to", default=None,
+                      help="body to report the final orbit around [default: the scenario's dashboard body]")
+    parser.add_option("--processes", type="int", default=None,
+                      help="worker processes [default: one per core]")
+    parser.add_option("--output", default=None,
+                      help="file to write the CSV table to [default: stdout]")
+    options, positional = parser.parse_args(arguments)
+    if len(positional) != 1:
+        parser.error("expected a grid file")
+    return options, positional[0]
+
+
+def main(arguments):
+    options, gridFile = parseArguments(arguments)
+    with open(gridFile) as grid:
+        parameters = json.load(grid)
+
+    ensemble = Ensemble(
+        options.scenario, parameters, options.duration, options.integrator, options.step, options.theta,
+        options.target, options.relative_to,
+    )
+    variants = ensemble.variants()
+    started = time.time()
+    results = ensemble.run(options.processes)
+    elapsed = time.time() - started
+
+    parameterNames = sorted(parameters)
+    output = open(options.output, "wb") if options.output else sys.stdout
+    try:
+        writer = csv.writer(output)
+        columns = [column for column in COLUMNS if column in results[0]] if results else []
+        writer.writerow(["variant"] + parameterNames + columns)
+        for variant, result in zip(variants, results):
+            writer.writerow(
+                [result["variant"]] +
+                [json.dumps(variant[name]) if isinstance(variant[name], (list, dict)) else variant[name]
+                 for name in parameterNames] +
+                [result[column] for column in columns]
+            )
+    finally:
+        if options.output:
+            output.close()
+
+    sys.stderr.write("%d runs in %.1fs (%.1fs of simulation each on average)\n" % (
+        len(results), elapsed, sum(result["seconds"] for result in results) / max(len(results), 1)
+    ))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
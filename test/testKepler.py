@@ -0,0 +1,92 @@
+import math
+import unittest
+
+import numpy
+
+from Integrators import Leapfrog
+from Kepler import KeplerHybrid
+from PhysicsEngine import PhysicsEngine
+from WorldObject import G, WorldObject
+
+
+# A planet with a moon a tenth of its mass, far enough apart and heavy
+# enough that the planet's own wobble around their centre of mass is
+# thousands of km, on an eccentric orbit, with the pair drifting along
+# at 1 km/s.
+PRIMARY_MASS = 6e24
+SECONDARY_MASS = 6e23
+SEPARATION = 50000.0
+DRIFT = numpy.array((1.0, 0.0, 0.0))
+
+
+def _pair():
+    mu = G * (PRIMARY_MASS + SECONDARY_MASS) / 1e9
+    relativeVelocity = numpy.array((0.0, 1.1 * math.sqrt(mu / SEPARATION), 0.0))
+    secondaryShare = SECONDARY_MASS / (PRIMARY_MASS + SECONDARY_MASS)
+    objects = [
+        WorldObject(PRIMARY_MASS, (-secondaryShare * SEPARATION, 0, 0),
+                    DRIFT - secondaryShare * relativeVelocity),
+        WorldObject(SECONDARY_MASS, ((1 - secondaryShare) * SEPARATION, 0, 0),
+                    DRIFT + (1 - secondaryShare) * relativeVelocity),
+    ]
+    semiMajorAxis = 1 / (2 / SEPARATION - relativeVelocity.dot(relativeVelocity) / mu)
+    return objects, 2 * math.pi * math.sqrt(semiMajorAxis ** 3 / mu)
+
+
+def _energy(engine):
+    # In J, as in benchmark.py
+    kinetic = 0.5 * (engine.masses[:, numpy.newaxis] * (engine.velocities * 1000) ** 2).sum()
+    distance = numpy.linalg.norm(engine.locations[1] - engine.locations[0]) * 1000
+    return kinetic - G * engine.masses[0] * engine.masses[1] / distance
+
+
+class KeplerHybridTest(unittest.TestCase):
+
+    # Both bodies go on rails, so KeplerHybrid moves them in closed form;
+    # a fine Leapfrog has to agree with it.  The primary has nothing to
+    # orbit, so this is all down to its reflex motion around the centre
+    # of mass.
+
+    # Leapfrog steps per orbit, and how close it then has to come to the
+    # exact answer: position as a fraction of the separation, and energy
+    # as a fraction of the starting energy.
+    leapfrogSteps = 20000
+    positionTolerance = 1e-5
+    energyTolerance = 1e-6
+
+    def propagate(self, integrator, period, parts=4):
+        objects, _ = _pair()
+        engine = PhysicsEngine(objects, integrator=integrator)
+        initialEnergy = _energy(engine)
+        states = []
+        for _ in range(parts):
+            engine.accelerateAndMove(period / parts, exact=True)
+            states.append((engine.locations.copy(), engine.velocities.copy(), _energy(engine)))
+        return engine, initialEnergy, states
+
+
+    def testAgreesWithLeapfrogOverAnOrbit(self):
+        objects, period = _pair()
+        start = numpy.array([obj.location for obj in objects])
+        kepler, initialEnergy, keplerStates = self.propagate(KeplerHybrid(60.0), period)
+        self.assertTrue(kepler.integrator.onRails[1])
+        self.assertEqual(kepler.integrator.primaries[0], -1)
+        _, _, leapfrogStates = self.propagate(Leapfrog(period / self.leapfrogSteps), period)
+
+        for (keplerLocations, _, keplerEnergy), (leapfrogLocations, _, leapfrogEnergy) in zip(
+                keplerStates, leapfrogStates):
+            error = numpy.linalg.norm(keplerLocations - leapfrogLocations, axis=1).max()
+            self.assertTrue(error < self.positionTolerance * SEPARATION, "%g km apart" % error)
+            self.assertTrue(abs(keplerEnergy / initialEnergy - 1) < 1e-12)
+            self.assertTrue(abs(leapfrogEnergy / initialEnergy - 1) < self.energyTolerance)
+
+        # After exactly one orbit, both bodies are back where they started,
+        # carried along by the drift
+        keplerLocations, keplerVelocities, _ = keplerStates[-1]
+        expected = start + period * DRIFT
+        self.assertTrue(numpy.allclose(keplerLocations, expected, rtol=0, atol=1e-6 * SEPARATION))
+        self.assertTrue(numpy.allclose(keplerVelocities, [obj.velocity for obj in _pair()[0]], rtol=0, atol=1e-9))
+
+
+if __name__ == "__main__":
+    unittest.main()
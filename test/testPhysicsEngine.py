@@ -0,0 +1,104 @@
+import math
+import random
+import unittest
+
+import numpy
+
+from DirectGravity import DirectGravity
+from PhysicsEngine import PhysicsEngine
+from WorldObject import G, WorldObject
+
+
+def _scene(seed=1, extras=300):
+    # The Sun, the Earth, a spaceship in low Earth orbit, and a swarm of
+    # lumps of all sizes around the Earth, close enough to matter to one
+    # another; enough of them to take more than one block
+    generator = random.Random(seed)
+    earth = (79262956, -128906582, -13927363)
+    objects = [
+        WorldObject(1.9891e30, (0, 0, 0), (0, 0, 0)),
+        WorldObject(5.9736e24, earth, (24.85, 15.34, 2.499)),
+        WorldObject(20000, (earth[0], earth[1], earth[2] + 6711), (17.12, 15.34, 2.499)),
+    ]
+    for _ in range(extras):
+        location = tuple(component + generator.uniform(-1e6, 1e6) for component in earth)
+        velocity = tuple(generator.uniform(-10, 10) for _ in range(3))
+        objects.append(WorldObject(10 ** generator.uniform(12, 22), location, velocity))
+    return objects
+
+
+def _perObjectAcceleration(obj, objects, sources):
+    # The sum as the universe used to do it, one pair at a time, over the
+    # bodies whose gravity counts
+    aX, aY, aZ = 0, 0, 0
+    for attractiveObject in objects:
+        if attractiveObject is obj or attractiveObject.index not in sources:
+            continue
+        # In meters, for compatibility with G
+        dX, dY, dZ = [(mine - theirs) * 1000 for mine, theirs in zip(obj.location, attractiveObject.location)]
+        distanceSquared = dX ** 2 + dY ** 2 + dZ ** 2
+        scalarAcceleration = -(G * attractiveObject.mass) / distanceSquared
+        distance = math.sqrt(distanceSquared)
+        aX += scalarAcceleration * dX / distance
+        aY += scalarAcceleration * dY / distance
+        aZ += scalarAcceleration * dZ / distance
+    return aX / 1000, aY / 1000, aZ / 1000
+
+
+class PhysicsEngineTest(unittest.TestCase):
+
+    # The engine's vectorised gravity has to agree with adding up the
+    # pull of every source on every body one at a time.
+
+    def assertMatchesPerObjectSum(self, objects, engine):
+        accelerations = engine.calculateGravity()
+        sources = set(engine.sources())
+        for obj in objects:
+            expected = numpy.array(_perObjectAcceleration(obj, objects, sources))
+            self.assertTrue(
+                numpy.allclose(accelerations[obj.index], expected, rtol=1e-10, atol=0),
+                "%r for body %d, expected %r" % (accelerations[obj.index], obj.index, expected)
+            )
+
+
+    def testMatchesPerObjectSum(self):
+        objects = _scene()
+        engine = PhysicsEngine(objects)
+        # Far too light to pull on anything
+        self.assertNotIn(objects[2].index, engine.sources())
+        self.assertMatchesPerObjectSum(objects, engine)
+
+
+    def testMatchesPerObjectSumInSmallBlocks(self):
+        objects = _scene(extras=40)
+        gravity = DirectGravity()
+        gravity.blockSize = 7
+        self.assertMatchesPerObjectSum(objects, PhysicsEngine(objects, gravity))
+
+
+    def testMatchesPerObjectSumWithTestParticles(self):
+        objects = _scene()
+        massless = objects[3::2]
+        for obj in massless:
+            obj.massless = True
+        objects[2].massless = False
+        engine = PhysicsEngine(objects)
+        sources = set(engine.sources())
+        self.assertFalse(sources & set(obj.index for obj in massless))
+        self.assertIn(objects[2].index, sources)
+        self.assertMatchesPerObjectSum(objects, engine)
+
+
+    def testMovedBodies(self):
+        # Objects are views onto the engine's arrays, both ways
+        objects = _scene()
+        engine = PhysicsEngine(objects)
+        engine.calculateGravity()
+        for obj in objects[3::7]:
+            x, y, z = obj.location
+            obj.location = x + 1000, y, z - 1000
+        self.assertMatchesPerObjectSum(objects, engine)
+
+
+if __name__ == "__main__":
+    unittest.main()
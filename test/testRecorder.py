@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from Recorder import Recorder, Replay
+from Universe import Universe
+
+
+class ReplayTest(unittest.TestCase):
+
+    # A ring of ten records, with tick t at simulated time t and the ship
+    # moving along x at 10 km/s, so x = 10 t.
+
+    capacity = 10
+
+    def setUp(self):
+        self.universe = Universe(headless=True)
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "recording")
+        self.recorder = Recorder(self.path, self.universe, self.capacity)
+
+
+    def tearDown(self):
+        self.recorder.close()
+        shutil.rmtree(self.directory)
+
+
+    def record(self, ticks):
+        engine = self.universe.engine
+        ship = self.universe.userSpaceship
+        engine.locations[:] = 0
+        engine.velocities[:] = 0
+        engine.velocities[ship.index] = 10, 0, 0
+        for tick in range(ticks):
+            engine.time = float(tick)
+            engine.locations[ship.index] = 10 * tick, 0, 0
+            self.recorder.record(self.universe)
+        self.recorder.records.flush()
+        self.recorder.header.flush()
+        return Replay(self.path)
+
+
+    def testWrapped(self):
+        # 23 ticks: the ring holds 13 to 22, with 13 to 19 at the end of the
+        # file and 20 to 22 wrapped round to the start.
+        replay = self.record(23)
+        self.assertEqual(len(replay), 10)
+        self.assertEqual([segment["time"].tolist() for segment in replay.segments],
+                         [[13, 14, 15, 16, 17, 18, 19], [20, 21, 22]])
+        self.assertEqual((replay.startTime, replay.endTime), (13, 22))
+        for index in range(len(replay)):
+            self.assertEqual(replay._record(index)["time"], 13 + index)
+
+        self.assertEqual(replay.find(12.5), -1)
+        self.assertEqual(replay.find(13), 0)
+        # Either side of the wrap point
+        self.assertEqual(replay.find(19), 6)
+        self.assertEqual(replay.find(19.5), 6)
+        self.assertEqual(replay.find(20), 7)
+        self.assertEqual(replay.find(20.5), 7)
+        self.assertEqual(replay.find(22), 9)
+        self.assertEqual(replay.find(100), 9)
+
+        # Interpolating between the last record before the wrap and the
+        # first after it
+        ship = self.universe.userSpaceship.index
+        for simulatedTime in (18.5, 19, 19.25, 19.75, 20, 20.5):
+            locations, velocities, _, _ = replay.stateAt(simulatedTime)
+            self.assertAlmostEqual(locations[ship][0], 10 * simulatedTime)
+            self.assertAlmostEqual(velocities[ship][0], 10)
+        # ...and clamped at the ends
+        self.assertAlmostEqual(replay.stateAt(0)[0][ship][0], 130)
+        self.assertAlmostEqual(replay.stateAt(30)[0][ship][0], 220)
+
+
+    def testExactlyFull(self):
+        replay = self.record(10)
+        self.assertEqual([len(segment) for segment in replay.segments], [10, 0])
+        self.assertEqual((replay.startTime, replay.endTime), (0, 9))
+        self.assertEqual(replay.find(9), 9)
+        self.assertEqual(replay.find(8.5), 8)
+
+
+    def testNotFull(self):
+        replay = self.record(4)
+        self.assertEqual(len(replay), 4)
+        self.assertEqual(replay.segments[0]["time"].tolist(), [0, 1, 2, 3])
+        self.assertEqual(replay.find(-1), -1)
+        self.assertEqual(replay.find(2.5), 2)
+        self.assertEqual(replay.find(10), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
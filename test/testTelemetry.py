@@ -0,0 +1,155 @@
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+import numpy
+
+from Telemetry import DELTA, FULL, HELLO, TelemetryClient, TelemetryServer, applyDelta
+from Universe import Universe
+
+
+def _waitFor(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.005)
+
+
+class TelemetryTest(unittest.TestCase):
+
+    # A real server and client over loopback, with the universe ticking
+    # along in between, and a publish for every tick.
+
+    def setUp(self):
+        self.universe = Universe(headless=True)
+        self.directory = tempfile.mkdtemp()
+        self.server = None
+        self.client = None
+        # Sequence numbers as the client got them, in follow
+        self.received = []
+
+
+    def tearDown(self):
+        if self.client is not None:
+            self.client.close()
+        if self.server is not None:
+            self.server.stop()
+        shutil.rmtree(self.directory)
+
+
+    def connect(self, address, **options):
+        names = [obj.name for obj in self.universe.objects]
+        self.server = TelemetryServer(address, names, rate=1e6, **options)
+        self.server.start()
+        self.client = TelemetryClient(self.server.boundAddress, timeout=5)
+        _waitFor(lambda: self.server.clients())
+
+
+    def tick(self, count=1):
+        ship = self.universe.userSpaceship
+        for _ in range(count):
+            ship.rotateBy(1, (0, 1, 0))
+            self.universe.accelerateAndMove(1 / 60.)
+            self.server.publish(self.universe)
+
+
+    def assertSameState(self, state):
+        expected = self.server.state
+        for field in expected.dtype.names:
+            self.assertTrue(numpy.array_equal(state[field], expected[field]), field)
+        # ...which is the universe's, to within float32 rounding of a tick
+        engine = self.universe.engine
+        self.assertTrue(numpy.allclose(state["location"], engine.locations, rtol=0, atol=1e-4))
+        self.assertTrue(numpy.allclose(state["velocity"], engine.velocities, rtol=0, atol=1e-6))
+
+
+    def testSnapshotThenDeltas(self):
+        self.connect(("127.0.0.1", 0))
+        self.universe.userSpaceship.thrust = 0.01
+        self.tick(20)
+
+        kind, sequence, simulatedTime, payload = self.client.readFrame()
+        self.assertEqual(kind, HELLO)
+        kind, sequence, simulatedTime, payload = self.client.readFrame()
+        self.assertEqual((kind, sequence), (FULL, 1))
+        state = numpy.frombuffer(payload, dtype=self.server.state.dtype).copy()
+        for expected in range(2, 21):
+            kind, sequence, simulatedTime, payload = self.client.readFrame()
+            self.assertEqual((kind, sequence), (DELTA, expected))
+            applyDelta(state, payload)
+        self.assertEqual(simulatedTime, self.universe.engine.time)
+        self.assertSameState(state)
+
+
+    def testUpdate(self):
+        self.connect(("127.0.0.1", 0))
+        self.tick(5)
+        while self.client.sequence != self.server.sequence:
+            self.client.update()
+        self.assertEqual(self.client.skipped, 0)
+        self.assertEqual(self.client.time, self.universe.engine.time)
+        self.assertSameState(self.client.state)
+        ship = self.client.byName(self.universe.userSpaceship.name)
+        self.assertEqual(tuple(ship["location"]), self.universe.userSpaceship.location)
+
+
+    def testSlowClientResynchronises(self):
+        # Over a Unix socket with a small send buffer, a client that isn't
+        # reading soon fills the server's buffer for it, and then has frames
+        # dropped until there's room again for a FULL one.
+        self.connect(os.path.join(self.directory, "telemetry"), maxBuffered=4096)
+        connection = self.server.clients()[0]
+        connection.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+        self.universe.userSpaceship.thrust = 0.01
+        for _ in range(50):
+            self.tick(20)
+            time.sleep(0.001)
+        _waitFor(lambda: not self.server.frames)
+        self.assertTrue(connection.dropped > 0)
+
+        # Now it keeps up, and as soon as there's room it's sent a FULL
+        # frame to start again from
+        reader = threading.Thread(target=self.follow)
+        reader.daemon = True
+        reader.start()
+        self.tickUntil(self.caughtUp)
+        self.assertTrue(numpy.diff(self.received).max() > 1)
+        self.assertSameState(self.client.state)
+
+        # ...and then carries on with deltas
+        caughtUp = len(self.received)
+        self.tick(3)
+        _waitFor(self.caughtUp)
+        self.assertEqual(numpy.diff(self.received[caughtUp - 1:]).tolist(), [1, 1, 1])
+        self.assertEqual(self.client.skipped, 0)
+        self.assertSameState(self.client.state)
+
+
+    def follow(self):
+        try:
+            while True:
+                self.received.append(self.client.update())
+        except (EOFError, socket.error):
+            pass
+
+
+    def caughtUp(self):
+        return bool(self.received) and self.received[-1] == self.server.sequence
+
+
+    def tickUntil(self, condition, timeout=5.0):
+        deadline = time.time() + timeout
+        while not condition():
+            if time.time() > deadline:
+                raise AssertionError("timed out")
+            self.tick()
+            time.sleep(0.002)
+
+
+if __name__ == "__main__":
+    unittest.main()